@@ -0,0 +1,4 @@
+import sys
+import os.path as path
+# prepend parent directory to sys.path
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark hot paths of RBM and DBM models on synthetic data
+and write results as JSON, to compare across versions.
+
+Measured quantities:
+* `rbm_fit`: samples/sec of `BaseRBM.fit` per layer type and `n_gibbs_steps`;
+* `dbm_fit`: iterations/sec of `DBM.fit` vs `max_mf_updates` and `n_particles`;
+* `rbm_transform`, `dbm_transform`: latency of `transform` for several batch sizes;
+* `dbm_log_Z`: time of AIS per intermediate distribution (beta);
+* `rbm_load`, `dbm_load`: cold model-load time (`load_model` + first `transform`);
+* `import`: cold import time of `boltzmann_machines.rbm` (excluding TensorFlow),
+  in a fresh interpreter.
+
+Throughput of `fit` is measured in keep-alive mode after a warm-up epoch,
+hence it does not include graph construction, but does include the
+final checkpoint write. Each measurement is repeated `--repeat` times
+and the best one is reported (all of them are stored as well).
+"""
+print __doc__
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+
+import env
+from boltzmann_machines import DBM
+from boltzmann_machines.rbm import BernoulliRBM, MultinomialRBM, GaussianRBM
+from boltzmann_machines.utils import RNG, Stopwatch
+
+
+RBM_CLASSES = {
+    'bernoulli': BernoulliRBM,
+    'multinomial': MultinomialRBM,
+    'gaussian': GaussianRBM,
+}
+
+
+def make_data(n_samples, n_features, layer='bernoulli', random_seed=1337):
+    rng = RNG(seed=random_seed)
+    if layer == 'gaussian':
+        return rng.randn(n_samples, n_features)
+    return (rng.rand(n_samples, n_features) > 0.5).astype(np.float64)
+
+def make_tf_session_config(args):
+    import tensorflow as tf
+    return tf.ConfigProto(intra_op_parallelism_threads=args.n_threads,
+                          inter_op_parallelism_threads=args.n_threads)
+
+def best_of(f, n_repeat):
+    """Run `f` `n_repeat` times and return (min, all) of the returned values."""
+    values = [f() for _ in xrange(n_repeat)]
+    return min(values), values
+
+def timeit(f):
+    with Stopwatch() as s:
+        f()
+    return s.elapsed()
+
+
+class Benchmarks(object):
+    def __init__(self, args):
+        self.args = args
+        self.results = []
+        self.dirpath = tempfile.mkdtemp(prefix='bm_benchmarks_')
+        self._n_models = 0
+
+    def model_path(self, name):
+        self._n_models += 1
+        return os.path.join(self.dirpath, '{0}_{1}/'.format(name, self._n_models))
+
+    def add(self, name, params, value, unit, values=None):
+        result = dict(name=name, params=params, value=value, unit=unit)
+        if values is not None:
+            result['values'] = values
+        self.results.append(result)
+        params_s = ', '.join('{0}={1}'.format(k, v) for k, v in sorted(params.items()))
+        print "{0:<16} {1:<48} {2:>12.4g} {3}".format(name, params_s, value, unit)
+
+    def make_rbm(self, layer, n_visible, n_hidden, **kwargs):
+        return RBM_CLASSES[layer](n_visible=n_visible, n_hidden=n_hidden,
+                                  batch_size=self.args.batch_size,
+                                  verbose=False, save_after_each_epoch=False,
+                                  random_seed=self.args.random_seed, dtype=self.args.dtype,
+                                  tf_session_config=make_tf_session_config(self.args),
+                                  model_path=self.model_path('rbm_' + layer), **kwargs)
+
+    def make_dbm(self, max_mf_updates=None, n_particles=None):
+        args = self.args
+        rbms = []
+        n_visible = args.n_visible
+        for i, n_hidden in enumerate(args.n_hiddens):
+            rbm = self.make_rbm('bernoulli', n_visible, n_hidden,
+                                dbm_first=(i == 0), dbm_last=(i == len(args.n_hiddens) - 1))
+            rbm.init()
+            rbms.append(rbm)
+            n_visible = n_hidden
+        return DBM(rbms=rbms,
+                   n_particles=n_particles or args.n_particles[0],
+                   n_gibbs_steps=args.dbm_n_gibbs_steps,
+                   max_mf_updates=max_mf_updates or args.max_mf_updates[0],
+                   mf_tol=args.mf_tol,
+                   batch_size=args.batch_size,
+                   verbose=False, save_after_each_epoch=False,
+                   random_seed=args.random_seed, dtype=args.dtype,
+                   tf_session_config=make_tf_session_config(args),
+                   model_path=self.model_path('dbm'))
+
+    def fit_time(self, model, X):
+        """Time of `fit` for `n_epochs` after a warm-up epoch."""
+        with model:
+            model.max_epoch = 1
+            model.fit(X)
+            def f():
+                model.max_epoch += self.args.n_epochs
+                return timeit(lambda: model.fit(X))
+            return best_of(f, self.args.repeat)
+
+    def bench_rbm_fit(self):
+        args = self.args
+        for layer in args.layers:
+            X = make_data(args.n_samples, args.n_visible, layer=layer)
+            for n_gibbs_steps in args.n_gibbs_steps:
+                rbm = self.make_rbm(layer, args.n_visible, args.n_hidden,
+                                    n_gibbs_steps=n_gibbs_steps)
+                t, ts = self.fit_time(rbm, X)
+                n = args.n_epochs * len(X)
+                self.add('rbm_fit', dict(layer=layer, n_gibbs_steps=n_gibbs_steps),
+                         n / t, 'samples/sec', values=[n / t_ for t_ in ts])
+
+    def bench_dbm_fit(self):
+        args = self.args
+        X = make_data(args.n_samples, args.n_visible)
+        n_batches = (len(X) + args.batch_size - 1) // args.batch_size
+        for max_mf_updates in args.max_mf_updates:
+            for n_particles in args.n_particles:
+                dbm = self.make_dbm(max_mf_updates=max_mf_updates, n_particles=n_particles)
+                t, ts = self.fit_time(dbm, X)
+                n = args.n_epochs * n_batches
+                self.add('dbm_fit', dict(max_mf_updates=max_mf_updates, n_particles=n_particles),
+                         n / t, 'iters/sec', values=[n / t_ for t_ in ts])
+
+    def transform_latency(self, name, model, set_batch_size):
+        X = make_data(max(self.args.transform_batch_sizes), self.args.n_visible)
+        with model:
+            for batch_size in self.args.transform_batch_sizes:
+                set_batch_size(batch_size)
+                X_b = X[:batch_size]
+                model.transform(X_b)  # warm-up
+                t, ts = best_of(lambda: timeit(lambda: model.transform(X_b)), self.args.repeat)
+                self.add(name, dict(batch_size=batch_size), 1e3 * t, 'ms',
+                         values=[1e3 * t_ for t_ in ts])
+
+    def bench_transform(self):
+        args = self.args
+        rbm = self.make_rbm('bernoulli', args.n_visible, args.n_hidden)
+        rbm.init()
+        self.transform_latency('rbm_transform', rbm,
+                               lambda batch_size: setattr(rbm, 'batch_size', batch_size))
+        dbm = self.make_dbm()
+        dbm.init()
+        self.transform_latency('dbm_transform', dbm,
+                               lambda batch_size: setattr(dbm, 'batch_size', batch_size))
+
+    def bench_log_Z(self):
+        args = self.args
+        if len(args.n_hiddens) != 2:
+            print "dbm_log_Z: skipped (AIS is implemented only for 2-layer DBM)"
+            return
+        dbm = self.make_dbm()
+        dbm.init()
+        with dbm:
+            for n_betas in args.n_betas:
+                t, ts = best_of(lambda: timeit(lambda: dbm.log_Z(n_betas=n_betas,
+                                                                 n_runs=args.n_ais_runs,
+                                                                 n_gibbs_steps=1)),
+                                args.repeat)
+                self.add('dbm_log_Z', dict(n_betas=n_betas, n_runs=args.n_ais_runs),
+                         1e3 * t / n_betas, 'ms/beta', values=[1e3 * t_ / n_betas for t_ in ts])
+
+    def bench_load(self):
+        X_b = make_data(1, self.args.n_visible)
+        for name, model in (('rbm_load', self.make_rbm('bernoulli', self.args.n_visible, self.args.n_hidden)),
+                            ('dbm_load', self.make_dbm())):
+            model.init()
+            model_path = model._model_dirpath
+            cls = model.__class__
+            t, ts = best_of(lambda: timeit(lambda: cls.load_model(model_path).transform(X_b)),
+                            self.args.repeat)
+            self.add(name, {}, 1e3 * t, 'ms', values=[1e3 * t_ for t_ in ts])
+
+    def bench_import(self):
+        # run in a fresh interpreter so that modules
+        # already imported here do not affect the result
+        script = ('import time, tensorflow\n'
+                  't = time.time()\n'
+                  'import boltzmann_machines.rbm\n'
+                  'print time.time() - t\n')
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        def f():
+            out = subprocess.check_output([sys.executable, '-c', script], env=env)
+            return float(out.strip().splitlines()[-1])
+        t, ts = best_of(f, self.args.repeat)
+        self.add('import', {}, 1e3 * t, 'ms', values=[1e3 * t_ for t_ in ts])
+
+    def cleanup(self):
+        shutil.rmtree(self.dirpath, ignore_errors=True)
+
+
+def get_git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def get_meta(args):
+    import tensorflow as tf
+    return dict(time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                git_revision=get_git_revision(),
+                python=sys.version.split()[0],
+                numpy=np.__version__,
+                tensorflow=tf.__version__,
+                platform=platform.platform(),
+                processor=platform.processor(),
+                config=vars(args))
+
+
+BENCHMARKS = ('rbm_fit', 'dbm_fit', 'transform', 'log_Z', 'load', 'import')
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    # general
+    parser.add_argument('--gpu', type=str, default='', metavar='ID',
+                        help="ID of the GPU to run on (or '' to run on CPU)")
+    parser.add_argument('--benchmarks', type=str, default=BENCHMARKS, metavar='NAME', nargs='+',
+                        choices=BENCHMARKS, help='benchmarks to run')
+    parser.add_argument('--output', type=str, default='benchmarks.json', metavar='FILEPATH',
+                        help='where to write results (JSON)')
+    parser.add_argument('--repeat', type=int, default=3, metavar='N',
+                        help='number of repetitions of each measurement')
+    parser.add_argument('--n-threads', type=int, default=0, metavar='N',
+                        help='number of TF intra- and inter-op threads (0 = TF default)')
+    parser.add_argument('--random-seed', type=int, default=1337, metavar='N',
+                        help='random seed for data and models')
+    parser.add_argument('--dtype', type=str, default='float32', metavar='T',
+                        help='datatype precision to use')
+
+    # data and models shapes
+    parser.add_argument('--n-samples', type=int, default=2000, metavar='N',
+                        help='number of synthetic training examples')
+    parser.add_argument('--n-visible', type=int, default=784, metavar='N',
+                        help='number of visible units')
+    parser.add_argument('--n-hidden', type=int, default=512, metavar='N',
+                        help='number of hidden units of RBM')
+    parser.add_argument('--n-hiddens', type=int, default=(512, 1024), metavar='N', nargs='+',
+                        help='number of hidden units in each layer of DBM')
+    parser.add_argument('--batch-size', type=int, default=100, metavar='B',
+                        help='input batch size for training')
+    parser.add_argument('--n-epochs', type=int, default=1, metavar='N',
+                        help='number of timed epochs (after one warm-up epoch)')
+
+    # RBM related
+    parser.add_argument('--layers', type=str, default=sorted(RBM_CLASSES), metavar='L', nargs='+',
+                        choices=sorted(RBM_CLASSES), help='types of RBM to benchmark')
+    parser.add_argument('--n-gibbs-steps', type=int, default=(1, 5), metavar='N', nargs='+',
+                        help='numbers of Gibbs steps for RBM')
+
+    # DBM related
+    parser.add_argument('--max-mf-updates', type=int, default=(10, 50), metavar='N', nargs='+',
+                        help='maximum numbers of mean-field updates')
+    parser.add_argument('--mf-tol', type=float, default=0., metavar='TOL',
+                        help='mean-field tolerance (0 = always run `max_mf_updates` updates)')
+    parser.add_argument('--n-particles', type=int, default=(100, 500), metavar='N', nargs='+',
+                        help='numbers of persistent particles')
+    parser.add_argument('--dbm-n-gibbs-steps', type=int, default=5, metavar='N',
+                        help='number of Gibbs steps for DBM')
+
+    # inference related
+    parser.add_argument('--transform-batch-sizes', type=int, default=(1, 10, 100, 1000),
+                        metavar='B', nargs='+', help='batch sizes for transform latency')
+    parser.add_argument('--n-betas', type=int, default=(100, 1000), metavar='N', nargs='+',
+                        help='numbers of intermediate distributions for AIS')
+    parser.add_argument('--n-ais-runs', type=int, default=100, metavar='N',
+                        help='number of AIS runs')
+
+    args = parser.parse_args()
+    os.environ['CUDA_VISIBLE_DEVICES'] = args.gpu
+
+    b = Benchmarks(args)
+    try:
+        for name in args.benchmarks:
+            getattr(b, 'bench_' + name)()
+    finally:
+        b.cleanup()
+
+    with open(args.output, 'w') as f:
+        json.dump(dict(meta=get_meta(args), results=b.results), f, indent=4, sort_keys=True)
+    print "\nResults are written to {0}".format(args.output)
+
+
+if __name__ == '__main__':
+    main()
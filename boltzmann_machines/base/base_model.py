@@ -3,7 +3,6 @@ from copy import deepcopy
 
 from base import is_param_name, is_attribute_name
 from mixin import SeedMixin
-from boltzmann_machines.utils import write_during_training
 
 
 class BaseModel(SeedMixin):
@@ -53,16 +52,13 @@ class BaseModel(SeedMixin):
         """Class-specific parameters serialization routine."""
         for k, v in params.items():
             if isinstance(v, np.ndarray):
-                if v.size > 1e6:
-                    msg = "WARNING: parameter `{0}` won't be serialized because it is too large:"
-                    msg += ' ({1:.2f} > 1 Mio elements)'
-                    msg = msg.format(k, 1e-6 * v.size)
-                    write_during_training(msg)
-                    params[k] = None
-                else:
-                    params[k] = v.tolist()
+                params[k] = self._serialize_array(k, v)
         return params
 
+    def _serialize_array(self, name, x):
+        """Serialization routine for array-valued parameter `name`."""
+        return x.tolist()
+
     def _deserialize(self, params):
         """Class-specific parameters deserialization routine."""
         return params
@@ -1,40 +1,60 @@
 import os
 import json
+import glob
+import time
+import hashlib
+import threading
+import numpy as np
 import tensorflow as tf
+from Queue import Queue
 from functools import wraps
 
 from boltzmann_machines.base import (BaseModel, DtypeMixin,
                                      is_param_name)
+from boltzmann_machines.utils import write_during_training
+from boltzmann_machines.utils.profiler import TFProfiler
+
+
+# collections of the expensive summaries, evaluated with their own frequency
+# (cheap scalar summaries are kept in the default `tf.GraphKeys.SUMMARIES`)
+HISTOGRAM_SUMMARIES = 'histogram_summaries'
+IMAGE_SUMMARIES = 'image_summaries'
 
 
 def run_in_tf_session(check_initialized=True, update_seed=False):
     """Decorator function that takes care to load appropriate graph/session,
     depending on whether model can be loaded from disk or is just created,
     and to execute `f` inside this session.
+
+    If the model is opened in keep-alive mode (see `TensorFlowModel.open`),
+    graph and session are reused across calls and are reloaded from disk
+    only if the checkpoint has changed since they were loaded. Random ops
+    of the resident graph keep their seeds then (`update_seed` only applies
+    when the graph is (re)loaded), hence such calls are not reproducible
+    against the same calls in the default mode.
     """
     def wrap(f):
         @wraps(f)  # preserve bound method properties
         def wrapped_f(model, *args, **kwargs):
-            tf.reset_default_graph()
-            model._tf_graph = tf.get_default_graph()
-            if update_seed:
-                tf.set_random_seed(model.make_random_seed())
-            if model.initialized_:  # model should be loaded from disk
-                model._tf_saver = tf.train.import_meta_graph(model._tf_meta_graph_filepath)
+            if model._tf_keep_alive:
+                if model._tf_session is None or \
+                        model._tf_checkpoint_signature != model._get_tf_checkpoint_signature():
+                    model._close_tf_session()
+                    model._load_tf_session(check_initialized=check_initialized,
+                                           update_seed=update_seed, f_name=f.__name__)
                 with model._tf_graph.as_default():
-                    with tf.Session(config=model._tf_session_config) as model._tf_session:
-                        model._tf_saver.restore(model._tf_session, model._model_filepath)
-                        model._init_tf_writers()
+                    with model._tf_session.as_default():
                         res = f(model, *args, **kwargs)
-            elif check_initialized:
-                raise RuntimeError('`fit` or `init` must be called before calling `{0}`'.format(f.__name__))
-            else:
+                return res
+
+            model._load_tf_session(check_initialized=check_initialized,
+                                   update_seed=update_seed, f_name=f.__name__)
+            try:
                 with model._tf_graph.as_default():
-                    with tf.Session(config=model._tf_session_config) as model._tf_session:
-                        model._make_tf_model()
-                        model._init_tf_ops()
-                        model._init_tf_writers()
+                    with model._tf_session.as_default():
                         res = f(model, *args, **kwargs)
+            finally:
+                model._close_tf_session()
             return res
         return wrapped_f
     return wrap
@@ -43,7 +63,7 @@ def run_in_tf_session(check_initialized=True, update_seed=False):
 class TensorFlowModel(BaseModel, DtypeMixin):
     def __init__(self, model_path='tf_model/', paths=None,
                  tf_session_config=None, tf_saver_params=None, json_params=None,
-                 *args, **kwargs):
+                 save_async=False, save_queue_size=1, *args, **kwargs):
         super(TensorFlowModel, self).__init__(*args, **kwargs)
         self._model_dirpath = None
         self._model_filepath = None
@@ -51,6 +71,7 @@ class TensorFlowModel(BaseModel, DtypeMixin):
         self._random_state_filepath = None
         self._train_summary_dirpath = None
         self._val_summary_dirpath = None
+        self._profile_dirpath = None
         self._tf_meta_graph_filepath = None
         self.update_working_paths(model_path=model_path, paths=paths)
 
@@ -59,14 +80,27 @@ class TensorFlowModel(BaseModel, DtypeMixin):
         self.json_params = json_params or {}
         self.json_params.setdefault('sort_keys', True)
         self.json_params.setdefault('indent', 4)
+        self.save_async = save_async
+        self.save_queue_size = save_queue_size
         self.initialized_ = False
 
         self._tf_graph = tf.Graph()
         self._tf_session = None
+        self._tf_keep_alive = False
+        self._tf_checkpoint_signature = None
         self._tf_saver = None
         self._tf_merged_summaries = None
-        self._tf_train_writer = None
-        self._tf_val_writer = None
+        self._tf_histogram_summaries = None
+        self._tf_image_summaries = None
+        self._tf_writers = {}
+        self._tf_written_graph = None
+        self._tf_meta_graph_str = None
+        self._profiler = None
+
+        # async checkpointing
+        self._save_queue = None
+        self._save_thread = None
+        self._save_error = None
 
     @staticmethod
     def compute_working_paths(model_path):
@@ -86,8 +120,10 @@ class TensorFlowModel(BaseModel, DtypeMixin):
         paths['model_filepath'] = os.path.join(paths['model_dirpath'], tail)
         paths['params_filepath'] = os.path.join(paths['model_dirpath'], 'params.json')
         paths['random_state_filepath'] = os.path.join(paths['model_dirpath'], 'random_state.json')
+        paths['params_arrays_dirpath'] = os.path.join(paths['model_dirpath'], 'params_arrays')
         paths['train_summary_dirpath'] = os.path.join(paths['model_dirpath'], 'logs/train')
         paths['val_summary_dirpath'] = os.path.join(paths['model_dirpath'], 'logs/val')
+        paths['profile_dirpath'] = os.path.join(paths['model_dirpath'], 'logs/profile')
         paths['tf_meta_graph_filepath'] = paths['model_filepath'] + '.meta'
         return paths
 
@@ -101,43 +137,335 @@ class TensorFlowModel(BaseModel, DtypeMixin):
     def _make_tf_model(self):
         raise NotImplementedError('`_make_tf_model` is not implemented')
 
+    def _latest_checkpoint_filepath(self):
+        """Path to the most recent checkpoint (incl. intermediate ones,
+        saved during training), `model_filepath` by default."""
+        filepath = tf.train.latest_checkpoint(self._model_dirpath)
+        if filepath is None or not os.path.isfile(filepath + '.index'):
+            filepath = self._model_filepath
+        return filepath
+
+    def _get_tf_checkpoint_signature(self):
+        """Path, modification times and sizes of the files the model is restored from."""
+        model_filepath = self._latest_checkpoint_filepath()
+        signature = [model_filepath]
+        for filepath in (model_filepath + '.meta', model_filepath + '.index'):
+            if os.path.isfile(filepath):
+                stat = os.stat(filepath)
+                signature.append((stat.st_mtime, stat.st_size))
+            else:
+                signature.append(None)
+        return tuple(signature)
+
+    def _load_tf_session(self, check_initialized=True, update_seed=False, f_name=None):
+        """Create new graph and session, and either restore the model
+        from disk or build it from scratch.
+        """
+        tf.reset_default_graph()
+        self._tf_graph = tf.get_default_graph()
+        if update_seed:
+            tf.set_random_seed(self.make_random_seed())
+        if self.initialized_:  # model should be loaded from disk
+            model_filepath = self._latest_checkpoint_filepath()
+            meta_graph_filepath = model_filepath + '.meta'
+            if not os.path.isfile(meta_graph_filepath):
+                meta_graph_filepath = self._tf_meta_graph_filepath
+            self._tf_saver = tf.train.import_meta_graph(meta_graph_filepath)
+            self._tf_session = tf.Session(graph=self._tf_graph, config=self._tf_session_config)
+            self._tf_saver.restore(self._tf_session, model_filepath)
+            self._tf_checkpoint_signature = self._get_tf_checkpoint_signature()
+            with self._tf_session.as_default():
+                self._init_tf_summaries()
+        elif check_initialized:
+            raise RuntimeError('`fit` or `init` must be called before calling `{0}`'.format(f_name))
+        else:
+            self._tf_session = tf.Session(graph=self._tf_graph, config=self._tf_session_config)
+            with self._tf_session.as_default():
+                self._make_tf_model()
+                self._init_tf_ops()
+                self._init_tf_summaries()
+
+    def _close_tf_session(self):
+        if self._tf_session is not None:
+            self._tf_session.close()
+            self._tf_session = None
+        self._tf_checkpoint_signature = None
+        self._tf_meta_graph_str = None
+        # writers are kept open only in keep-alive mode, otherwise
+        # each of them would hold an events file and a thread
+        if self._tf_keep_alive:
+            self._flush_tf_writers()
+        else:
+            self._close_tf_writers()
+
+    def open(self):
+        """Switch the model to keep-alive mode: graph, session and restored
+        variables stay resident across calls of `transform`, `get_tf_params`
+        etc. until `close` is called. Can also be used as a context manager.
+
+        Random ops are not reseeded between calls, so e.g. `fit` in this mode
+        draws different random numbers than the same call in the default
+        mode (see `run_in_tf_session`); results are still deterministic
+        for the same sequence of calls.
+        """
+        self._tf_keep_alive = True
+        if self.initialized_ and self._tf_session is None:
+            self._load_tf_session()
+        return self
+
+    def close(self):
+        """Close the session opened in keep-alive mode."""
+        self._tf_keep_alive = False
+        self._close_tf_session()
+        return self
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     def _init_tf_ops(self):
         """Initialize all TF variables and Saver"""
         init_op = tf.global_variables_initializer()
         self._tf_session.run(init_op)
         self._tf_saver = tf.train.Saver(**self.tf_saver_params)
 
-    def _init_tf_writers(self):
+    def _init_tf_summaries(self):
         self._tf_merged_summaries = tf.summary.merge_all()
-        self._tf_train_writer = tf.summary.FileWriter(self._train_summary_dirpath,
-                                                      self._tf_graph)
-        self._tf_val_writer = tf.summary.FileWriter(self._val_summary_dirpath,
-                                                    self._tf_graph)
+        self._tf_histogram_summaries = tf.summary.merge_all(key=HISTOGRAM_SUMMARIES)
+        self._tf_image_summaries = tf.summary.merge_all(key=IMAGE_SUMMARIES)
+
+    def _get_tf_writer(self, dirpath):
+        """Summary writer for `dirpath`, created once a summary is actually
+        emitted and reused until the session is closed (across calls,
+        hence sessions, in keep-alive mode).
+
+        The graph is added only to the train writer, and only if this version
+        of the graph has not been written there yet, which is tracked by the
+        digest of the graph definition stored next to the event files.
+        """
+        writer = self._tf_writers.get(dirpath)
+        if writer is None:
+            writer = tf.summary.FileWriter(dirpath)
+            self._tf_writers[dirpath] = writer
+        # (graph is checked once per loaded graph, not on every call)
+        if dirpath == self._train_summary_dirpath and self._tf_written_graph is not self._tf_graph:
+            digest = hashlib.sha1(self._tf_graph.as_graph_def().SerializeToString()).hexdigest()
+            digest_filepath = os.path.join(dirpath, 'graph_version')
+            written_digest = None
+            if os.path.isfile(digest_filepath):
+                with open(digest_filepath) as f:
+                    written_digest = f.read().strip()
+            if written_digest != digest:
+                writer.add_graph(self._tf_graph)
+                writer.flush()
+                with open(digest_filepath, 'w') as f:
+                    f.write(digest)
+            self._tf_written_graph = self._tf_graph
+        return writer
+
+    def _flush_tf_writers(self):
+        for writer in self._tf_writers.values():
+            writer.flush()
+
+    def _close_tf_writers(self):
+        for writer in self._tf_writers.values():
+            writer.close()
+        self._tf_writers = {}
+
+    def _summaries_due(self, step, scalars_every_iter=None,
+                       histograms_every_iter=None, images_every_iter=None):
+        """Merged summaries of the tiers (scalars, histograms, images) due at
+        iteration `step`. Tier is turned off if its frequency is 0 or None."""
+        ops = []
+        for op, every_iter in ((self._tf_merged_summaries, scalars_every_iter),
+                               (self._tf_histogram_summaries, histograms_every_iter),
+                               (self._tf_image_summaries, images_every_iter)):
+            if op is not None and every_iter and step % every_iter == 0:
+                ops.append(op)
+        return ops
+
+    def _start_profiling(self, profile_iters, tag, get_tf_writer=None):
+        """Trace `session.run` calls made through `_tf_run` on the
+        steps selected by `profile_iters` (see `TFProfiler`)."""
+        self._profiler = None
+        if profile_iters:
+            self._profiler = TFProfiler(self._profile_dirpath, iters=profile_iters,
+                                        tag=tag, get_tf_writer=get_tf_writer)
+
+    def _stop_profiling(self):
+        if self._profiler is not None:
+            s = self._profiler.write_summary()
+            if s and getattr(self, 'verbose', False):
+                write_during_training(s)
+            self._profiler = None
+
+    def _tf_run(self, fetches, feed_dict=None, step=None):
+        if self._profiler is None:
+            return self._tf_session.run(fetches, feed_dict=feed_dict)
+        return self._profiler.run(self._tf_session, fetches, feed_dict=feed_dict, step=step)
+
+    def _serialize_array(self, name, x):
+        """Save array-valued parameter to a binary .npy file next to
+        params.json, to be memory-mapped on load."""
+        if not os.path.exists(self._params_arrays_dirpath):
+            os.makedirs(self._params_arrays_dirpath)
+        filename = '{0}.npy'.format(name)
+        filepath = os.path.join(self._params_arrays_dirpath, filename)
+
+        # write to temporary file first, as the current one may be memory-mapped
+        tmp_filepath = filepath + '.tmp'
+        with open(tmp_filepath, 'wb') as f:
+            np.save(f, x)
+        os.rename(tmp_filepath, filepath)
+        return {'__ndarray__': os.path.relpath(filepath, self._model_dirpath)}
+
+    def _write_json(self, obj, filepath, **json_params):
+        # write to temporary file and rename, so that the file is never left partially written
+        tmp_filepath = filepath + '.tmp'
+        with open(tmp_filepath, 'w') as f:
+            json.dump(obj, f, **json_params)
+        os.rename(tmp_filepath, filepath)
+
+    def _write_params(self, params, random_state=None):
+        params = self._serialize(params)
+        params['__class_name__'] = self.__class__.__name__
+        self._write_json(params, self._params_filepath, **self.json_params)
+        if random_state is not None:
+            self._write_json(random_state, self._random_state_filepath)
 
     def _save_model(self, global_step=None):
+        self._flush_saves()
+
         # (recursively) create all folders needed
         for dirpath in (self._train_summary_dirpath, self._val_summary_dirpath):
             if not os.path.exists(dirpath):
                 os.makedirs(dirpath)
 
-        # save params
-        params = self.get_params(deep=False)
-        params = self._serialize(params)
-        params['__class_name__'] = self.__class__.__name__
-        with open(self._params_filepath, 'w') as params_file:
-            json.dump(params, params_file, **self.json_params)
-
-        # dump random state if needed
-        if self.random_seed is not None:
-            random_state = self._rng.get_state()
-            with open(self._random_state_filepath, 'w') as random_state_file:
-                json.dump(random_state, random_state_file)
+        # save params and dump random state if needed
+        random_state = self._rng.get_state() if self.random_seed is not None else None
+        self._write_params(self.get_params(deep=False), random_state)
 
         # save tf model
         self._tf_saver.save(self._tf_session,
                             self._model_filepath,
                             global_step=global_step)
 
+        # resident session (if any) is up-to-date with what has just been saved
+        if self._tf_keep_alive:
+            self._tf_checkpoint_signature = self._get_tf_checkpoint_signature()
+
+    def _save_checkpoint(self, global_step=None):
+        """Save intermediate checkpoint during training
+        (in a background thread, if `save_async` is set)."""
+        if self.save_async:
+            self._save_model_async(global_step)
+        else:
+            self._save_model(global_step)
+
+    def _save_model_async(self, global_step=None):
+        """Snapshot params, random state and values of TF variables in memory,
+        and write them to disk in a background thread. Blocks only if there
+        are already `save_queue_size` snapshots waiting to be written.
+        """
+        if self._save_error is not None:
+            self._flush_saves()  # (re-)raise error
+        if self._save_thread is None:
+            self._save_queue = Queue(maxsize=self.save_queue_size)
+            self._save_thread = threading.Thread(target=self._save_worker,
+                                                 args=(self._save_queue,))
+            self._save_thread.daemon = True
+            self._save_thread.start()
+
+        # graph is not changing during training, hence it is exported once
+        if self._tf_meta_graph_str is None:
+            self._tf_meta_graph_str = self._tf_saver.export_meta_graph().SerializeToString()
+
+        tf_vars = {v.op.name: v for v in tf.global_variables()}
+        snapshot = dict(global_step=global_step,
+                        params=self.get_params(deep=False),
+                        random_state=self._rng.get_state() if self.random_seed is not None else None,
+                        tf_meta_graph_str=self._tf_meta_graph_str,
+                        tf_values=self._tf_session.run(tf_vars))
+        self._save_queue.put(snapshot)
+
+    def _save_worker(self, queue):
+        # values are saved from a separate graph (on CPU), holding the copies of variables
+        tf_graph = tf.Graph()
+        tf_session = None
+        tf_init_op = None
+        tf_saver = None
+        tf_feeds = {}
+        while True:
+            snapshot = queue.get()
+            try:
+                if snapshot is None:
+                    break
+                if self._save_error is not None:
+                    continue
+                if tf_session is None:
+                    tf_vars = {}
+                    with tf_graph.as_default(), tf.device('/cpu:0'):
+                        for name, value in snapshot['tf_values'].items():
+                            t = tf.placeholder(tf.as_dtype(value.dtype), value.shape)
+                            tf_vars[name] = tf.Variable(t)
+                            tf_feeds[name] = t
+                        tf_init_op = tf.variables_initializer(tf_vars.values())
+                        tf_saver = tf.train.Saver(var_list=tf_vars)
+                    tf_session = tf.Session(graph=tf_graph,
+                                            config=tf.ConfigProto(device_count={'GPU': 0}))
+                self._write_snapshot(snapshot, tf_session, tf_init_op, tf_saver, tf_feeds)
+            except Exception as e:
+                self._save_error = e  # re-raised in the training thread
+            finally:
+                queue.task_done()
+        if tf_session is not None:
+            tf_session.close()
+
+    def _write_snapshot(self, snapshot, tf_session, tf_init_op, tf_saver, tf_feeds):
+        self._write_params(snapshot['params'], snapshot['random_state'])
+
+        # write checkpoint under temporary prefix and rename when complete
+        model_filepath = self._model_filepath
+        if snapshot['global_step'] is not None:
+            model_filepath += '-{0}'.format(snapshot['global_step'])
+        tmp_filepath = model_filepath + '.tmp'
+        feed_dict = {tf_feeds[name]: value for name, value in snapshot['tf_values'].items()}
+        tf_session.run(tf_init_op, feed_dict=feed_dict)
+        tf_saver.save(tf_session, tmp_filepath, write_meta_graph=False, write_state=False)
+        with open(tmp_filepath + '.meta', 'wb') as f:
+            f.write(snapshot['tf_meta_graph_str'])
+        for filepath in glob.glob(tmp_filepath + '.*'):
+            os.rename(filepath, model_filepath + filepath[len(tmp_filepath):])
+
+        # remove old checkpoints and update checkpoint state as `tf.train.Saver` does,
+        # using its list of checkpoints, so that it is shared with synchronous saves
+        # (these wait for pending snapshots, see `_save_model`)
+        saver = self._tf_saver
+        checkpoints = [filepath for filepath in saver.last_checkpoints if filepath != model_filepath]
+        checkpoints.append(model_filepath)
+        max_to_keep = saver.saver_def.max_to_keep
+        while max_to_keep and len(checkpoints) > max_to_keep:
+            for filepath in glob.glob(checkpoints.pop(0) + '.*'):
+                os.remove(filepath)
+        saver.set_last_checkpoints_with_time([(filepath, time.time()) for filepath in checkpoints])
+        tf.train.update_checkpoint_state(self._model_dirpath, model_filepath,
+                                         all_model_checkpoint_paths=checkpoints)
+
+    def _flush_saves(self):
+        """Wait until all the pending async checkpoints are written."""
+        if self._save_thread is not None:
+            self._save_queue.put(None)
+            self._save_thread.join()
+            self._save_thread = None
+            self._save_queue = None
+            if self._tf_keep_alive:
+                self._tf_checkpoint_signature = self._get_tf_checkpoint_signature()
+        if self._save_error is not None:
+            e, self._save_error = self._save_error, None
+            raise e
+
     @classmethod
     def load_model(cls, model_path):
         paths = TensorFlowModel.compute_working_paths(model_path)
@@ -145,6 +473,10 @@ class TensorFlowModel(BaseModel, DtypeMixin):
         # load params
         with open(paths['params_filepath'], 'r') as params_file:
             params = json.load(params_file)
+        for k, v in params.items():
+            if isinstance(v, dict) and '__ndarray__' in v:
+                filepath = os.path.join(paths['model_dirpath'], v['__ndarray__'])
+                params[k] = np.load(filepath, mmap_mode='c')
         class_name = params.pop('__class_name__')
         if class_name != cls.__name__:
             raise RuntimeError("attempt to load {0} with class {1}".format(class_name, cls.__name__))
@@ -173,10 +505,25 @@ class TensorFlowModel(BaseModel, DtypeMixin):
         return self
 
     @run_in_tf_session(check_initialized=False, update_seed=True)
-    def fit(self, X, X_val=None, *args, **kwargs):
-        """Fit the model according to the given training data."""
+    def fit(self, X, X_val=None, profile_iters=None, *args, **kwargs):
+        """Fit the model according to the given training data.
+
+        Parameters
+        ----------
+        profile_iters : None, positive int or iterable of int
+            If provided, trace training iterations (every `profile_iters`-th one
+            if int, otherwise ones with these numbers), and write their timelines
+            and per-scope time summary to `logs/profile` (see `TFProfiler`).
+        """
         self.initialized_ = True
-        self._fit(X, X_val=X_val, *args, **kwargs)
+        self._start_profiling(profile_iters, tag='train',
+                              get_tf_writer=lambda: self._get_tf_writer(self._train_summary_dirpath))
+        try:
+            self._fit(X, X_val=X_val, *args, **kwargs)
+        finally:
+            self._stop_profiling()
+            self._flush_tf_writers()
+            self._flush_saves()
         self._save_model()
         return self
 
@@ -201,6 +548,43 @@ class TensorFlowModel(BaseModel, DtypeMixin):
             weights[key] = var.eval()
         return weights
 
+    def read_tf_params(self, scopes=None):
+        """Read tf params of the model straight from the latest checkpoint,
+        w/o building graph or session, for any subset of scopes at once.
+
+        Parameters
+        ----------
+        scopes : None, str or iterable of str
+            Read variables whose names start with this scope (or any of
+            these scopes). If None, read all the variables.
+
+        Returns
+        -------
+        params : dict[str] = np.ndarray or dict[str] = dict[str] = np.ndarray
+            Values keyed as in `get_tf_params`. If `scopes` is iterable,
+            one such dict per scope.
+        """
+        if not self.initialized_:
+            raise RuntimeError('`fit` or `init` must be called before calling `read_tf_params`')
+        self._flush_saves()
+        reader = tf.train.NewCheckpointReader(self._latest_checkpoint_filepath())
+        names = sorted(reader.get_variable_to_shape_map())
+
+        def read(scope):
+            weights = {}
+            for name in names:
+                if scope and not name.startswith(scope):
+                    continue
+                key = name.replace(scope, '') if scope else name
+                if key.startswith('/'):
+                    key = key[1:]
+                weights[key] = reader.get_tensor(name)
+            return weights
+
+        if scopes is None or isinstance(scopes, basestring):
+            return read(scopes)
+        return dict((scope, read(scope)) for scope in scopes)
+
 
 if __name__ == '__main__':
     # run corresponding tests
@@ -1,14 +1,19 @@
+import os
+import time
+import hashlib
 import numpy as np
 import tensorflow as tf
 from tensorflow.core.framework import summary_pb2
 from tensorflow.contrib.distributions import Bernoulli
 
-from base import run_in_tf_session
+from base import run_in_tf_session, HISTOGRAM_SUMMARIES, IMAGE_SUMMARIES
 from ebm import EnergyBasedModel
 from layers import BernoulliLayer
-from utils import (make_list_from, write_during_training,
+from runtime import NumpyDBM
+from utils import (RNG, LazyArray, make_list_from, write_during_training,
                    batch_iter, epoch_iter,
                    log_sum_exp, log_diff_exp, log_mean_exp, log_std_exp)
+from boltzmann_machines.utils.mf_cache import MeanFieldCache
 
 
 class DBM(EnergyBasedModel):
@@ -27,19 +32,53 @@ class DBM(EnergyBasedModel):
         otherwise initialize using resp. stochastic layer initializer.
     h_particles_init : None or iterable of None or (n_particles, n_hiddens[i]) np.ndarray
         Same semantics as for `v_particle_init`, but for hidden particles for all layers
+    pt_betas : None or iterable of float
+        If provided, use parallel tempering [6] for negative particles (both
+        in training and in `sample_v`): `n_particles` replicas at each of these
+        (strictly decreasing, starting with 1) inverse temperatures are run
+        at once, as a single batch, and states of adjacent replicas are swapped
+        after each Gibbs step using Metropolis rule. Only replicas at inverse
+        temperature 1 are used as negative particles. States of all the
+        layers are then sampled, regardless of `sample_v_states` and
+        `sample_h_states`. Gaussian units require `sigma` = 1.
     n_gibbs_steps : positive int or iterable
         Number of Gibbs steps for PCD. Values are updated after each epoch.
     max_mf_updates : positive int
         Maximum number of mean-field updates per weight update.
     mf_tol : positive float
         Mean-field tolerance.
+    gibbs_schedule : {'sequential', 'checkerboard'}
+        Order of layer updates within a Gibbs step (and a mean-field update).
+        If 'sequential', layers are updated one after another, from the first
+        hidden layer to the top one, and then the visible one. If 'checkerboard',
+        odd layers (counting visible as 0th) are updated given the even ones,
+        and then vice versa, so that updates within each of the 2 phases are
+        independent and can run in parallel. The two are equivalent for
+        DBMs with at most 2 hidden layers.
+    mf_cache : {None, 'memory', 'mmap'}
+        If provided, converged variational parameters of each training
+        example are cached (in host memory or in memory-mapped files in
+        `mf_cache` subdirectory of the model directory), indexed by its
+        position in the training data, and mean-field updates for this
+        example start from them on the next epoch, instead of approximate
+        inference. Hit rate and average number of mean-field updates saved
+        per batch are logged after each epoch. Cached states are discarded
+        if weights (iteration) or training data (size, first and last
+        examples) differ from those they were computed for. Cannot be used
+        with `AugmentedArray` training data (also if wrapped in `LazyArray`),
+        as its examples change every epoch.
     learning_rate, momentum : positive float or iterable
         Gradient descent parameters. Values are updated after each epoch.
     max_epoch : positive int
         Train till this epoch.
     batch_size : positive int
-        Input batch size for training. Total number of training examples should
-        be divisible by this number.
+        Input batch size for training.
+    shuffle : bool
+        Whether to shuffle training data before each epoch
+        (using seeded random permutation).
+    n_prefetch_batches : non-negative int
+        If positive, input batches are prepared in a background thread,
+        and up to this number of them are kept ready for the session.
     l2 : non-negative float
         L2 weight decay coefficient.
     max_norm : positive float
@@ -58,11 +97,30 @@ class DBM(EnergyBasedModel):
     sparsity_damping : float in (0, 1)
         Decay rate for hidden activations probs.
     train_metrics_every_iter, val_metrics_every_epoch : positive int
-        Control frequency of logging progress
+        Control frequency of logging progress (and of scalar summaries).
+    histograms_every_iter : non-negative int
+        Frequency of (expensive) histograms of weights, biases, their updates
+        and variational parameters, 0 turns them off.
+    images_every_iter : non-negative int
+        Frequency of image summaries (filters, particles), 0 turns them off.
     verbose : bool
         Whether to display progress during training.
     save_after_each_epoch : bool
         If False, save model only after the whole training is complete.
+    save_async : bool
+        Whether to write checkpoints after each epoch in a background
+        thread, while training continues. Only in-memory snapshot of
+        the variables is taken on the training thread.
+    save_queue_size : positive int
+        Max number of snapshots waiting to be written, when exceeded
+        training blocks until the oldest one is written.
+    checkpoint_every_iter : None or positive int
+        If provided, save checkpoint every this number of iterations
+        (also in the middle of an epoch).
+    checkpoint_every_sec : None or positive float
+        If provided, save checkpoint every this number of seconds.
+        Checkpoints store the position within the epoch, so that `fit`
+        of the loaded model resumes from the next batch.
     display_filters : non-negative int
         Number of weights filters to display during training (in TensorBoard).
     display_particles : non-negative int
@@ -85,16 +143,22 @@ class DBM(EnergyBasedModel):
     [5] G. Hinton and R. Salakhutdinov. A better way to pretrain Deep
         Boltzmann Machines. In Advances in Neural Information Processing
         Systems, pp. 2447-2455, 2012.
+    [6] G. Desjardins, A. Courville, Y. Bengio, P. Vincent and O. Delalleau.
+        Parallel tempering for training of restricted Boltzmann machines.
+        In AISTATS, pp. 145-152. 2010
     """
     def __init__(self, rbms=None,
-                 n_particles=100, v_particle_init=None, h_particles_init=None,
-                 n_gibbs_steps=5, max_mf_updates=10, mf_tol=1e-7,
+                 n_particles=100, v_particle_init=None, h_particles_init=None, pt_betas=None,
+                 n_gibbs_steps=5, max_mf_updates=10, mf_tol=1e-7, gibbs_schedule='sequential',
+                 mf_cache=None,
                  learning_rate=0.0005, momentum=0.9, max_epoch=10, batch_size=100,
-                 l2=0., max_norm=np.inf,
+                 shuffle=False, n_prefetch_batches=0, l2=0., max_norm=np.inf,
                  sample_v_states=True, sample_h_states=None,
                  sparsity_target=0.1, sparsity_cost=0., sparsity_damping=0.9,
                  train_metrics_every_iter=10, val_metrics_every_epoch=1,
+                 histograms_every_iter=1000, images_every_iter=100,
                  verbose=False, save_after_each_epoch=True,
+                 checkpoint_every_iter=None, checkpoint_every_sec=None,
                  display_filters=0, display_particles=0, v_shape=(28, 28),
                  model_path='dbm_model/', *args, **kwargs):
         super(DBM, self).__init__(model_path=model_path, *args, **kwargs)
@@ -106,15 +170,30 @@ class DBM(EnergyBasedModel):
         self.n_particles = n_particles
         self._v_particle_init = v_particle_init
         self._h_particles_init = h_particles_init
+        self.pt_betas = self._check_pt_betas(pt_betas)
+        if self.pt_betas is not None and rbms is not None:
+            self._check_pt_layers([self._v_layer] + self._h_layers)
 
         self.n_gibbs_steps = make_list_from(n_gibbs_steps)
         self.max_mf_updates = max_mf_updates
         self.mf_tol = mf_tol
+        if gibbs_schedule not in ('sequential', 'checkerboard'):
+            raise ValueError("`gibbs_schedule` must be one of 'sequential', 'checkerboard', got '{0}'"
+                             .format(gibbs_schedule))
+        self.gibbs_schedule = gibbs_schedule
+        if mf_cache not in (None, 'memory', 'mmap'):
+            raise ValueError("`mf_cache` must be one of None, 'memory', 'mmap', got '{0}'"
+                             .format(mf_cache))
+        self.mf_cache = mf_cache
+        self._mf_cache = None
+        self._mf_cache_data_digest = None
 
         self.learning_rate = make_list_from(learning_rate)
         self.momentum = make_list_from(momentum)
         self.max_epoch = max_epoch
         self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.n_prefetch_batches = n_prefetch_batches
         self.l2 = l2
         self.max_norm = max_norm
 
@@ -131,8 +210,12 @@ class DBM(EnergyBasedModel):
 
         self.train_metrics_every_iter = train_metrics_every_iter
         self.val_metrics_every_epoch = val_metrics_every_epoch
+        self.histograms_every_iter = histograms_every_iter
+        self.images_every_iter = images_every_iter
         self.verbose = verbose
         self.save_after_each_epoch = save_after_each_epoch
+        self.checkpoint_every_iter = checkpoint_every_iter
+        self.checkpoint_every_sec = checkpoint_every_sec
 
         for nh in self.n_hiddens_:
             assert nh >= display_filters
@@ -150,6 +233,11 @@ class DBM(EnergyBasedModel):
         self.iter_ = 0
         self.n_samples_generated_ = 0
 
+        # position within the current epoch (to resume from)
+        self.batch_offset_ = 0
+        self.order_ = None
+        self._checkpoint_time = None
+
         # tf constants
         self._n_visible = None
         self._n_hiddens = []
@@ -161,10 +249,8 @@ class DBM(EnergyBasedModel):
         self._sparsity_costs = []
         self._sparsity_damping = None
 
-        self._batch_size = None
         self._l2 = None
         self._max_norm = None
-        self._N = None
         self._M = None
 
         # tf input data
@@ -174,6 +260,8 @@ class DBM(EnergyBasedModel):
         self._X_batch = None
         self._delta_beta = None
         self._n_ais_runs = None
+        self._mu_init = []
+        self._mu_init_mask = None
 
         # tf vars
         self._W = []
@@ -185,7 +273,6 @@ class DBM(EnergyBasedModel):
         self._dhb = []
 
         self._mu = []
-        self._mu_new = []
         self._q_means = []
         self._mu_means = []
 
@@ -193,6 +280,8 @@ class DBM(EnergyBasedModel):
         self._v_new = None
         self._H = []
         self._H_new = []
+        self._v_tempered = None
+        self._H_tempered = []
 
         # tf operations
         self._train_op = None
@@ -203,6 +292,7 @@ class DBM(EnergyBasedModel):
         self._sample_v = None
         self._log_Z = None
         self._log_proba = None
+        self._pt_swap_rate = None
 
     def load_rbms(self, rbms):
         if rbms is not None:
@@ -213,10 +303,10 @@ class DBM(EnergyBasedModel):
             self.n_visible_ = self._rbms[0].n_visible
             self.n_hiddens_ = [rbm.n_hidden for rbm in self._rbms]
 
-            # extract weights and biases
+            # extract weights and biases (straight from checkpoints)
             self._W_init, self._vb_init, self._hb_init = [], [], []
             for i in xrange(self.n_layers_):
-                weights = self._rbms[i].get_tf_params(scope='weights')
+                weights = self._rbms[i].read_tf_params(scopes='weights')
                 self._W_init.append(weights['W'])
                 self._vb_init.append(weights['vb'])
                 self._hb_init.append(weights['hb'])
@@ -248,10 +338,8 @@ class DBM(EnergyBasedModel):
                 self._sparsity_costs.append(C)
             self._sparsity_damping = tf.constant(self.sparsity_damping, dtype=self._tf_dtype, name='sparsity_damping')
 
-            self._batch_size = tf.constant(self.batch_size, dtype=tf.int32, name='batch_size')
             self._l2 = tf.constant(self.l2, dtype=self._tf_dtype, name='L2_coef')
             self._max_norm = tf.constant(self.max_norm, dtype=self._tf_dtype, name='max_norm_coef')
-            self._N = tf.cast(self._batch_size, dtype=self._tf_dtype, name='N')
             self._M = tf.cast(self._n_particles, dtype=self._tf_dtype, name='M')
 
     def _make_placeholders(self):
@@ -263,6 +351,15 @@ class DBM(EnergyBasedModel):
             self._delta_beta = tf.placeholder(self._tf_dtype, [], name='delta_beta')
             self._n_ais_runs = tf.placeholder(tf.int32, [], name='n_ais_runs')
 
+            # states to warm-start mean-field from (where `mu_init_mask` is set)
+            N = tf.shape(self._X_batch)[0]
+            for i in xrange(self.n_layers_):
+                T = tf.zeros([N, self.n_hiddens_[i]], dtype=self._tf_dtype)
+                T = tf.placeholder_with_default(T, [None, self.n_hiddens_[i]], name='mu_init_{0}'.format(i))
+                self._mu_init.append(T)
+            t = tf.zeros([N], dtype=tf.bool)
+            self._mu_init_mask = tf.placeholder_with_default(t, [None], name='mu_init_mask')
+
     def _make_vars(self):
         # compose weights and biases of DBM from trained RBMs' ones
         # and account double-counting evidence problem [1]
@@ -294,19 +391,19 @@ class DBM(EnergyBasedModel):
         with tf.name_scope('weights'):
             t = tf.constant(vb_init, dtype=self._tf_dtype, name='vb_init')
             self._vb = tf.Variable(t, dtype=self._tf_dtype, name='vb')
-            tf.summary.histogram('vb_hist', self._vb)
+            tf.summary.histogram('vb_hist', self._vb, collections=[HISTOGRAM_SUMMARIES])
 
             for i in xrange(self.n_layers_):
                 T = tf.constant(W_init[i], dtype=self._tf_dtype, name='W_init')
                 W = tf.Variable(T, dtype=self._tf_dtype, name='W')
                 self._W.append(W)
-                tf.summary.histogram('W_hist', W)
+                tf.summary.histogram('W_hist', W, collections=[HISTOGRAM_SUMMARIES])
 
             for i in xrange(self.n_layers_):
                 t = tf.constant(hb_init[i],  dtype=self._tf_dtype, name='hb_init')
                 hb = tf.Variable(t,  dtype=self._tf_dtype, name='hb')
                 self._hb.append(hb)
-                tf.summary.histogram('hb_hist', hb)
+                tf.summary.histogram('hb_hist', hb, collections=[HISTOGRAM_SUMMARIES])
 
         # visualize filters
         if self.display_filters:
@@ -319,37 +416,27 @@ class DBM(EnergyBasedModel):
                     W_display = tf.reshape(W_display, [self.n_hiddens_[i], self.v_shape[2],
                                                        self.v_shape[0], self.v_shape[1]])
                     W_display = tf.transpose(W_display, [0, 2, 3, 1])
-                    tf.summary.image('W_filters', W_display, max_outputs=self.display_filters)
+                    tf.summary.image('W_filters', W_display, max_outputs=self.display_filters,
+                                     collections=[IMAGE_SUMMARIES])
 
         # initialize gradients accumulators
         with tf.name_scope('grads_accumulators'):
             t = tf.zeros(vb_init.shape, dtype=self._tf_dtype, name='dvb_init')
             self._dvb = tf.Variable(t, name='dvb')
-            tf.summary.histogram('dvb_hist', self._dvb)
+            tf.summary.histogram('dvb_hist', self._dvb, collections=[HISTOGRAM_SUMMARIES])
 
             for i in xrange(self.n_layers_):
                 T = tf.zeros(W_init[i].shape, dtype=self._tf_dtype, name='dW_init')
                 dW = tf.Variable(T, name='dW')
-                tf.summary.histogram('dW_hist', dW)
+                tf.summary.histogram('dW_hist', dW, collections=[HISTOGRAM_SUMMARIES])
                 self._dW.append(dW)
 
             for i in xrange(self.n_layers_):
                 t = tf.zeros(hb_init[i].shape, dtype=self._tf_dtype, name='dhb_init')
                 dhb = tf.Variable(t, name='dhb')
-                tf.summary.histogram('dhb_hist', dhb)
+                tf.summary.histogram('dhb_hist', dhb, collections=[HISTOGRAM_SUMMARIES])
                 self._dhb.append(dhb)
 
-        # initialize variational parameters
-        with tf.name_scope('variational_params'):
-            for i in xrange(self.n_layers_):
-                t = tf.zeros([self._batch_size, self.n_hiddens_[i]], dtype=self._tf_dtype)
-                mu = tf.Variable(t, name='mu')
-                t_new = tf.zeros([self._batch_size, self.n_hiddens_[i]], dtype=self._tf_dtype)
-                mu_new = tf.Variable(t_new, name='mu_new')
-                tf.summary.histogram('mu_hist', mu)
-                self._mu.append(mu)
-                self._mu_new.append(mu_new)
-
         # initialize running means of hidden activations means
         with tf.name_scope('hidden_means_accumulators'):
             for i in xrange(self.n_layers_):
@@ -382,8 +469,32 @@ class DBM(EnergyBasedModel):
                     self._H.append(h)
                     self._H_new.append(h_new)
 
-    def _make_gibbs_step(self, v, H, v_new, H_new, update_v=True, sample=True):
-        """Compute one Gibbs step."""
+            # replicas at lower inverse temperatures, stacked along the first axis
+            if self.pt_betas is not None:
+                n_tempered = (len(self.pt_betas) - 1) * self.n_particles
+                t = self._v_layer.init(batch_size=n_tempered)
+                self._v_tempered = tf.Variable(t, dtype=self._tf_dtype, name='v_tempered')
+                for i in xrange(self.n_layers_):
+                    q = self._h_layers[i].init(batch_size=n_tempered)
+                    self._H_tempered.append(tf.Variable(q, dtype=self._tf_dtype, name='h_tempered'))
+
+    def _activation(self, layer, T, b, beta=None):
+        """Compute activation of `layer` (at inverse temperature(s) `beta`)."""
+        if beta is None:
+            return layer.activation(T, b)
+        return layer.tempered_activation(T, b, beta)
+
+    def _make_gibbs_step(self, v, H, v_new, H_new, update_v=True, sample=True, sample_all=False,
+                         beta=None):
+        """Compute one Gibbs step (at inverse temperature(s) `beta`), sampling
+        states of all the layers if `sample_all`, otherwise of those
+        selected by `sample_*_states` (if `sample` at all)."""
+        if self.gibbs_schedule == 'checkerboard':
+            return self._make_checkerboard_gibbs_step(v, H, v_new, H_new, update_v=update_v,
+                                                      sample=sample, sample_all=sample_all, beta=beta)
+        sample_v = sample and (sample_all or self.sample_v_states)
+        sample_h = [sample and (sample_all or s) for s in self.sample_h_states]
+
         with tf.name_scope('gibbs_step'):
 
             # update first hidden layer
@@ -391,59 +502,108 @@ class DBM(EnergyBasedModel):
                 T = tf.matmul(v, self._W[0])
                 if self.n_layers_ >= 2:
                     T += tf.matmul(a=H[1], b=self._W[1], transpose_b=True)
-                H_new[0] = self._h_layers[0].activation(T, self._hb[0])
-            if sample and self.sample_h_states[0]:
+                H_new[0] = self._activation(self._h_layers[0], T, self._hb[0], beta)
+            if sample_h[0]:
                 with tf.name_scope('sample_h0_hat_given_v_h1'):
-                    H_new[0] = self._h_layers[0].sample(means=H_new[0])
+                    H_new[0] = self._h_layers[0].sample(means=H_new[0], beta=beta)
 
             # update the intermediate hidden layers if any
             for i in xrange(1, self.n_layers_ - 1):
                 with tf.name_scope('means_h{0}_hat_given_h{1}_hat_h{2}'.format(i, i - 1, i + 1)):
                     T1 = tf.matmul(H_new[i - 1], self._W[i])
                     T2 = tf.matmul(a=H[i + 1], b=self._W[i + 1], transpose_b=True)
-                    H_new[i] = self._h_layers[i].activation(T1 + T2, self._hb[i])
-                if sample and self.sample_h_states[i]:
+                    H_new[i] = self._activation(self._h_layers[i], T1 + T2, self._hb[i], beta)
+                if sample_h[i]:
                     with tf.name_scope('sample_h{0}_hat_given_h{1}_hat_h{2}'.format(i, i - 1, i + 1)):
-                        H_new[i] = self._h_layers[i].sample(means=H_new[i])
+                        H_new[i] = self._h_layers[i].sample(means=H_new[i], beta=beta)
 
             # update last hidden layer
             if self.n_layers_ >= 2:
                 with tf.name_scope('means_h{0}_hat_given_h{1}_hat'.format(self.n_layers_ - 1, self.n_layers_ - 2)):
                     T = tf.matmul(H_new[-2], self._W[-1])
-                    H_new[-1] = self._h_layers[-1].activation(T, self._hb[-1])
-                if sample and self.sample_h_states[-1]:
+                    H_new[-1] = self._activation(self._h_layers[-1], T, self._hb[-1], beta)
+                if sample_h[-1]:
                     with tf.name_scope('sample_h{0}_hat_given_h{1}_hat'.format(self.n_layers_ - 1, self.n_layers_ - 2)):
-                        H_new[-1] = self._h_layers[-1].sample(means=H_new[-1])
+                        H_new[-1] = self._h_layers[-1].sample(means=H_new[-1], beta=beta)
 
             # update visible layer if needed
             if update_v:
                 with tf.name_scope('means_v_hat_given_h0_hat'):
                     T = tf.matmul(a=H_new[0], b=self._W[0], transpose_b=True)
-                    v_new = self._v_layer.activation(T, self._vb)
-                if sample and self.sample_v_states:
+                    v_new = self._activation(self._v_layer, T, self._vb, beta)
+                if sample_v:
                     with tf.name_scope('sample_v_hat_given_h_hat'):
-                        v_new = self._v_layer.sample(means=v_new)
+                        v_new = self._v_layer.sample(means=v_new, beta=beta)
+
+        return v, H, v_new, H_new
+
+    def _make_checkerboard_gibbs_step(self, v, H, v_new, H_new, update_v=True, sample=True,
+                                      sample_all=False, beta=None):
+        """Compute one Gibbs step in 2 phases: first update odd layers
+        (h0, h2, ...) given the even ones, then even layers (v, h1, ...)
+        given the updated odd ones. Within a phase, layers are conditionally
+        independent, hence their updates do not depend on each other.
+        """
+        sample_v = sample and (sample_all or self.sample_v_states)
+        sample_h = [sample and (sample_all or s) for s in self.sample_h_states]
+
+        def update_h(i, below, above):
+            with tf.name_scope('means_h{0}_hat'.format(i)):
+                T = tf.matmul(below, self._W[i])
+                if above is not None:
+                    T += tf.matmul(a=above, b=self._W[i + 1], transpose_b=True)
+                h = self._activation(self._h_layers[i], T, self._hb[i], beta)
+            if sample_h[i]:
+                with tf.name_scope('sample_h{0}_hat'.format(i)):
+                    h = self._h_layers[i].sample(means=h, beta=beta)
+            return h
+
+        with tf.name_scope('gibbs_step'):
+            with tf.name_scope('odd_layers'):
+                for i in xrange(0, self.n_layers_, 2):
+                    H_new[i] = update_h(i, below=v if i == 0 else H[i - 1],
+                                        above=H[i + 1] if i + 1 < self.n_layers_ else None)
+
+            with tf.name_scope('even_layers'):
+                for i in xrange(1, self.n_layers_, 2):
+                    H_new[i] = update_h(i, below=H_new[i - 1],
+                                        above=H_new[i + 1] if i + 1 < self.n_layers_ else None)
+                if update_v:
+                    with tf.name_scope('means_v_hat_given_h0_hat'):
+                        T = tf.matmul(a=H_new[0], b=self._W[0], transpose_b=True)
+                        v_new = self._activation(self._v_layer, T, self._vb, beta)
+                    if sample_v:
+                        with tf.name_scope('sample_v_hat_given_h_hat'):
+                            v_new = self._v_layer.sample(means=v_new, beta=beta)
 
         return v, H, v_new, H_new
 
-    def _make_mf(self):
-        """Run mean-field updates for current mini-batch"""
+    def _make_mf(self, X_batch, mu_init=None, mu_init_mask=None):
+        """Run mean-field updates for mini-batch `X_batch`, starting from
+        `mu_init` for examples where `mu_init_mask` is set (if provided).
+
+        Variational parameters are kept in loop-local tensors,
+        so the returned ops don't modify any of the variables.
+        """
         with tf.name_scope('mean_field'):
-            # initialize mu_new using approximate inference
+            # initialize mu using approximate inference
             # as suggested in [1]
-            init_ops = []
+            mu = []
             T = None
             for i in xrange(self.n_layers_):
                 if i == 0:
-                    T = 2. * tf.matmul(self._X_batch, self._W[0])
+                    T = 2. * tf.matmul(X_batch, self._W[0])
                 else:
                     T = tf.matmul(T, self._W[i])
                     if i < self.n_layers_ - 1:
                         T *= 2.
                 T = self._h_layers[i].activation(T, self._hb[i])
-                q_new = tf.identity(T, name='approx_inference')
-                init_op = tf.assign(self._mu_new[i], q_new)
-                init_ops.append(init_op)
+                mu.append(tf.identity(T, name='approx_inference'))
+            if mu_init is not None:
+                mu = [tf.where(mu_init_mask, q0, q, name='warm_start') for q0, q in zip(mu_init, mu)]
+            # (values of `mu_new` are only used for the convergence check
+            # before the first update, so it is enough to make them differ)
+            mu_new = [tf.zeros_like(q) for q in mu]
 
             # run mean-field updates until convergence
             def cond(step, max_step, tol, X_batch, mu, mu_new):
@@ -456,33 +616,84 @@ class DBM(EnergyBasedModel):
                                                          update_v=False, sample=False)
                 return step + 1, max_step, tol, X_batch, mu_new, mu  # swap mu and mu_new
 
-            with tf.control_dependencies(init_ops):  # make sure mu's are initialized
-                i = tf.constant(0)
-                n_mf_updates, _, _, _, mu, _ = \
-                    tf.while_loop(cond=cond, body=body,
-                                  loop_vars=[i,
-                                             self._max_mf_updates,
-                                             self._mf_tol,
-                                             self._X_batch,
-                                             self._mu, self._mu_new],
-                                  shape_invariants=[i.get_shape(),
-                                                    self._max_mf_updates.get_shape(),
-                                                    self._mf_tol.get_shape(),
-                                                    self._X_batch.get_shape(),
-                                                    [tf.TensorShape([None, n]) for n in self.n_hiddens_],
-                                                    [tf.TensorShape([None, n]) for n in self.n_hiddens_]],
-                                  back_prop=False,
-                                  parallel_iterations=1,
-                                  name='mean_field_updates')
-                mu_updates = [self._mu[i].assign(mu[i]) for i in xrange(self.n_layers_)]
-            return n_mf_updates, mu_updates
+            i = tf.constant(0)
+            n_mf_updates, _, _, _, mu, _ = \
+                tf.while_loop(cond=cond, body=body,
+                              loop_vars=[i,
+                                         self._max_mf_updates,
+                                         self._mf_tol,
+                                         X_batch,
+                                         mu, mu_new],
+                              shape_invariants=[i.get_shape(),
+                                                self._max_mf_updates.get_shape(),
+                                                self._mf_tol.get_shape(),
+                                                X_batch.get_shape(),
+                                                [tf.TensorShape([None, n]) for n in self.n_hiddens_],
+                                                [tf.TensorShape([None, n]) for n in self.n_hiddens_]],
+                              back_prop=False,
+                              parallel_iterations=1,
+                              name='mean_field_updates')
+            return n_mf_updates, mu
+
+    def _make_energy(self, v, H):
+        """Compute energy of joint states (per sample)."""
+        with tf.name_scope('energy'):
+            E = self._v_layer.energy(v, self._vb)
+            x = v
+            for i in xrange(self.n_layers_):
+                E += self._h_layers[i].energy(H[i], self._hb[i])
+                E -= tf.reduce_sum(tf.matmul(x, self._W[i]) * H[i], axis=1)
+                x = H[i]
+        return E
+
+    def _make_tempered_particles_update(self, n_steps):
+        """Update negative particles together with their replicas
+        at lower inverse temperatures (parallel tempering), proposing
+        swaps of adjacent replicas after each Gibbs step. Swaps are valid
+        only for sampled states, hence states of all the layers are sampled.
+        """
+        M = self.n_particles
+        betas, beta = self._make_replica_betas(self.pt_betas, M)
+
+        with tf.name_scope('gibbs_chain'):
+            def cond(step, max_step, v, H, n_accepted, n_proposed):
+                return step < max_step
+
+            def body(step, max_step, v, H, n_accepted, n_proposed):
+                _, _, v, H = self._make_gibbs_step(v, H, v, list(H), update_v=True,
+                                                   sample=True, sample_all=True, beta=beta)
+                states, a, p = self._make_replica_swaps([v] + H, self._make_energy(v, H),
+                                                        betas, M, parity=step % 2)
+                return step + 1, max_step, states[0], states[1:], n_accepted + a, n_proposed + p
+
+            n_pairs = len(self.pt_betas) - 1
+            _, _, v, H, n_accepted, n_proposed = \
+                tf.while_loop(cond=cond, body=body,
+                              loop_vars=[tf.constant(0),
+                                         n_steps,
+                                         tf.concat([self._v, self._v_tempered], 0),
+                                         [tf.concat([h, h_t], 0) for h, h_t in zip(self._H, self._H_tempered)],
+                                         tf.zeros([n_pairs], dtype=self._tf_dtype),
+                                         tf.zeros([n_pairs], dtype=self._tf_dtype)],
+                              parallel_iterations=1,
+                              back_prop=False)
+            self._pt_swap_rate = tf.reduce_sum(n_accepted) / tf.maximum(tf.reduce_sum(n_proposed), 1.)
+
+            v_update = self._v.assign(v[:M])
+            v_tempered_update = self._v_tempered.assign(v[M:])
+            H_updates = [self._H[i].assign(H[i][:M]) for i in xrange(self.n_layers_)]
+            H_tempered_updates = [self._H_tempered[i].assign(H[i][M:]) for i in xrange(self.n_layers_)]
+        return v_update, H_updates, v_tempered_update, H_tempered_updates
 
     def _make_particles_update(self, n_steps=None, sample=True, G_fed=False):
         """Update negative particles by running Gibbs sampler
-        for specified number of steps.
+        for specified number of steps (with parallel tempering
+        if `pt_betas` are provided and states are sampled).
         """
         if n_steps is None:
             n_steps = self._n_gibbs_steps
+        if self.pt_betas is not None and sample:
+            return self._make_tempered_particles_update(n_steps)
 
         with tf.name_scope('gibbs_chain'):
             def cond(step, max_step, v, H, v_new, H_new):
@@ -512,20 +723,33 @@ class DBM(EnergyBasedModel):
         T_norm = tf.norm(T, axis=0)
         return T * tf.minimum(T_norm, self._max_norm) / tf.maximum(T_norm, 1e-8), T_norm
 
+    def _make_transform_op(self):
+        # encoded data and reconstructions, used by the transform and reconstruct
+        # methods: only mean-field updates for the input batch are run, w/o touching
+        # negative particles (or any other variables)
+        with tf.name_scope('transform'):
+            _, mu = self._make_mf(self._X_batch)
+            transform_op = tf.identity(mu[-1])
+            tf.add_to_collection('transform_op', transform_op)
+
+            T = tf.matmul(a=mu[0], b=self._W[0], transpose_b=True)
+            v_means = self._v_layer.activation(T, self._vb)
+            v_means = tf.identity(v_means, name='x_reconstruction')
+            tf.add_to_collection('reconstruction', v_means)
+
     def _make_train_op(self):
         # run mean-field updates for current mini-batch
-        n_mf_updates, mu_updates = self._make_mf()
+        n_mf_updates, self._mu = self._make_mf(self._X_batch, self._mu_init, self._mu_init_mask)
+        with tf.name_scope('variational_params'):
+            for i in xrange(self.n_layers_):
+                tf.summary.histogram('mu_hist', self._mu[i], collections=[HISTOGRAM_SUMMARIES])
+                tf.add_to_collection('mu', self._mu[i])
 
         # update negative particles by running Gibbs sampler
         # for specified number of steps
         v_update, H_updates, v_new_update, H_new_updates = self._make_particles_update()
 
-        with tf.control_dependencies([v_update, v_new_update] + H_updates + H_new_updates + mu_updates):
-
-            # encoded data, used by the transform method
-            with tf.name_scope('transform'):
-                transform_op = tf.identity(self._mu[-1])
-                tf.add_to_collection('transform_op', transform_op)
+        with tf.control_dependencies([v_update, v_new_update] + H_updates + H_new_updates):
 
             # visualize particles
             if self.display_particles:
@@ -537,17 +761,22 @@ class DBM(EnergyBasedModel):
                                                self.v_shape[0], self.v_shape[1]])
                     V_display = tf.transpose(V_display, [0, 2, 3, 1])
                     V_display = tf.cast(V_display, tf.float32)
-                    tf.summary.image('visible_activations_means', V_display, max_outputs=self.display_filters)
+                    tf.summary.image('visible_activations_means', V_display, max_outputs=self.display_filters,
+                                     collections=[IMAGE_SUMMARIES])
 
                     for i in xrange(self.n_layers_):
                         h_means_display = H_means[i][:, :self.display_particles]
                         h_means_display = tf.cast(h_means_display, tf.float32)
                         h_means_display = tf.expand_dims(h_means_display, 0)
                         h_means_display = tf.expand_dims(h_means_display, -1)
-                        tf.summary.image('hidden_activations_means', h_means_display)
+                        tf.summary.image('hidden_activations_means', h_means_display,
+                                         collections=[IMAGE_SUMMARIES])
 
             # compute gradients estimates (= positive - negative associations)
             with tf.name_scope('grads_estimates'):
+                # number of training examples might not be divisible by batch size
+                N = tf.cast(tf.shape(self._X_batch)[0], dtype=self._tf_dtype)
+
                 # visible bias
                 with tf.name_scope('dvb'):
                     dvb = tf.reduce_mean(self._X_batch, axis=0) - tf.reduce_mean(self._v, axis=0)
@@ -555,7 +784,7 @@ class DBM(EnergyBasedModel):
                 dW = []
                 # first layer of weights
                 with tf.name_scope('dW'):
-                    dW_0_positive = tf.matmul(a=self._X_batch, b=self._mu[0], transpose_a=True) / self._N
+                    dW_0_positive = tf.matmul(a=self._X_batch, b=self._mu[0], transpose_a=True) / N
                     dW_0_negative = tf.matmul(a=self._v, b=self._H[0], transpose_a=True) / self._M
                     dW_0 = (dW_0_positive - dW_0_negative) - self._l2 * self._W[0]
                     dW.append(dW_0)
@@ -563,7 +792,7 @@ class DBM(EnergyBasedModel):
                 # ... rest of them
                 for i in xrange(1, self.n_layers_):
                     with tf.name_scope('dW'):
-                        dW_i_positive = tf.matmul(a=self._mu[i - 1], b=self._mu[i], transpose_a=True) / self._N
+                        dW_i_positive = tf.matmul(a=self._mu[i - 1], b=self._mu[i], transpose_a=True) / N
                         dW_i_negative = tf.matmul(a=self._H[i - 1], b=self._H[i], transpose_a=True) / self._M
                         dW_i = (dW_i_positive - dW_i_negative) - self._l2 * self._W[i]
                         dW.append(dW_i)
@@ -629,7 +858,6 @@ class DBM(EnergyBasedModel):
                 msre = tf.reduce_mean(tf.square(self._X_batch - v_means))
                 tf.add_to_collection('msre', msre)
 
-            tf.add_to_collection('reconstruction', v_means)
             tf.add_to_collection('n_mf_updates', n_mf_updates)
 
             # collect summaries
@@ -637,6 +865,8 @@ class DBM(EnergyBasedModel):
             tf.summary.scalar('n_mf_updates', n_mf_updates)
             for i in xrange(self.n_layers_):
                 tf.summary.scalar('W_norm', W_norms[i])
+            if self.pt_betas is not None:
+                tf.summary.scalar('pt_swap_rate', self._pt_swap_rate)
 
     def _make_sample_v(self):
         with tf.name_scope('sample_v'):
@@ -738,23 +968,23 @@ class DBM(EnergyBasedModel):
     def _make_log_proba(self):
         with tf.name_scope('log_proba'):
 
-            n_mf_updates, mu_updates = self._make_mf()
-            with tf.control_dependencies(mu_updates):
-                t1 = tf.matmul(self._X_batch, self._W[0])
-                minus_E = tf.reduce_sum(t1 * self._mu[0], axis=1)
-                t2 = tf.matmul(self._mu[0], self._W[1])
-                minus_E += tf.reduce_sum(t2 * self._mu[1], axis=1)
-                minus_E += tf.einsum('ij,j->i', self._X_batch, self._vb)
-                minus_E += tf.einsum('ij,j->i', self._mu[0], self._hb[0])
-                minus_E += tf.einsum('ij,j->i', self._mu[1], self._hb[1])
+            _, mu = self._make_mf(self._X_batch)
+
+            t1 = tf.matmul(self._X_batch, self._W[0])
+            minus_E = tf.reduce_sum(t1 * mu[0], axis=1)
+            t2 = tf.matmul(mu[0], self._W[1])
+            minus_E += tf.reduce_sum(t2 * mu[1], axis=1)
+            minus_E += tf.einsum('ij,j->i', self._X_batch, self._vb)
+            minus_E += tf.einsum('ij,j->i', mu[0], self._hb[0])
+            minus_E += tf.einsum('ij,j->i', mu[1], self._hb[1])
 
-                s1 = tf.clip_by_value(self._mu[0], 1e-7, 1. - 1e-7)
-                s2 = tf.clip_by_value(self._mu[1], 1e-7, 1. - 1e-7)
-                S1 = -s1 * tf.log(s1) - (1. - s1) * tf.log(1. - s1)
-                S2 = -s2 * tf.log(s2) - (1. - s2) * tf.log(1. - s2)
-                H = tf.reduce_sum(S1, axis=1) + tf.reduce_sum(S2, axis=1)
+            s1 = tf.clip_by_value(mu[0], 1e-7, 1. - 1e-7)
+            s2 = tf.clip_by_value(mu[1], 1e-7, 1. - 1e-7)
+            S1 = -s1 * tf.log(s1) - (1. - s1) * tf.log(1. - s1)
+            S2 = -s2 * tf.log(s2) - (1. - s2) * tf.log(1. - s2)
+            H = tf.reduce_sum(S1, axis=1) + tf.reduce_sum(S2, axis=1)
 
-                log_p = minus_E + H
+            log_p = minus_E + H
 
         tf.add_to_collection('log_proba', log_p)
 
@@ -763,6 +993,7 @@ class DBM(EnergyBasedModel):
         self._make_placeholders()
         self._make_vars()
 
+        self._make_transform_op()
         self._make_train_op()
         self._make_sample_v()
         self._make_ais()
@@ -792,24 +1023,70 @@ class DBM(EnergyBasedModel):
 
     def _train_epoch(self, X):
         train_msres, train_n_mf_updates = [], []
-        for X_batch in batch_iter(X, self.batch_size, verbose=self.verbose):
+        # feeds other than input batch do not change during an epoch
+        feed_dict = self._make_tf_feed_dict()
+        if self.batch_offset_ == 0 and self.shuffle:
+            # permutation depends only on the seed and epoch,
+            # hence it is the same if training is resumed from checkpoint
+            rng = self._rng if self.random_seed is None else RNG(seed=[self.random_seed, self.epoch_])
+            self.order_ = rng.permutation(len(X))
+        # augmentations of data augmented on the fly depend only on the epoch as well
+        if hasattr(X, 'set_epoch'):
+            X.set_epoch(self.epoch_)
+        for X_batch in batch_iter(X, self.batch_size, verbose=self.verbose,
+                                  indices=self.order_, n_prefetch=self.n_prefetch_batches,
+                                  dtype=self._np_dtype, start_batch=self.batch_offset_):
             self.iter_ += 1
-            if self.iter_ % self.train_metrics_every_iter == 0:
-                msre, n_mf_upds, _, s = self._tf_session.run([self._msre, self._n_mf_updates,
-                                                              self._train_op, self._tf_merged_summaries],
-                                                              feed_dict=self._make_tf_feed_dict(X_batch))
-                train_msres.append(msre)
-                train_n_mf_updates.append(n_mf_upds)
-                self._tf_train_writer.add_summary(s, self.iter_)
+            feed_dict['input_data/X_batch:0'] = X_batch
+            metrics_ops = []
+            if self.train_metrics_every_iter and self.iter_ % self.train_metrics_every_iter == 0:
+                metrics_ops = [self._msre, self._n_mf_updates]
+
+            # warm-start mean-field from cached states of the batch examples
+            cache_ops = []
+            if self._mf_cache is not None:
+                start = self.batch_offset_ * self.batch_size
+                ids = np.arange(start, min(start + self.batch_size, len(X))) if self.order_ is None else \
+                      self.order_[start:(start + self.batch_size)]
+                mu_init, cached = self._mf_cache.get(ids)
+                for i, q in enumerate(mu_init):
+                    feed_dict['input_data/mu_init_{0}:0'.format(i)] = q
+                feed_dict['input_data/mu_init_mask:0'] = cached
+                cache_ops = [self._n_mf_updates] + self._mu
+
+            summary_ops = self._summaries_due(self.iter_,
+                                              scalars_every_iter=self.train_metrics_every_iter,
+                                              histograms_every_iter=self.histograms_every_iter,
+                                              images_every_iter=self.images_every_iter)
+            if metrics_ops or cache_ops or summary_ops:
+                outputs = self._tf_run(metrics_ops + cache_ops + summary_ops + [self._train_op],
+                                       feed_dict=feed_dict, step=self.iter_)
+                if metrics_ops:
+                    train_msres.append(outputs[0])
+                    train_n_mf_updates.append(outputs[1])
+                if cache_ops:
+                    cache_outputs = outputs[len(metrics_ops):(len(metrics_ops) + len(cache_ops))]
+                    self._mf_cache.add_n_mf_updates(cache_outputs[0], cached)
+                    self._mf_cache.put(ids, cache_outputs[1:])
+                for s in outputs[(len(metrics_ops) + len(cache_ops)):-1]:
+                    self._get_tf_writer(self._train_summary_dirpath).add_summary(s, self.iter_)
             else:
-                self._tf_session.run(self._train_op,
-                                     feed_dict=self._make_tf_feed_dict(X_batch))
+                self._tf_run(self._train_op, feed_dict=feed_dict, step=self.iter_)
+            self.batch_offset_ += 1
+
+            # save checkpoint if needed
+            if self.checkpoint_every_iter and self.iter_ % self.checkpoint_every_iter == 0 or \
+               self.checkpoint_every_sec and time.time() - self._checkpoint_time >= self.checkpoint_every_sec:
+                self._save_checkpoint()
+                self._checkpoint_time = time.time()
+        self.batch_offset_ = 0
+        self.order_ = None
         return (np.mean(train_msres) if train_msres else None,
                 np.mean(train_n_mf_updates) if train_n_mf_updates else None)
 
     def _run_val_metrics(self, X_val):
         val_msres, val_n_mf_updates = [], []
-        for X_vb in batch_iter(X_val, batch_size=self.batch_size):
+        for X_vb in batch_iter(X_val, batch_size=self.batch_size, dtype=self._np_dtype):
             msre, n_mf_upds = self._tf_session.run([self._msre, self._n_mf_updates],
                                                     feed_dict=self._make_tf_feed_dict(X_vb))
             val_msres.append(msre)
@@ -820,20 +1097,66 @@ class DBM(EnergyBasedModel):
             summary_pb2.Summary.Value(tag='mean_squared_recon_error', simple_value=mean_msre),
             summary_pb2.Summary.Value(tag='n_mf_updates', simple_value=mean_n_mf_updates),
         ])
-        self._tf_val_writer.add_summary(s, self.iter_)
+        self._get_tf_writer(self._val_summary_dirpath).add_summary(s, self.iter_)
         return mean_msre, mean_n_mf_updates
 
+    def _init_mf_cache(self, X):
+        from boltzmann_machines.utils.augmentation import AugmentedArray
+        X_raw = X
+        while isinstance(X_raw, LazyArray):
+            X_raw = X_raw.X
+        if isinstance(X_raw, AugmentedArray):
+            raise ValueError('`mf_cache` cannot be used with `AugmentedArray`, '
+                             'as its examples change every epoch')
+        n_samples = len(X)
+        if self._mf_cache is None or self._mf_cache.n_samples != n_samples or \
+           (self._mf_cache.dirpath is None) != (self.mf_cache == 'memory'):
+            dirpath = os.path.join(self._model_dirpath, 'mf_cache') if self.mf_cache == 'mmap' else None
+            self._mf_cache = MeanFieldCache(n_samples, self.n_hiddens_,
+                                            dtype=self._np_dtype, dirpath=dirpath)
+        # cached states are only valid for the same data and weights
+        # (identified by the iteration they were stored at)
+        digest = hashlib.md5(np.asarray(X[[0, n_samples - 1]], dtype=self._np_dtype).tobytes())
+        self._mf_cache_data_digest = digest.hexdigest()
+        self._mf_cache.check_key(self._mf_cache_key())
+
+    def _mf_cache_key(self):
+        return dict(iter_=self.iter_, data=self._mf_cache_data_digest)
+
+    def _run_mf_cache_stats(self):
+        """Write and return statistics of mean-field cache for the last epoch."""
+        stats = self._mf_cache.stats()
+        self._mf_cache.flush(key=self._mf_cache_key())
+        summary_value = [summary_pb2.Summary.Value(tag='mf_cache/{0}'.format(k), simple_value=v)
+                         for k, v in sorted(stats.items()) if v is not None]
+        if summary_value:
+            s = summary_pb2.Summary(value=summary_value)
+            self._get_tf_writer(self._train_summary_dirpath).add_summary(s, self.iter_)
+        return stats
+
     def _fit(self, X, X_val=None, *args, **kwargs):
         # load ops requested
         self._train_op = tf.get_collection('train_op')[0]
         self._msre = tf.get_collection('msre')[0]
         self._n_mf_updates = tf.get_collection('n_mf_updates')[0]
+        self._mu = tf.get_collection('mu')
+
+        if self.mf_cache:
+            self._init_mf_cache(X)
+        else:
+            self._mf_cache = None
 
         # main loop
         val_msre, val_n_mf_updates = None, None
-        for self.epoch_ in epoch_iter(start_epoch=self.epoch_, max_epoch=self.max_epoch,
+        # resume interrupted epoch if needed
+        start_epoch = self.epoch_ - 1 if self.batch_offset_ else self.epoch_
+        self._checkpoint_time = time.time()
+        for self.epoch_ in epoch_iter(start_epoch=start_epoch, max_epoch=self.max_epoch,
                                       verbose=self.verbose):
+            if self._mf_cache is not None:
+                self._mf_cache.reset_stats()
             train_msre, train_n_mf_updates = self._train_epoch(X)
+            mf_cache_stats = self._run_mf_cache_stats() if self._mf_cache is not None else {}
 
             # run validation metrics if needed
             if X_val is not None and self.epoch_ % self.val_metrics_every_epoch == 0:
@@ -850,38 +1173,63 @@ class DBM(EnergyBasedModel):
                     s += "; val.msre: {0:.5f}".format(val_msre)
                 if val_n_mf_updates:
                     s += "; val.n_mf_upds: {0:.1f}".format(val_n_mf_updates)
+                if mf_cache_stats.get('hit_rate') is not None:
+                    s += "; mf_cache.hit_rate: {0:.3f}".format(mf_cache_stats['hit_rate'])
+                if mf_cache_stats.get('n_mf_updates_saved') is not None:
+                    s += "; mf_cache.n_mf_upds_saved: {0:.1f}".format(mf_cache_stats['n_mf_updates_saved'])
                 write_during_training(s)
 
             # save if needed
             if self.save_after_each_epoch:
-                self._save_model(global_step=self.epoch_)
+                self._save_checkpoint(global_step=self.epoch_)
 
     @run_in_tf_session()
-    def transform(self, X, np_dtype=None):
-        """Compute hidden units' (from last layer) activation probabilities."""
+    def transform(self, X, np_dtype=None, batch_size=None, profile_iters=None):
+        """Compute hidden units' (from last layer) activation probabilities.
+
+        Parameters
+        ----------
+        batch_size : None or positive int
+            Input batch size for inference, if None use `self.batch_size`.
+        profile_iters : None, positive int or iterable of int
+            If provided, trace batches (every `profile_iters`-th one if int,
+            otherwise ones with these indices), and write their timelines
+            and per-scope time summary to `logs/profile` (see `TFProfiler`).
+        """
         np_dtype = np_dtype or self._np_dtype
+        batch_size = batch_size or self.batch_size
 
         self._transform_op = tf.get_collection('transform_op')[0]
         G = np.zeros((len(X), self.n_hiddens_[-1]), dtype=np_dtype)
         start = 0
-        for X_b in batch_iter(X, batch_size=self.batch_size,
-                              verbose=self.verbose, desc='transform'):
-            G_b = self._transform_op.eval(feed_dict=self._make_tf_feed_dict(X_b))
-            G[start:(start + self.batch_size)] = G_b
-            start += self.batch_size
+        self._start_profiling(profile_iters, tag='transform')
+        try:
+            for i, X_b in enumerate(batch_iter(X, batch_size=batch_size,
+                                               verbose=self.verbose, desc='transform',
+                                               n_prefetch=self.n_prefetch_batches,
+                                               dtype=self._np_dtype)):
+                G_b = self._tf_run(self._transform_op, feed_dict={'input_data/X_batch:0': X_b}, step=i)
+                G[start:(start + batch_size)] = G_b
+                start += batch_size
+        finally:
+            self._stop_profiling()
         return G
 
-    @run_in_tf_session(update_seed=True)
-    def reconstruct(self, X):
+    @run_in_tf_session()
+    def reconstruct(self, X, batch_size=None):
         """Compute p(v|h_0=q, h...)=p(v|h_0=q), where q=p(h_0|v=x)"""
+        batch_size = batch_size or self.batch_size
+
         self._reconstruction = tf.get_collection('reconstruction')[0]
-        X_recon = np.zeros_like(X)
+        X_recon = np.zeros((len(X), self.n_visible_), dtype=self._np_dtype)
         start = 0
-        for X_b in batch_iter(X, batch_size=self.batch_size,
-                              verbose=self.verbose, desc='reconstruction'):
-            X_recon_b = self._reconstruction.eval(feed_dict=self._make_tf_feed_dict(X_b))
-            X_recon[start:(start + self.batch_size)] = X_recon_b
-            start += self.batch_size
+        for X_b in batch_iter(X, batch_size=batch_size,
+                              verbose=self.verbose, desc='reconstruction',
+                              n_prefetch=self.n_prefetch_batches,
+                              dtype=self._np_dtype):
+            X_recon_b = self._reconstruction.eval(feed_dict={'input_data/X_batch:0': X_b})
+            X_recon[start:(start + batch_size)] = X_recon_b
+            start += batch_size
         return X_recon
 
     @run_in_tf_session(update_seed=True)
@@ -939,7 +1287,7 @@ class DBM(EnergyBasedModel):
         return log_mean, (log_low, log_high), values
 
     @run_in_tf_session()
-    def log_proba(self, X_test, log_Z):
+    def log_proba(self, X_test, log_Z, batch_size=None):
         """Estimate variational lower-bound on a test set, as in [5].
         Currently implemented only for 2-layer binary BM.
         """
@@ -947,17 +1295,44 @@ class DBM(EnergyBasedModel):
         for L in [self._v_layer] + self._h_layers:
             assert isinstance(L, BernoulliLayer)
 
+        batch_size = batch_size or self.batch_size
+
         self._log_proba = tf.get_collection('log_proba')[0]
         P = np.zeros(len(X_test))
         start = 0
-        for X_b in batch_iter(X_test, batch_size=self.batch_size, verbose=self.verbose):
-            P_b = self._log_proba.eval(feed_dict=self._make_tf_feed_dict(X_b))
-            P[start:(start + self.batch_size)] = P_b
-            start += self.batch_size
+        for X_b in batch_iter(X_test, batch_size=batch_size, verbose=self.verbose,
+                              dtype=self._np_dtype):
+            P_b = self._log_proba.eval(feed_dict={'input_data/X_batch:0': X_b})
+            P[start:(start + batch_size)] = P_b
+            start += batch_size
         return P - log_Z
 
+    def export_numpy(self, filepath):
+        """Export weights, biases, parameters of layers and mean-field
+        settings to `filepath` (.npz), to be used for inference w/o
+        TensorFlow. Layers are known only once `rbms` are loaded.
+
+        Returns
+        -------
+        dbm : runtime.NumpyDBM
+        """
+        if not hasattr(self, '_v_layer'):
+            raise RuntimeError('`load_rbms` must be called before calling `export_numpy`')
+        weights = self.get_tf_params(scope='weights')
+        suffix = lambda i: '_{0}'.format(i) if i else ''
+        dbm = NumpyDBM(W=[weights['W' + suffix(i)] for i in xrange(self.n_layers_)],
+                       vb=weights['vb'],
+                       hb=[weights['hb' + suffix(i)] for i in xrange(self.n_layers_)],
+                       v_layer=self._v_layer.export_params(),
+                       h_layers=[L.export_params() for L in self._h_layers],
+                       max_mf_updates=self.max_mf_updates,
+                       mf_tol=self.mf_tol,
+                       gibbs_schedule=self.gibbs_schedule)
+        return dbm.save(filepath)
+
 
 if __name__ == '__main__':
     # run corresponding tests
     from boltzmann_machines.utils.testing import run_tests
-    run_tests(__file__)
+    from tests import test_dbm as t
+    run_tests(__file__, t)
@@ -1,8 +1,19 @@
+import numpy as np
+import tensorflow as tf
+
 from base import TensorFlowModel
+from layers import GaussianLayer
 
 
 class EnergyBasedModel(TensorFlowModel):
-    """A generic Energy-based model with hidden variables."""
+    """A generic Energy-based model with hidden variables.
+
+    References
+    ----------
+    [1] G. Desjardins, A. Courville, Y. Bengio, P. Vincent and O. Delalleau.
+        Parallel tempering for training of restricted Boltzmann machines.
+        In AISTATS, pp. 145-152. 2010
+    """
     def __init__(self, *args, **kwargs):
         super(EnergyBasedModel, self).__init__(*args, **kwargs)
 
@@ -15,3 +26,89 @@ class EnergyBasedModel(TensorFlowModel):
         v : (batch_size, n_visible) tf.Tensor
         """
         raise NotImplementedError('`free_energy` is not implemented')
+
+    @staticmethod
+    def _check_pt_betas(pt_betas):
+        """Validate inverse temperatures for parallel tempering."""
+        if pt_betas is None:
+            return None
+        pt_betas = [float(beta) for beta in pt_betas]
+        if len(pt_betas) < 2 or pt_betas[0] != 1. or \
+           any(b1 <= b2 for b1, b2 in zip(pt_betas[:-1], pt_betas[1:])) or pt_betas[-1] <= 0.:
+            raise ValueError('`pt_betas` must be at least 2 strictly decreasing '
+                             'inverse temperatures in (0, 1], starting with 1, got {0}'.format(pt_betas))
+        return pt_betas
+
+    @staticmethod
+    def _check_pt_layers(layers):
+        """Check that parallel tempering can be used with `layers`.
+
+        Swaps assume that replicas at inverse temperature beta are sampled
+        from exp(-beta * E). For Gaussian units this holds only for unit
+        variance, since with `sigma` != 1 the conditionals used here
+        (mean `x * sigma + b`) do not correspond to a joint energy.
+        """
+        for layer in layers:
+            if isinstance(layer, GaussianLayer) and np.any(layer.sigma != 1.):
+                raise ValueError('parallel tempering requires Gaussian units '
+                                 'with `sigma` = 1, got {0}'.format(layer.sigma))
+
+    def _make_replica_betas(self, pt_betas, n_chains):
+        """Inverse temperature of each row of replicas stacked along
+        the first axis (first `n_chains` rows are at `pt_betas[0]` etc.).
+
+        Returns
+        -------
+        betas : (n_replicas,) tf.Tensor
+        beta : (n_replicas * n_chains, 1) tf.Tensor
+        """
+        with tf.name_scope('replica_betas'):
+            betas = tf.constant(pt_betas, dtype=self._tf_dtype, name='pt_betas')
+            beta = tf.tile(tf.expand_dims(betas, 1), [1, n_chains])
+            beta = tf.reshape(beta, [-1, 1], name='beta')
+        return betas, beta
+
+    def _make_replica_swaps(self, states, energy, betas, n_chains, parity):
+        """Propose to swap states of replicas at adjacent inverse
+        temperatures using Metropolis rule (parallel tempering [1]).
+        All the chains and pairs of replicas are processed at once.
+
+        Parameters
+        ----------
+        states : [(n_replicas * n_chains, n_units) tf.Tensor]
+            States of the layers, replicas stacked along the first axis.
+        energy : (n_replicas * n_chains,) tf.Tensor
+            Energy of the joint states (at unit inverse temperature).
+        betas : (n_replicas,) tf.Tensor
+            Inverse temperatures in decreasing order.
+        n_chains : positive int
+        parity : int tf.Tensor
+            Swaps are proposed between replicas `2k + parity` and
+            `2k + parity + 1`, hence pairs do not overlap; alternate it
+            between steps for replicas to travel across all temperatures.
+
+        Returns
+        -------
+        states : [(n_replicas * n_chains, n_units) tf.Tensor]
+            States after accepted swaps.
+        n_accepted, n_proposed : (n_replicas - 1,) tf.Tensor
+            Number of accepted and proposed swaps for each pair of replicas.
+        """
+        with tf.name_scope('replica_swaps'):
+            K = betas.get_shape()[0].value
+            E = tf.reshape(energy, [K, n_chains])
+            log_r = tf.expand_dims(betas[:-1] - betas[1:], 1) * (E[:-1] - E[1:])
+            u = tf.random_uniform(tf.shape(log_r), dtype=self._tf_dtype, seed=self.make_random_seed())
+            pairs = tf.equal(tf.range(K - 1) % 2, parity)
+            accept = tf.logical_and(tf.expand_dims(pairs, 1), tf.log(u) < log_r)
+
+            # for each chain, index of the replica to take state from
+            a = tf.cast(accept, tf.int32)
+            zeros = tf.zeros([1, n_chains], dtype=tf.int32)
+            src = tf.expand_dims(tf.range(K), 1) + tf.concat([a, zeros], 0) - tf.concat([zeros, a], 0)
+            ind = tf.reshape(src * n_chains + tf.expand_dims(tf.range(n_chains), 0), [-1])
+            states = [tf.gather(T, ind) for T in states]
+
+            n_accepted = tf.reduce_sum(tf.cast(accept, self._tf_dtype), axis=1)
+            n_proposed = float(n_chains) * tf.cast(pairs, self._tf_dtype)
+        return states, n_accepted, n_proposed
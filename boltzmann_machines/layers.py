@@ -27,14 +27,39 @@ class BaseLayer(DtypeMixin):
         """
         raise NotImplementedError('`activation` is not implemented')
 
-    def _sample(self, means):
+    def tempered_activation(self, x, b, beta):
+        """Compute activation of states according to their distribution
+        at inverse temperature(s) `beta`, i.e. conditional proportional
+        to exp(-`beta` * E). States are then sampled with `sample(means, beta)`.
+
+        Parameters
+        ----------
+        x : (n_units,) tf.Tensor
+            Total input received (excluding bias).
+        b : (n_units,) tf.Tensor
+            Bias.
+        beta : float or (batch_size, 1) tf.Tensor
+            Inverse temperature(s).
+        """
+        return self.activation(x=beta * x, b=beta * b)
+
+    def _sample(self, means, beta=None):
         """Sample states of the units by combining output from 2 previous functions."""
         raise NotImplementedError('`sample` is not implemented')
 
-    def sample(self, means):
-        T = self._sample(means).sample()
+    def sample(self, means, beta=None):
+        T = self._sample(means, beta=beta).sample()
         return tf.cast(T, dtype=self._tf_dtype)
 
+    def energy(self, x, b):
+        """Compute terms of the energy that depend only on the states
+        `x` of this layer (per sample), given bias `b`."""
+        raise NotImplementedError('`energy` is not implemented')
+
+    def export_params(self):
+        """Parameters of the layer for `runtime` (NumPy inference)."""
+        raise NotImplementedError('`export_params` is not implemented')
+
 
 class BernoulliLayer(BaseLayer):
     def __init__(self, *args, **kwargs):
@@ -47,9 +72,15 @@ class BernoulliLayer(BaseLayer):
     def activation(self, x, b):
         return tf.nn.sigmoid(x + b)
 
-    def _sample(self, means):
+    def _sample(self, means, beta=None):
         return Bernoulli(probs=means)
 
+    def energy(self, x, b):
+        return -tf.einsum('ij,j->i', x, b)
+
+    def export_params(self):
+        return dict(type='bernoulli')
+
 
 class MultinomialLayer(BaseLayer):
     def __init__(self, n_samples=100, *args, **kwargs):
@@ -65,10 +96,16 @@ class MultinomialLayer(BaseLayer):
     def activation(self, x, b):
         return self.n_samples * tf.nn.softmax(x + b)
 
-    def _sample(self, means):
+    def _sample(self, means, beta=None):
         probs = tf.to_float(means / tf.reduce_sum(means))
         return Multinomial(total_count=self.n_samples, probs=probs)
 
+    def energy(self, x, b):
+        return -tf.einsum('ij,j->i', x, b)
+
+    def export_params(self):
+        return dict(type='multinomial', n_samples=self.n_samples)
+
 
 class GaussianLayer(BaseLayer):
     def __init__(self, sigma, *args, **kwargs):
@@ -85,5 +122,20 @@ class GaussianLayer(BaseLayer):
         t = x * self.sigma + b
         return t
 
-    def _sample(self, means):
-        return Normal(loc=means, scale=tf.cast(self.sigma, dtype=self._tf_dtype))
+    def tempered_activation(self, x, b, beta):
+        # exp(-beta * E) only scales the variance of a Gaussian
+        # by 1/beta (see `_sample`), the mean stays the same
+        return self.activation(x=x, b=b)
+
+    def _sample(self, means, beta=None):
+        scale = tf.cast(self.sigma, dtype=self._tf_dtype)
+        if beta is not None:
+            scale /= tf.sqrt(beta)
+        return Normal(loc=means, scale=scale)
+
+    def energy(self, x, b):
+        T = tf.square(x - b) / tf.cast(np.square(self.sigma), dtype=self._tf_dtype)
+        return 0.5 * tf.reduce_sum(T, axis=1)
+
+    def export_params(self):
+        return dict(type='gaussian', sigma=self.sigma)
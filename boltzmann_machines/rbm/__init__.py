@@ -1,2 +1,3 @@
 from base_rbm import *
 from rbm import *
+from stacked_rbm import *
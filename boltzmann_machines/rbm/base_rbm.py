@@ -1,10 +1,13 @@
+import time
 import numpy as np
 import tensorflow as tf
 from tensorflow.core.framework import summary_pb2
 
 from boltzmann_machines import EnergyBasedModel
-from boltzmann_machines.base import run_in_tf_session, is_attribute_name
-from boltzmann_machines.utils import (make_list_from, batch_iter, epoch_iter,
+from boltzmann_machines.base import (run_in_tf_session, is_attribute_name,
+                                     HISTOGRAM_SUMMARIES, IMAGE_SUMMARIES)
+from boltzmann_machines.runtime import NumpyRBM
+from boltzmann_machines.utils import (RNG, make_list_from, batch_iter, epoch_iter,
                                       write_during_training)
 from boltzmann_machines.utils.testing import assert_len, assert_shape
 
@@ -12,7 +15,8 @@ from boltzmann_machines.utils.testing import assert_len, assert_shape
 class BaseRBM(EnergyBasedModel):
     """
     A generic implementation of Restricted Boltzmann Machine
-    with k-step Contrastive Divergence (CD-k) learning algorithm.
+    with k-step Contrastive Divergence (CD-k) learning algorithm,
+    or its persistent variants (PCD-k [5], Fast PCD [6]).
 
     Parameters
     ----------
@@ -27,12 +31,44 @@ class BaseRBM(EnergyBasedModel):
         Visible and hidden unit bias(es).
     n_gibbs_steps : positive int
         Number of Gibbs steps per iteration (per weight update).
+    learning_algorithm : {'cd', 'pcd', 'fpcd'}
+        If 'cd', negative phase Gibbs chains start from the data.
+        If 'pcd', `n_particles` persistent chains (stored as tf variables,
+        hence also in checkpoints) are continued from their previous states
+        instead, which usually makes 1 Gibbs step per weight update enough.
+        If 'fpcd', persistent chains are run with the sum of regular
+        and "fast" weights, which are updated with the same gradient
+        estimates, but with `fast_learning_rate` and strong decay,
+        which improves mixing of the chains [6].
+    n_particles : None or positive int
+        Number of persistent chains. If None, `batch_size` is used.
+    fast_learning_rate : None or positive float
+        Learning rate for the fast weights (FPCD). If None, the current
+        (regular) learning rate is used.
+    fast_weights_decay : float in [0, 1)
+        Multiplier applied to the fast weights on each update (FPCD).
+    pt_betas : None or iterable of float
+        If provided, use parallel tempering [7] for persistent chains:
+        `n_particles` chains are run at each of these (strictly decreasing,
+        starting with 1) inverse temperatures at once, as a single batch,
+        and states of adjacent replicas are swapped after each Gibbs step
+        using Metropolis rule. Only replicas at inverse temperature 1
+        contribute to the gradient estimates. States within the chains
+        are always sampled, regardless of `sample_h_states` and
+        `sample_v_states`. Not supported together with `dbm_first`
+        or `dbm_last`; Gaussian units require `sigma` = 1.
     learning_rate, momentum : positive float or iterable
         Gradient descent parameters. Values are updated after each epoch.
     max_epoch : positive int
         Train till this epoch.
     batch_size : positive int
         Input batch size for training.
+    shuffle : bool
+        Whether to shuffle training data before each epoch
+        (using seeded random permutation).
+    n_prefetch_batches : non-negative int
+        If positive, input batches are prepared in a background thread,
+        and up to this number of them are kept ready for the session.
     l2 : non-negative float
         L2 weight decay coefficient.
     sample_v_states, sample_h_states : bool
@@ -67,6 +103,13 @@ class BaseRBM(EnergyBasedModel):
         * pll_fmt : str, default '.3f'
         * feg_fmt : str, default '.2f'
         * train_metrics_every_iter : non-negative int, default 10
+            Also frequency of scalar summaries, 0 turns them off.
+        * histograms_every_iter : non-negative int, default 1000
+            Frequency of (expensive) histograms of weights, biases and their
+            updates, 0 turns them off.
+        * images_every_iter : non-negative int, default 100
+            Frequency of image summaries (filters, hidden activations),
+            0 turns them off.
         * val_metrics_every_epoch : non-negative int, default 1
         * feg_every_epoch : non-negative int, default 2
         * n_batches_for_feg : non-negative int, default 10
@@ -74,6 +117,20 @@ class BaseRBM(EnergyBasedModel):
         Whether to display progress during training.
     save_after_each_epoch : bool
         If False, save model only after the whole training is complete.
+    save_async : bool
+        Whether to write checkpoints after each epoch in a background
+        thread, while training continues. Only in-memory snapshot of
+        the variables is taken on the training thread.
+    save_queue_size : positive int
+        Max number of snapshots waiting to be written, when exceeded
+        training blocks until the oldest one is written.
+    checkpoint_every_iter : None or positive int
+        If provided, save checkpoint every this number of iterations
+        (also in the middle of an epoch).
+    checkpoint_every_sec : None or positive float
+        If provided, save checkpoint every this number of seconds.
+        Checkpoints store the position within the epoch, so that `fit`
+        of the loaded model resumes from the next batch.
     display_filters : non-negative int
         Number of weights filters to display during training (in TensorBoard).
     display_hidden_activations : non-negative int
@@ -91,16 +148,27 @@ class BaseRBM(EnergyBasedModel):
         url: http://deeplearning.net/tutorial/rbm.html
     [4] R. Salakhutdinov and G. Hinton. Deep boltzmann machines.
         In AISTATS, pp. 448-455. 2009
+    [5] T. Tieleman. Training restricted Boltzmann machines using
+        approximations to the likelihood gradient. In ICML, pp. 1064-1071. 2008
+    [6] T. Tieleman and G. Hinton. Using fast weights to improve persistent
+        contrastive divergence. In ICML, pp. 1033-1040. 2009
+    [7] G. Desjardins, A. Courville, Y. Bengio, P. Vincent and O. Delalleau.
+        Parallel tempering for training of restricted Boltzmann machines.
+        In AISTATS, pp. 145-152. 2010
     """
     def __init__(self,
                  n_visible=784, v_layer_cls=None, v_layer_params=None,
                  n_hidden=256, h_layer_cls=None, h_layer_params=None,
                  W_init=0.01, vb_init=0., hb_init=0., n_gibbs_steps=1,
-                 learning_rate=0.01, momentum=0.9, max_epoch=10, batch_size=10, l2=1e-4,
+                 learning_algorithm='cd', n_particles=None,
+                 fast_learning_rate=None, fast_weights_decay=0.95, pt_betas=None,
+                 learning_rate=0.01, momentum=0.9, max_epoch=10, batch_size=10,
+                 shuffle=False, n_prefetch_batches=0, l2=1e-4,
                  sample_v_states=False, sample_h_states=True, dropout=None,
                  sparsity_target=0.1, sparsity_cost=0., sparsity_damping=0.9,
                  dbm_first=False, dbm_last=False,
                  metrics_config=None, verbose=True, save_after_each_epoch=True,
+                 checkpoint_every_iter=None, checkpoint_every_sec=None,
                  display_filters=0, display_hidden_activations=0, v_shape=(28, 28),
                  model_path='rbm_model/', *args, **kwargs):
         super(BaseRBM, self).__init__(model_path=model_path, *args, **kwargs)
@@ -141,10 +209,23 @@ class BaseRBM(EnergyBasedModel):
         self._dhb_init = None
 
         self.n_gibbs_steps = make_list_from(n_gibbs_steps)
+        if learning_algorithm not in ('cd', 'pcd', 'fpcd'):
+            raise ValueError("`learning_algorithm` must be one of 'cd', 'pcd', 'fpcd', got '{0}'"
+                             .format(learning_algorithm))
+        self.learning_algorithm = learning_algorithm
+        self.n_particles = n_particles
+        self.fast_learning_rate = fast_learning_rate
+        self.fast_weights_decay = fast_weights_decay
+        self.pt_betas = self._check_pt_betas(pt_betas)
+        if self.pt_betas is not None and self.learning_algorithm == 'cd':
+            raise ValueError('parallel tempering requires persistent chains (`learning_algorithm` '
+                             "'pcd' or 'fpcd')")
         self.learning_rate = make_list_from(learning_rate)
         self.momentum = make_list_from(momentum)
         self.max_epoch = max_epoch
         self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.n_prefetch_batches = n_prefetch_batches
         self.l2 = l2
 
         # According to [2], the training goes less noisy and slightly faster, if
@@ -162,6 +243,13 @@ class BaseRBM(EnergyBasedModel):
 
         self.dbm_first = dbm_first
         self.dbm_last = dbm_last
+        if self.pt_betas is not None:
+            if self.dbm_first or self.dbm_last:
+                # doubled inputs of `dbm_first`/`dbm_last` RBMs do not
+                # correspond to any energy the swaps could be based on
+                raise ValueError('parallel tempering is not supported for RBMs '
+                                 'with `dbm_first` or `dbm_last` set')
+            self._check_pt_layers([self._v_layer, self._h_layer])
 
         self.metrics_config = metrics_config or {}
         self.metrics_config.setdefault('l2_loss', False)
@@ -173,6 +261,8 @@ class BaseRBM(EnergyBasedModel):
         self.metrics_config.setdefault('pll_fmt', '.3f')
         self.metrics_config.setdefault('feg_fmt', '.2f')
         self.metrics_config.setdefault('train_metrics_every_iter', 10)
+        self.metrics_config.setdefault('histograms_every_iter', 1000)
+        self.metrics_config.setdefault('images_every_iter', 100)
         self.metrics_config.setdefault('val_metrics_every_epoch', 1)
         self.metrics_config.setdefault('feg_every_epoch', 2)
         self.metrics_config.setdefault('n_batches_for_feg', 10)
@@ -189,6 +279,8 @@ class BaseRBM(EnergyBasedModel):
 
         self.verbose = verbose
         self.save_after_each_epoch = save_after_each_epoch
+        self.checkpoint_every_iter = checkpoint_every_iter
+        self.checkpoint_every_sec = checkpoint_every_sec
 
         assert self.n_hidden >= display_filters
         self.display_filters = display_filters
@@ -204,6 +296,11 @@ class BaseRBM(EnergyBasedModel):
         self.epoch_ = 0
         self.iter_ = 0
 
+        # position within the current epoch (to resume from)
+        self.batch_offset_ = 0
+        self.order_ = None
+        self._checkpoint_time = None
+
         # tf constants
         self._n_visible = None
         self._n_hidden = None
@@ -216,6 +313,8 @@ class BaseRBM(EnergyBasedModel):
         self._dbm_last = None
         self._propup_multiplier = None
         self._propdown_multiplier = None
+        self._fast_learning_rate = None
+        self._fast_weights_decay = None
 
         # tf input data
         self._learning_rate = None
@@ -234,12 +333,19 @@ class BaseRBM(EnergyBasedModel):
 
         self._q_means = None
 
+        self._h_particles = None
+        self._h_tempered = None
+        self._W_fast = None
+        self._vb_fast = None
+        self._hb_fast = None
+
         # tf operations
         self._train_op = None
         self._transform_op = None
         self._msre = None
         self._pll = None
         self._free_energy_op = None
+        self._pt_swap_rate = None
 
     def _make_constants(self):
         with tf.name_scope('constants'):
@@ -261,6 +367,13 @@ class BaseRBM(EnergyBasedModel):
             t2 = tf.cast(self._dbm_last, dtype=self._tf_dtype)
             self._propdown_multiplier = tf.identity(tf.add(t2, t), name='propdown_multiplier')
 
+            if self.learning_algorithm == 'fpcd':
+                if self.fast_learning_rate is not None:
+                    self._fast_learning_rate = tf.constant(self.fast_learning_rate, dtype=self._tf_dtype,
+                                                           name='fast_learning_rate')
+                self._fast_weights_decay = tf.constant(self.fast_weights_decay, dtype=self._tf_dtype,
+                                                       name='fast_weights_decay')
+
     def _make_placeholders(self):
         with tf.name_scope('input_data'):
             self._learning_rate = tf.placeholder(self._tf_dtype, [], name='learning_rate')
@@ -292,9 +405,9 @@ class BaseRBM(EnergyBasedModel):
             self._vb = tf.Variable(vb_init, dtype=self._tf_dtype, name='vb')
             self._hb = tf.Variable(hb_init, dtype=self._tf_dtype, name='hb')
 
-            tf.summary.histogram('W', self._W)
-            tf.summary.histogram('vb', self._vb)
-            tf.summary.histogram('hb', self._hb)
+            tf.summary.histogram('W', self._W, collections=[HISTOGRAM_SUMMARIES])
+            tf.summary.histogram('vb', self._vb, collections=[HISTOGRAM_SUMMARIES])
+            tf.summary.histogram('hb', self._hb, collections=[HISTOGRAM_SUMMARIES])
 
         # visualize filters
         if self.display_filters:
@@ -303,7 +416,8 @@ class BaseRBM(EnergyBasedModel):
                 W_display = tf.reshape(W_display, [self.n_hidden, self.v_shape[2],
                                                    self.v_shape[0], self.v_shape[1]])
                 W_display = tf.transpose(W_display, [0, 2, 3, 1])
-                tf.summary.image('W_filters', W_display, max_outputs=self.display_filters)
+                tf.summary.image('W_filters', W_display, max_outputs=self.display_filters,
+                                 collections=[IMAGE_SUMMARIES])
 
         # initialize gradients accumulators
         with tf.name_scope('grads_accumulators'):
@@ -318,14 +432,33 @@ class BaseRBM(EnergyBasedModel):
             self._dvb = tf.Variable(dvb_init, name='dvb')
             self._dhb = tf.Variable(dhb_init, name='dhb')
 
-            tf.summary.histogram('dW', self._dW)
-            tf.summary.histogram('dvb', self._dvb)
-            tf.summary.histogram('dhb', self._dhb)
+            tf.summary.histogram('dW', self._dW, collections=[HISTOGRAM_SUMMARIES])
+            tf.summary.histogram('dvb', self._dvb, collections=[HISTOGRAM_SUMMARIES])
+            tf.summary.histogram('dhb', self._dhb, collections=[HISTOGRAM_SUMMARIES])
 
         # initialize running means of hidden activations means
         with tf.name_scope('hidden_activations_means'):
             self._q_means = tf.Variable(tf.zeros([self._n_hidden], dtype=self._tf_dtype), name='q_means')
 
+        # initialize persistent chains (PCD, FPCD)
+        if self.learning_algorithm != 'cd':
+            with tf.name_scope('negative_particles'):
+                t = self._h_layer.init(batch_size=self.n_particles or self.batch_size,
+                                       random_seed=self.random_seed)
+                self._h_particles = tf.Variable(t, dtype=self._tf_dtype, name='h')
+                if self.pt_betas is not None:
+                    # replicas at lower inverse temperatures, stacked along the first axis
+                    n_tempered = (len(self.pt_betas) - 1) * (self.n_particles or self.batch_size)
+                    t = self._h_layer.init(batch_size=n_tempered, random_seed=self.random_seed)
+                    self._h_tempered = tf.Variable(t, dtype=self._tf_dtype, name='h_tempered')
+
+        if self.learning_algorithm == 'fpcd':
+            with tf.name_scope('fast_weights'):
+                self._W_fast = tf.Variable(tf.zeros([self._n_visible, self._n_hidden], dtype=self._tf_dtype),
+                                           name='W_fast')
+                self._vb_fast = tf.Variable(tf.zeros([self._n_visible], dtype=self._tf_dtype), name='vb_fast')
+                self._hb_fast = tf.Variable(tf.zeros([self._n_hidden], dtype=self._tf_dtype), name='hb_fast')
+
     def _propup(self, v):
         with tf.name_scope('prop_up'):
             t = tf.matmul(v, self._W)
@@ -336,44 +469,51 @@ class BaseRBM(EnergyBasedModel):
             t = tf.matmul(a=h, b=self._W, transpose_b=True)
         return t
 
-    def _means_h_given_v(self, v):
-        """Compute means E(h|v)."""
+    def _means_h_given_v(self, v, beta=None):
+        """Compute means E(h|v) (at inverse temperature(s) `beta`)."""
         with tf.name_scope('means_h_given_v'):
             x  = self._propup_multiplier * self._propup(v)
             hb = self._propup_multiplier * self._hb
-            h_means = self._h_layer.activation(x=x, b=hb)
+            if beta is None:
+                h_means = self._h_layer.activation(x=x, b=hb)
+            else:
+                h_means = self._h_layer.tempered_activation(x=x, b=hb, beta=beta)
         return h_means
 
-    def _sample_h_given_v(self, h_means):
+    def _sample_h_given_v(self, h_means, beta=None):
         """Sample from P(h|v)."""
         with tf.name_scope('sample_h_given_v'):
-            h_samples = self._h_layer.sample(means=h_means)
+            h_samples = self._h_layer.sample(means=h_means, beta=beta)
         return h_samples
 
-    def _means_v_given_h(self, h):
-        """Compute means E(v|h)."""
+    def _means_v_given_h(self, h, beta=None):
+        """Compute means E(v|h) (at inverse temperature(s) `beta`)."""
         with tf.name_scope('means_v_given_h'):
             x  = self._propdown_multiplier * self._propdown(h)
             vb = self._propdown_multiplier * self._vb
-            v_means = self._v_layer.activation(x=x, b=vb)
+            if beta is None:
+                v_means = self._v_layer.activation(x=x, b=vb)
+            else:
+                v_means = self._v_layer.tempered_activation(x=x, b=vb, beta=beta)
         return v_means
 
-    def _sample_v_given_h(self, v_means):
+    def _sample_v_given_h(self, v_means, beta=None):
         """Sample from P(v|h)."""
         with tf.name_scope('sample_v_given_h'):
-            v_samples = self._v_layer.sample(means=v_means)
+            v_samples = self._v_layer.sample(means=v_means, beta=beta)
         return v_samples
 
-    def _make_gibbs_step(self, h_states):
-        """Compute one Gibbs step."""
+    def _make_gibbs_step(self, h_states, beta=None, sample=False):
+        """Compute one Gibbs step (sampling states of all the units
+        if `sample`, otherwise according to `sample_*_states`)."""
         with tf.name_scope('gibbs_step'):
-            v_states = v_means = self._means_v_given_h(h_states)
-            if self.sample_v_states:
-                v_states = self._sample_v_given_h(v_means)
+            v_states = v_means = self._means_v_given_h(h_states, beta=beta)
+            if sample or self.sample_v_states:
+                v_states = self._sample_v_given_h(v_means, beta=beta)
 
-            h_states = h_means = self._means_h_given_v(v_states)
-            if self.sample_h_states:
-                h_states = self._sample_h_given_v(h_means)
+            h_states = h_means = self._means_h_given_v(v_states, beta=beta)
+            if sample or self.sample_h_states:
+                h_states = self._sample_h_given_v(h_means, beta=beta)
 
         return v_states, v_means, h_states, h_means
 
@@ -412,6 +552,100 @@ class BaseRBM(EnergyBasedModel):
         else:
             return self._make_gibbs_chain_variable(*args, **kwargs)
 
+    def _make_energy(self, v, h):
+        """Compute energy of joint states (per sample)."""
+        with tf.name_scope('energy'):
+            E = self._v_layer.energy(v, self._vb) + \
+                self._h_layer.energy(h, self._hb) - \
+                tf.reduce_sum(self._propup(v) * h, axis=1)
+        return E
+
+    def _make_tempered_chain(self, h_states):
+        """Run chains at all inverse temperatures `pt_betas` at once,
+        proposing swaps of adjacent replicas after each Gibbs step.
+
+        Swaps are valid only for sampled states, hence the chains always
+        sample both layers; `sample_v_states` only selects whether visible
+        samples or means are returned (for gradient estimates).
+        """
+        M = self.n_particles or self.batch_size
+        betas, beta = self._make_replica_betas(self.pt_betas, M)
+
+        def cond(step, max_step, v_states, v_means, h_states, h_means, n_accepted, n_proposed):
+            return step < max_step
+
+        def body(step, max_step, v_states, v_means, h_states, h_means, n_accepted, n_proposed):
+            v_states, v_means, h_states, h_means = \
+                self._make_gibbs_step(h_states, beta=beta, sample=True)
+            energy = self._make_energy(v_states, h_states)
+            states, a, p = self._make_replica_swaps([v_states, v_means, h_states, h_means],
+                                                    energy, betas, M, parity=step % 2)
+            v_states, v_means, h_states, h_means = states
+            return step + 1, max_step, v_states, v_means, h_states, h_means, n_accepted + a, n_proposed + p
+
+        n_rows = len(self.pt_betas) * M
+        n_pairs = len(self.pt_betas) - 1
+        _, _, v_states, v_means, h_states, h_means, n_accepted, n_proposed = \
+            tf.while_loop(cond=cond, body=body,
+                          loop_vars=[tf.constant(0),
+                                     self._n_gibbs_steps,
+                                     tf.zeros([n_rows, self.n_visible], dtype=self._tf_dtype),
+                                     tf.zeros([n_rows, self.n_visible], dtype=self._tf_dtype),
+                                     h_states,
+                                     tf.zeros_like(h_states),
+                                     tf.zeros([n_pairs], dtype=self._tf_dtype),
+                                     tf.zeros([n_pairs], dtype=self._tf_dtype)],
+                          back_prop=False,
+                          parallel_iterations=1)
+        self._pt_swap_rate = tf.reduce_sum(n_accepted) / tf.maximum(tf.reduce_sum(n_proposed), 1.)
+        if not self.sample_v_states:
+            v_states = v_means
+        return v_states, v_means, h_states, h_means
+
+    def _make_negative_chain(self):
+        """Continue persistent chains (all the replicas in case of parallel
+        tempering) for specified number of steps, using regular plus
+        fast weights in case of FPCD.
+
+        Returns
+        -------
+        states : (v_states, v_means, h_states, h_means)
+            States of the chains at inverse temperature 1.
+        particles_updates : [tf.Tensor]
+            Ops storing the states of all the chains.
+        """
+        h_states = tf.identity(self._h_particles, name='h_particles')
+        if self.pt_betas is not None:
+            h_states = tf.concat([h_states, self._h_tempered], 0)
+        make_chain = self._make_gibbs_chain if self.pt_betas is None else self._make_tempered_chain
+
+        # chain ops read weights through `self._W` etc.,
+        # so swap them while the chain is being built
+        W, vb, hb = self._W, self._vb, self._hb
+        if self.learning_algorithm == 'fpcd':
+            self._W = tf.add(W, self._W_fast, name='W_total')
+            self._vb = tf.add(vb, self._vb_fast, name='vb_total')
+            self._hb = tf.add(hb, self._hb_fast, name='hb_total')
+        try:
+            v_states, v_means, h_states, h_means = make_chain(h_states)
+        finally:
+            self._W, self._vb, self._hb = W, vb, hb
+
+        if self.pt_betas is None:
+            return (v_states, v_means, h_states, h_means), [self._h_particles.assign(h_states)]
+        M = self.n_particles or self.batch_size
+        particles_updates = [self._h_particles.assign(h_states[:M]),
+                             self._h_tempered.assign(h_states[M:])]
+        return (v_states[:M], v_means[:M], h_states[:M], h_means[:M]), particles_updates
+
+    def _make_transform_op(self):
+        # encoded data, used by the transform method: deterministic hidden
+        # activation probabilities computed in a single up pass (w/o dropout,
+        # sampling or Gibbs steps, hence learning rate, momentum etc. need not be fed)
+        with tf.name_scope('transform'):
+            transform_op = tf.identity(self._means_h_given_v(self._X_batch))
+            tf.add_to_collection('transform_op', transform_op)
+
     def _make_train_op(self):
         # apply dropout if necessary
         if self.dropout is not None:
@@ -423,7 +657,10 @@ class BaseRBM(EnergyBasedModel):
             h0_samples = self._sample_h_given_v(h0_means)
             h_states = h0_samples if self.sample_h_states else h0_means
 
-            v_states, v_means, _, h_means = self._make_gibbs_chain(h_states)
+            if self.learning_algorithm == 'cd':
+                v_states, v_means, _, h_means = self._make_gibbs_chain(h_states)
+            else:
+                (v_states, v_means, _, h_means), particles_updates = self._make_negative_chain()
 
         # visualize hidden activation means
         if self.display_hidden_activations:
@@ -432,29 +669,29 @@ class BaseRBM(EnergyBasedModel):
                 h_means_display = tf.cast(h_means_display, tf.float32)
                 h_means_display = tf.expand_dims(h_means_display, 0)
                 h_means_display = tf.expand_dims(h_means_display, -1)
-                tf.summary.image('hidden_activation_means', h_means_display)
-
-        # encoded data, used by the transform method
-        with tf.name_scope('transform'):
-            transform_op = tf.identity(h_means)
-            tf.add_to_collection('transform_op', transform_op)
+                tf.summary.image('hidden_activation_means', h_means_display,
+                                 collections=[IMAGE_SUMMARIES])
 
         # compute gradients estimates (= positive - negative associations)
         with tf.name_scope('grads_estimates'):
-            # number of training examples might not be divisible by batch size
+            # number of training examples might not be divisible by batch size,
+            # and number of persistent chains might differ from it
             N = tf.cast(tf.shape(self._X_batch)[0], dtype=self._tf_dtype)
+            M = tf.cast(tf.shape(v_states)[0], dtype=self._tf_dtype)
             with tf.name_scope('dW'):
                 dW_positive = tf.matmul(self._X_batch, h0_means, transpose_a=True)
                 dW_negative = tf.matmul(v_states, h_means, transpose_a=True)
-                dW = (dW_positive - dW_negative) / N - self._l2 * self._W
+                dW = dW_positive / N - dW_negative / M - self._l2 * self._W
             with tf.name_scope('dvb'):
-                dvb = tf.reduce_mean(self._X_batch - v_states, axis=0) # == sum / N
+                dvb = tf.reduce_mean(self._X_batch, axis=0) - tf.reduce_mean(v_states, axis=0)
             with tf.name_scope('dhb'):
-                dhb = tf.reduce_mean(h0_means - h_means, axis=0) # == sum / N
+                dhb = tf.reduce_mean(h0_means, axis=0) - tf.reduce_mean(h_means, axis=0)
 
         # apply sparsity targets if needed
         with tf.name_scope('sparsity_targets'):
-            q_means = tf.reduce_sum(h_means, axis=0)
+            # (persistent chains are not driven by the data, use hidden
+            # activations of the batch instead)
+            q_means = tf.reduce_sum(h_means if self.learning_algorithm == 'cd' else h0_means, axis=0)
             q_update = self._q_means.assign(self._sparsity_damping * self._q_means + \
                                             (1 - self._sparsity_damping) * q_means)
             sparsity_penalty = self._sparsity_cost * (q_update - self._sparsity_target)
@@ -473,9 +710,21 @@ class BaseRBM(EnergyBasedModel):
                 dhb_update = self._dhb.assign(self._learning_rate * (self._momentum * self._dhb + dhb))
                 hb_update = self._hb.assign_add(dhb_update)
 
+        updates = [W_update, vb_update, hb_update]
+        if self.learning_algorithm != 'cd':
+            updates.extend(particles_updates)
+        if self.learning_algorithm == 'fpcd':
+            with tf.name_scope('fast_weights_updates'):
+                fast_lr = self._fast_learning_rate if self._fast_learning_rate is not None else \
+                          self._learning_rate
+                decay = self._fast_weights_decay
+                updates.append(self._W_fast.assign(decay * self._W_fast + fast_lr * dW))
+                updates.append(self._vb_fast.assign(decay * self._vb_fast + fast_lr * dvb))
+                updates.append(self._hb_fast.assign(decay * self._hb_fast + fast_lr * dhb))
+
         # assemble train_op
         with tf.name_scope('training_step'):
-            train_op = tf.group(W_update, vb_update, hb_update)
+            train_op = tf.group(*updates)
             tf.add_to_collection('train_op', train_op)
 
         # compute metrics
@@ -484,6 +733,9 @@ class BaseRBM(EnergyBasedModel):
             tf.add_to_collection('l2_loss', l2_loss)
 
         with tf.name_scope('mean_squared_recon_error'):
+            if self.learning_algorithm != 'cd':
+                # negative particles are not reconstructions of the batch
+                v_means = self._means_v_given_h(h_states)
             msre = tf.reduce_mean(tf.square(self._X_batch - v_means))
             tf.add_to_collection('msre', msre)
 
@@ -523,18 +775,22 @@ class BaseRBM(EnergyBasedModel):
             tf.summary.scalar(self._metrics_names_map['msre'], msre)
         if self.metrics_config['pll']:
             tf.summary.scalar(self._metrics_names_map['pll'], pll)
+        if self.pt_betas is not None:
+            tf.summary.scalar('pt_swap_rate', self._pt_swap_rate)
 
     def _make_tf_model(self):
         self._make_constants()
         self._make_placeholders()
         self._make_vars()
+        self._make_transform_op()
         self._make_train_op()
 
-    def _make_tf_feed_dict(self, X_batch, n_gibbs_steps=None):
+    def _make_tf_feed_dict(self, X_batch=None, n_gibbs_steps=None):
         d = {}
         d['learning_rate'] = self.learning_rate[min(self.epoch_, len(self.learning_rate) - 1)]
         d['momentum'] = self.momentum[min(self.epoch_, len(self.momentum) - 1)]
-        d['X_batch'] = X_batch
+        if X_batch is not None:
+            d['X_batch'] = X_batch
         if n_gibbs_steps is not None:
             d['n_gibbs_steps'] = n_gibbs_steps
         else:
@@ -548,23 +804,48 @@ class BaseRBM(EnergyBasedModel):
 
     def _train_epoch(self, X):
         results = [[] for _ in xrange(len(self._train_metrics_map))]
+        # feeds other than input batch do not change during an epoch
+        feed_dict = self._make_tf_feed_dict()
+        if self.batch_offset_ == 0 and self.shuffle:
+            # permutation depends only on the seed and epoch,
+            # hence it is the same if training is resumed from checkpoint
+            rng = self._rng if self.random_seed is None else RNG(seed=[self.random_seed, self.epoch_])
+            self.order_ = rng.permutation(len(X))
+        # augmentations of data augmented on the fly depend only on the epoch as well
+        if hasattr(X, 'set_epoch'):
+            X.set_epoch(self.epoch_)
         for X_batch in batch_iter(X, self.batch_size,
-                                  verbose=self.verbose):
+                                  verbose=self.verbose, indices=self.order_,
+                                  n_prefetch=self.n_prefetch_batches,
+                                  dtype=self._np_dtype, start_batch=self.batch_offset_):
             self.iter_ += 1
-            if self.iter_ % self.metrics_config['train_metrics_every_iter'] == 0:
-                run_ops = [v for _, v in sorted(self._train_metrics_map.items())]
-                run_ops += [self._tf_merged_summaries, self._train_op]
-                outputs = \
-                self._tf_session.run(run_ops,
-                                     feed_dict=self._make_tf_feed_dict(X_batch))
-                values = outputs[:len(self._train_metrics_map)]
-                for i, v in enumerate(values):
+            feed_dict['input_data/X_batch:0'] = X_batch
+            metrics_ops = []
+            train_metrics_every_iter = self.metrics_config['train_metrics_every_iter']
+            if train_metrics_every_iter and self.iter_ % train_metrics_every_iter == 0:
+                metrics_ops = [v for _, v in sorted(self._train_metrics_map.items())]
+            summary_ops = self._summaries_due(self.iter_,
+                                              scalars_every_iter=train_metrics_every_iter,
+                                              histograms_every_iter=self.metrics_config['histograms_every_iter'],
+                                              images_every_iter=self.metrics_config['images_every_iter'])
+            if metrics_ops or summary_ops:
+                outputs = self._tf_run(metrics_ops + summary_ops + [self._train_op],
+                                       feed_dict=feed_dict, step=self.iter_)
+                for i, v in enumerate(outputs[:len(metrics_ops)]):
                     results[i].append(v)
-                train_s = outputs[len(self._train_metrics_map)]
-                self._tf_train_writer.add_summary(train_s, self.iter_)
+                for train_s in outputs[len(metrics_ops):-1]:
+                    self._get_tf_writer(self._train_summary_dirpath).add_summary(train_s, self.iter_)
             else:
-                self._tf_session.run(self._train_op,
-                                     feed_dict=self._make_tf_feed_dict(X_batch))
+                self._tf_run(self._train_op, feed_dict=feed_dict, step=self.iter_)
+            self.batch_offset_ += 1
+
+            # save checkpoint if needed
+            if self.checkpoint_every_iter and self.iter_ % self.checkpoint_every_iter == 0 or \
+               self.checkpoint_every_sec and time.time() - self._checkpoint_time >= self.checkpoint_every_sec:
+                self._save_checkpoint()
+                self._checkpoint_time = time.time()
+        self.batch_offset_ = 0
+        self.order_ = None
 
         # aggregate and return metrics values
         results = map(lambda r: np.mean(r) if r else None, results)
@@ -572,7 +853,7 @@ class BaseRBM(EnergyBasedModel):
 
     def _run_val_metrics(self, X_val):
         results = [[] for _ in xrange(len(self._val_metrics_map))]
-        for X_vb in batch_iter(X_val, batch_size=self.batch_size):
+        for X_vb in batch_iter(X_val, batch_size=self.batch_size, dtype=self._np_dtype):
             run_ops = [v for _, v in sorted(self._val_metrics_map.items())]
             values = \
             self._tf_session.run(run_ops,
@@ -586,7 +867,7 @@ class BaseRBM(EnergyBasedModel):
             summary_value.append(summary_pb2.Summary.Value(tag=self._metrics_names_map[m],
                                                            simple_value=results[i]))
         val_s = summary_pb2.Summary(value=summary_value)
-        self._tf_val_writer.add_summary(val_s, self.iter_)
+        self._get_tf_writer(self._val_summary_dirpath).add_summary(val_s, self.iter_)
         return dict(zip(sorted(self._val_metrics_map), results))
 
     def _run_feg(self, X, X_val):
@@ -601,14 +882,14 @@ class BaseRBM(EnergyBasedModel):
 
         train_fes = []
         for _, X_b in zip(xrange(self.metrics_config['n_batches_for_feg']),
-                          batch_iter(X, batch_size=self.batch_size)):
+                          batch_iter(X, batch_size=self.batch_size, dtype=self._np_dtype)):
             train_fe = self._tf_session.run(self._free_energy_op,
                                             feed_dict=self._make_tf_feed_dict(X_b))
             train_fes.append(train_fe)
 
         val_fes = []
         for _, X_vb in zip(xrange(self.metrics_config['n_batches_for_feg']),
-                           batch_iter(X_val, batch_size=self.batch_size)):
+                           batch_iter(X_val, batch_size=self.batch_size, dtype=self._np_dtype)):
             val_fe = self._tf_session.run(self._free_energy_op,
                                           feed_dict=self._make_tf_feed_dict(X_vb))
             val_fes.append(val_fe)
@@ -617,7 +898,7 @@ class BaseRBM(EnergyBasedModel):
         summary_value = [summary_pb2.Summary.Value(tag=self._metrics_names_map['feg'],
                                                    simple_value=feg)]
         feg_s = summary_pb2.Summary(value=summary_value)
-        self._tf_val_writer.add_summary(feg_s, self.iter_)
+        self._get_tf_writer(self._val_summary_dirpath).add_summary(feg_s, self.iter_)
         return feg
 
     def _fit(self, X, X_val=None, *args, **kwargs):
@@ -635,7 +916,10 @@ class BaseRBM(EnergyBasedModel):
                 self._val_metrics_map[m] = tf.get_collection(m)[0]
 
         # main loop
-        for self.epoch_ in epoch_iter(start_epoch=self.epoch_, max_epoch=self.max_epoch,
+        # resume interrupted epoch if needed
+        start_epoch = self.epoch_ - 1 if self.batch_offset_ else self.epoch_
+        self._checkpoint_time = time.time()
+        for self.epoch_ in epoch_iter(start_epoch=start_epoch, max_epoch=self.max_epoch,
                                       verbose=self.verbose):
             val_results = {}
             feg = None
@@ -663,18 +947,20 @@ class BaseRBM(EnergyBasedModel):
 
             # save if needed
             if self.save_after_each_epoch:
-                self._save_model(global_step=self.epoch_)
+                self._save_checkpoint(global_step=self.epoch_)
 
     def init_from(self, rbm):
         if type(self) != type(rbm):
             raise ValueError('an attempt to initialize `{0}` from `{1}`'.
                              format(self.__class__.__name__, rbm.__class__.__name__))
-        weights = rbm.get_tf_params(scope='weights')
+        # read both scopes at once from checkpoint (w/o loading the model)
+        params = rbm.read_tf_params(scopes=('weights', 'grads_accumulators'))
+        weights = params['weights']
         self.W_init = weights['W']
         self.vb_init = weights['vb']
         self.hb_init = weights['hb']
 
-        grads_accumulators = rbm.get_tf_params(scope='grads_accumulators')
+        grads_accumulators = params['grads_accumulators']
         self._dW_init = grads_accumulators['dW']
         self._dvb_init = grads_accumulators['dvb']
         self._dhb_init = grads_accumulators['dhb']
@@ -684,17 +970,47 @@ class BaseRBM(EnergyBasedModel):
             if is_attribute_name(k):
                 setattr(self, k, v)
 
-    @run_in_tf_session(update_seed=True)
-    def transform(self, X, np_dtype=None):
-        """Compute hidden units' activation probabilities."""
+    @run_in_tf_session()
+    def transform(self, X, np_dtype=None, profile_iters=None):
+        """Compute hidden units' activation probabilities.
+
+        Parameters
+        ----------
+        profile_iters : None, positive int or iterable of int
+            If provided, trace batches (every `profile_iters`-th one if int,
+            otherwise ones with these indices), and write their timelines
+            and per-scope time summary to `logs/profile` (see `TFProfiler`).
+        """
         np_dtype = np_dtype or self._np_dtype
 
         self._transform_op = tf.get_collection('transform_op')[0]
         H = np.zeros((len(X), self.n_hidden), dtype=np_dtype)
         start = 0
-        for X_b in batch_iter(X, batch_size=self.batch_size,
-                              verbose=self.verbose, desc='transform'):
-            H_b = self._transform_op.eval(feed_dict=self._make_tf_feed_dict(X_b))
-            H[start:(start + self.batch_size)] = H_b
-            start += self.batch_size
+        self._start_profiling(profile_iters, tag='transform')
+        try:
+            for i, X_b in enumerate(batch_iter(X, batch_size=self.batch_size,
+                                               verbose=self.verbose, desc='transform',
+                                               n_prefetch=self.n_prefetch_batches,
+                                               dtype=self._np_dtype)):
+                H_b = self._tf_run(self._transform_op, feed_dict={'input_data/X_batch:0': X_b}, step=i)
+                H[start:(start + self.batch_size)] = H_b
+                start += self.batch_size
+        finally:
+            self._stop_profiling()
         return H
+
+    def export_numpy(self, filepath):
+        """Export weights, biases and parameters of layers to `filepath`
+        (.npz), to be used for inference w/o TensorFlow.
+
+        Returns
+        -------
+        rbm : runtime.NumpyRBM
+        """
+        weights = self.get_tf_params(scope='weights')
+        rbm = NumpyRBM(W=weights['W'], vb=weights['vb'], hb=weights['hb'],
+                       v_layer=self._v_layer.export_params(),
+                       h_layer=self._h_layer.export_params(),
+                       propup_multiplier=1. + self.dbm_first,
+                       propdown_multiplier=1. + self.dbm_last)
+        return rbm.save(filepath)
@@ -0,0 +1,261 @@
+import numpy as np
+import tensorflow as tf
+
+import env
+from rbm import GaussianRBM
+from boltzmann_machines.base import run_in_tf_session, HISTOGRAM_SUMMARIES
+from boltzmann_machines.utils import batch_iter
+from boltzmann_machines.utils.testing import assert_shape
+
+
+class StackedGaussianRBM(GaussianRBM):
+    """Stack of `n_models` independent Gaussian RBMs of identical shape,
+    trained at once within a single graph using batched matrix
+    multiplications over the leading model axis.
+
+    Useful to train many small RBMs (e.g. on different patches of
+    images), which would underutilize the hardware if trained one
+    after another. Input data should be of shape
+    (n_samples, `n_models`, `n_visible`), i-th model is trained on
+    its own slice [:, i, :] of the data. Trained models can be
+    exported as separate `GaussianRBM`s using `unstack` method.
+
+    Parameters
+    ----------
+    n_models : positive int
+        Number of RBMs in a stack.
+    W_init : float or (n_models, n_visible, n_hidden) iterable
+        Weight matrices initialization.
+    vb_init, hb_init : float or (n_models, n_visible/n_hidden) iterable
+        Visible and hidden unit biases.
+
+    Other parameters have the same semantics as for `GaussianRBM`,
+    except that displaying filters and hidden activations is not
+    supported, pseudo-loglikelihood is not computed, and only CD-k
+    learning algorithm is available.
+    """
+    def __init__(self, n_models=2, W_init=0.01, vb_init=0., hb_init=0.,
+                 model_path='sg_rbm_model/', *args, **kwargs):
+        super(StackedGaussianRBM, self).__init__(model_path=model_path, *args, **kwargs)
+        self.n_models = n_models
+        assert not self.display_filters
+        assert not self.display_hidden_activations
+        assert not self.metrics_config['pll']
+        assert self.learning_algorithm == 'cd'
+
+        self.W_init = W_init
+        if hasattr(self.W_init, '__iter__'):
+            self.W_init = np.asarray(self.W_init)
+            assert_shape(self, 'W_init', (self.n_models, self.n_visible, self.n_hidden))
+
+        self.vb_init = vb_init
+        if hasattr(self.vb_init, '__iter__'):
+            self.vb_init = np.asarray(self.vb_init)
+            assert_shape(self, 'vb_init', (self.n_models, self.n_visible))
+
+        self.hb_init = hb_init
+        if hasattr(self.hb_init, '__iter__'):
+            self.hb_init = np.asarray(self.hb_init)
+            assert_shape(self, 'hb_init', (self.n_models, self.n_hidden))
+
+    def _make_placeholders(self):
+        with tf.name_scope('input_data'):
+            self._learning_rate = tf.placeholder(self._tf_dtype, [], name='learning_rate')
+            self._momentum = tf.placeholder(self._tf_dtype, [], name='momentum')
+            self._n_gibbs_steps = tf.placeholder(tf.int32, [], name='n_gibbs_steps')
+            self._X_batch = tf.placeholder(self._tf_dtype, [None, self.n_models, self.n_visible],
+                                           name='X_batch')
+
+            # divide by resp. sigmas before any operation
+            self._sigma = tf.Variable(self._sigma_tmp, dtype=self._tf_dtype, name='sigma')
+            self._sigma = tf.reshape(self._sigma, [1, 1, self.n_visible])
+            self._X_batch = tf.divide(self._X_batch, self._sigma)
+
+            # move model axis to the front: (n_models, batch_size, n_visible)
+            self._X_batch = tf.transpose(self._X_batch, [1, 0, 2])
+
+    def _make_vars(self):
+        # initialize weights and biases, biases are stored
+        # as (n_models, 1, n_units) to broadcast over batch
+        with tf.name_scope('weights'):
+            if hasattr(self.W_init, '__iter__'):
+                W_init = tf.constant(self.W_init, dtype=self._tf_dtype)
+            else:
+                W_init = tf.random_normal([self.n_models, self.n_visible, self.n_hidden],
+                                          mean=0.0, stddev=self.W_init,
+                                          seed=self.random_seed, dtype=self._tf_dtype)
+            W_init = tf.identity(W_init, name='W_init')
+
+            vb_init = self.vb_init if hasattr(self.vb_init, '__iter__') else \
+                      np.tile(self.vb_init, (self.n_models, self.n_visible))
+            hb_init = self.hb_init if hasattr(self.hb_init, '__iter__') else \
+                      np.tile(self.hb_init, (self.n_models, self.n_hidden))
+
+            vb_init = tf.constant(np.expand_dims(vb_init, 1), dtype=self._tf_dtype, name='vb_init')
+            hb_init = tf.constant(np.expand_dims(hb_init, 1), dtype=self._tf_dtype, name='hb_init')
+
+            self._W = tf.Variable(W_init, dtype=self._tf_dtype, name='W')
+            self._vb = tf.Variable(vb_init, dtype=self._tf_dtype, name='vb')
+            self._hb = tf.Variable(hb_init, dtype=self._tf_dtype, name='hb')
+
+            tf.summary.histogram('W', self._W, collections=[HISTOGRAM_SUMMARIES])
+            tf.summary.histogram('vb', self._vb, collections=[HISTOGRAM_SUMMARIES])
+            tf.summary.histogram('hb', self._hb, collections=[HISTOGRAM_SUMMARIES])
+
+        # initialize gradients accumulators
+        with tf.name_scope('grads_accumulators'):
+            self._dW = tf.Variable(tf.zeros_like(W_init), name='dW')
+            self._dvb = tf.Variable(tf.zeros_like(vb_init), name='dvb')
+            self._dhb = tf.Variable(tf.zeros_like(hb_init), name='dhb')
+
+            tf.summary.histogram('dW', self._dW, collections=[HISTOGRAM_SUMMARIES])
+            tf.summary.histogram('dvb', self._dvb, collections=[HISTOGRAM_SUMMARIES])
+            tf.summary.histogram('dhb', self._dhb, collections=[HISTOGRAM_SUMMARIES])
+
+        # initialize running means of hidden activations means
+        with tf.name_scope('hidden_activations_means'):
+            self._q_means = tf.Variable(tf.zeros_like(hb_init), name='q_means')
+
+    def _make_transform_op(self):
+        with tf.name_scope('transform'):
+            h_means = self._means_h_given_v(self._X_batch)
+            transform_op = tf.transpose(h_means, [1, 0, 2])
+            tf.add_to_collection('transform_op', transform_op)
+
+    def _make_train_op(self):
+        # apply dropout if necessary
+        if self.dropout is not None:
+            self._X_batch = tf.nn.dropout(self._X_batch, keep_prob=self._dropout)
+
+        # Run Gibbs chain for specified number of steps.
+        with tf.name_scope('gibbs_chain'):
+            h0_means = self._means_h_given_v(self._X_batch)
+            h0_samples = self._sample_h_given_v(h0_means)
+            h_states = h0_samples if self.sample_h_states else h0_means
+
+            v_states, v_means, _, h_means = self._make_gibbs_chain(h_states)
+
+        # compute gradients estimates (= positive - negative associations),
+        # independently for each model in a stack
+        with tf.name_scope('grads_estimates'):
+            N = tf.cast(tf.shape(self._X_batch)[1], dtype=self._tf_dtype)
+            with tf.name_scope('dW'):
+                dW_positive = tf.matmul(self._X_batch, h0_means, transpose_a=True)
+                dW_negative = tf.matmul(v_states, h_means, transpose_a=True)
+                dW = (dW_positive - dW_negative) / N - self._l2 * self._W
+            with tf.name_scope('dvb'):
+                dvb = tf.reduce_mean(self._X_batch - v_states, axis=1, keep_dims=True)
+            with tf.name_scope('dhb'):
+                dhb = tf.reduce_mean(h0_means - h_means, axis=1, keep_dims=True)
+
+        # apply sparsity targets if needed
+        with tf.name_scope('sparsity_targets'):
+            q_means = tf.reduce_sum(h_means, axis=1, keep_dims=True)
+            q_update = self._q_means.assign(self._sparsity_damping * self._q_means + \
+                                            (1 - self._sparsity_damping) * q_means)
+            sparsity_penalty = self._sparsity_cost * (q_update - self._sparsity_target)
+            dhb -= sparsity_penalty
+            dW  -= sparsity_penalty
+
+        # update parameters
+        with tf.name_scope('momentum_updates'):
+            with tf.name_scope('dW'):
+                dW_update = self._dW.assign(self._learning_rate * (self._momentum * self._dW + dW))
+                W_update = self._W.assign_add(dW_update)
+            with tf.name_scope('dvb'):
+                dvb_update = self._dvb.assign(self._learning_rate * (self._momentum * self._dvb + dvb))
+                vb_update = self._vb.assign_add(dvb_update)
+            with tf.name_scope('dhb'):
+                dhb_update = self._dhb.assign(self._learning_rate * (self._momentum * self._dhb + dhb))
+                hb_update = self._hb.assign_add(dhb_update)
+
+        # assemble train_op
+        with tf.name_scope('training_step'):
+            train_op = tf.group(W_update, vb_update, hb_update)
+            tf.add_to_collection('train_op', train_op)
+
+        # compute metrics (averaged over models)
+        with tf.name_scope('L2_loss'):
+            l2_loss = self._l2 * tf.nn.l2_loss(self._W) / float(self.n_models)
+            tf.add_to_collection('l2_loss', l2_loss)
+
+        with tf.name_scope('mean_squared_recon_error'):
+            msre = tf.reduce_mean(tf.square(self._X_batch - v_means))
+            tf.add_to_collection('msre', msre)
+
+        # add also free energy of input batch to collection (for feg)
+        free_energy_op = self._free_energy(self._X_batch)
+        tf.add_to_collection('free_energy_op', free_energy_op)
+
+        # collect summaries
+        if self.metrics_config['l2_loss']:
+            tf.summary.scalar(self._metrics_names_map['l2_loss'], l2_loss)
+        if self.metrics_config['msre']:
+            tf.summary.scalar(self._metrics_names_map['msre'], msre)
+
+    def _free_energy(self, v):
+        with tf.name_scope('free_energy'):
+            T1 = tf.divide(self._vb, self._sigma)
+            T2 = tf.square(tf.subtract(v, T1))
+            T3 = 0.5 * tf.reduce_sum(T2, axis=2)
+            T4 = -tf.reduce_sum(tf.nn.softplus(self._propup(v) + self._hb), axis=2)
+            fe = tf.reduce_mean(T3 + T4)
+        return fe
+
+    @run_in_tf_session()
+    def transform(self, X, np_dtype=None, profile_iters=None):
+        """Compute hidden units' activation probabilities
+        for all models, (n_samples, `n_models`, `n_hidden`)."""
+        np_dtype = np_dtype or self._np_dtype
+
+        self._transform_op = tf.get_collection('transform_op')[0]
+        H = np.zeros((len(X), self.n_models, self.n_hidden), dtype=np_dtype)
+        start = 0
+        self._start_profiling(profile_iters, tag='transform')
+        try:
+            for i, X_b in enumerate(batch_iter(X, batch_size=self.batch_size,
+                                               verbose=self.verbose, desc='transform',
+                                               n_prefetch=self.n_prefetch_batches,
+                                               dtype=self._np_dtype)):
+                H_b = self._tf_run(self._transform_op, feed_dict={'input_data/X_batch:0': X_b}, step=i)
+                H[start:(start + self.batch_size)] = H_b
+                start += self.batch_size
+        finally:
+            self._stop_profiling()
+        return H
+
+    def unstack(self, model_paths):
+        """Export models from the stack as separate `GaussianRBM`s
+        (with weights, biases, gradients accumulators and training
+        progress), saved to `model_paths`.
+
+        Returns
+        -------
+        rbms : [GaussianRBM]
+        """
+        assert len(model_paths) == self.n_models
+        tf_params = self.read_tf_params(scopes=('weights', 'grads_accumulators'))
+        weights = tf_params['weights']
+        grads_accumulators = tf_params['grads_accumulators']
+        params = self.get_params(include_attributes=False)
+        params.pop('n_models')
+        rbms = []
+        for i, model_path in enumerate(model_paths):
+            params.update(W_init=weights['W'][i],
+                          vb_init=weights['vb'][i, 0],
+                          hb_init=weights['hb'][i, 0])
+            rbm = GaussianRBM(model_path=model_path, **params)
+            rbm._dW_init = grads_accumulators['dW'][i]
+            rbm._dvb_init = grads_accumulators['dvb'][i, 0]
+            rbm._dhb_init = grads_accumulators['dhb'][i, 0]
+            rbm.epoch_ = self.epoch_
+            rbm.iter_ = self.iter_
+            rbms.append(rbm.init())
+        return rbms
+
+
+if __name__ == '__main__':
+    # run corresponding tests
+    from boltzmann_machines.utils.testing import run_tests
+    from tests import test_rbm as t
+    run_tests(__file__, t)
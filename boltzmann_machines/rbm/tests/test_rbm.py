@@ -1,12 +1,19 @@
 import os
+import json
 import numpy as np
+import tensorflow as tf
+from glob import glob
 from shutil import rmtree
 from numpy.testing import (assert_allclose,
                            assert_almost_equal,
+                           assert_array_equal,
                            assert_raises)
 
-from boltzmann_machines.rbm import BernoulliRBM, MultinomialRBM, GaussianRBM
-from boltzmann_machines.utils import RNG
+from boltzmann_machines.rbm import (BernoulliRBM, MultinomialRBM, GaussianRBM,
+                                    StackedGaussianRBM)
+from boltzmann_machines.runtime import load_numpy_model
+from boltzmann_machines.utils import RNG, LazyArray
+from boltzmann_machines.utils.augmentation import AugmentedArray
 
 
 class TestRBM(object):
@@ -22,9 +29,11 @@ class TestRBM(object):
                                random_seed=1337)
 
     def cleanup(self):
-        for d in ('test_rbm_1/', 'test_rbm_2/'):
+        for d in ('test_rbm_1/', 'test_rbm_2/', 'test_rbm_3/', 'test_rbm_4/'):
             if os.path.exists(d):
                 rmtree(d)
+        if os.path.exists('test_rbm_X.npy'):
+            os.remove('test_rbm_X.npy')
 
     def test_W_init(self):
         for C in (BernoulliRBM, MultinomialRBM, GaussianRBM):
@@ -130,5 +139,474 @@ class TestRBM(object):
         # cleanup
         self.cleanup()
 
+    def test_consistency_shuffle(self):
+        rbm1 = BernoulliRBM(max_epoch=2, shuffle=True, n_prefetch_batches=2,
+                            model_path='test_rbm_1/',
+                            **self.rbm_config)
+        rbm2 = BernoulliRBM(max_epoch=2, shuffle=True,
+                            model_path='test_rbm_2/',
+                            **self.rbm_config)
+
+        rbm1.fit(self.X)
+        rbm2.fit(self.X)
+
+        self.compare_weights(rbm1, rbm2)
+        self.compare_transforms(rbm1, rbm2)
+
+        # permutations are reproducible after loading from disk
+        rbm1 = BernoulliRBM.load_model('test_rbm_1/')
+        rbm1.set_params(max_epoch=rbm1.max_epoch + 1).fit(self.X)
+        rbm2.set_params(max_epoch=rbm2.max_epoch + 1).fit(self.X)
+
+        self.compare_weights(rbm1, rbm2)
+
+        # cleanup
+        self.cleanup()
+
+    def test_consistency_mmap(self):
+        rbm1 = BernoulliRBM(max_epoch=2,
+                            model_path='test_rbm_1/',
+                            **self.rbm_config)
+        rbm2 = BernoulliRBM(max_epoch=2,
+                            model_path='test_rbm_2/',
+                            **self.rbm_config)
+
+        # train on memory-mapped data, scaled lazily by batches
+        np.save('test_rbm_X.npy', 2. * self.X)
+        X = np.load('test_rbm_X.npy', mmap_mode='r')
+        X = LazyArray(X, dtype=np.float32, fn=lambda x: x / 2.)
+
+        rbm1.fit(self.X)
+        rbm2.fit(X)
+
+        self.compare_weights(rbm1, rbm2)
+        assert_allclose(rbm1.transform(self.X), rbm2.transform(X))
+
+        # cleanup
+        self.cleanup()
+
+    def test_consistency_augmented(self):
+        rbm1 = BernoulliRBM(max_epoch=2, n_prefetch_batches=2,
+                            model_path='test_rbm_1/',
+                            **self.rbm_config)
+        rbm2 = BernoulliRBM(max_epoch=2,
+                            model_path='test_rbm_2/',
+                            **self.rbm_config)
+
+        # augmentation on the fly is reproducible
+        # (also if performed in background thread)
+        rbm1.fit(AugmentedArray(self.X, im_shape=(2, 2, 3), random_seed=1337))
+        rbm2.fit(AugmentedArray(self.X, im_shape=(2, 2, 3), random_seed=1337))
+
+        self.compare_weights(rbm1, rbm2)
+
+        # cleanup
+        self.cleanup()
+
+    def test_stacked(self):
+        # w/o sampling and dropout training is deterministic
+        config = dict(n_visible=6, n_hidden=self.n_hidden, max_epoch=2,
+                      sample_v_states=False, sample_h_states=False,
+                      verbose=False, random_seed=1337)
+        X = self.X.reshape((-1, 2, 6))
+        W_init = RNG(seed=1337).randn(2, 6, self.n_hidden) * 0.01
+        hb_init = RNG(seed=42).randn(2, self.n_hidden) * 0.01
+
+        stacked_rbm = StackedGaussianRBM(n_models=2, W_init=W_init, hb_init=hb_init,
+                                         model_path='test_rbm_3/', **config)
+        stacked_rbm.fit(X)
+        H = stacked_rbm.transform(X)
+        assert H.shape == (len(X), 2, self.n_hidden)
+
+        # each model is trained independently on its own slice of data
+        stacked_rbm.unstack(('test_rbm_1/', 'test_rbm_2/'))
+        for i in xrange(2):
+            rbm = GaussianRBM.load_model('test_rbm_{0}/'.format(i + 1))
+            rbm_i = GaussianRBM(W_init=W_init[i], hb_init=hb_init[i],
+                                model_path='test_rbm_4/', **config)
+            rbm_i.fit(X[:, i, :])
+            weights = rbm.get_tf_params(scope='weights')
+            for k, v in rbm_i.get_tf_params(scope='weights').items():
+                assert_allclose(v, weights[k], rtol=1e-5, atol=1e-7)
+            assert_allclose(H[:, i, :], rbm_i.transform(X[:, i, :]), rtol=1e-5)
+            assert rbm.epoch_ == rbm_i.epoch_
+            rmtree('test_rbm_4/')
+
+        # cleanup
+        self.cleanup()
+
+    def test_transform(self):
+        rbm = BernoulliRBM(max_epoch=2,
+                           model_path='test_rbm_1/',
+                           **self.rbm_config)
+        rbm.fit(self.X)
+
+        # hidden activation probabilities are computed deterministically
+        # in a single up pass (w/o dropout and Gibbs sampling)
+        weights = rbm.get_tf_params(scope='weights')
+        H = 1. / (1. + np.exp(-self.X_val.dot(weights['W']) - weights['hb']))
+        assert_allclose(rbm.transform(self.X_val), H, rtol=1e-5)
+        assert_allclose(rbm.transform(self.X_val), rbm.transform(self.X_val))
+
+        # cleanup
+        self.cleanup()
+
+    def test_export_numpy(self):
+        for C, kwargs in (
+            (BernoulliRBM, dict(dbm_first=True)),
+            (MultinomialRBM, dict(n_samples=10)),
+            (GaussianRBM, dict(sigma=2.)),
+            (GaussianRBM, dict(sigma=np.linspace(0.5, 2., self.n_visible))),
+        ):
+            rbm = C(max_epoch=2,
+                    model_path='test_rbm_1/',
+                    **dict(self.rbm_config, **kwargs))
+            rbm.fit(self.X)
+            rbm.export_numpy('test_rbm_1/rbm.npz')
+            rbm_np = load_numpy_model('test_rbm_1/rbm.npz')
+            H = rbm_np.transform(self.X_val, batch_size=3)
+            assert H.dtype == np.float32
+            assert_allclose(H, rbm.transform(self.X_val), rtol=1e-5, atol=1e-6)
+            if C is BernoulliRBM:
+                weights = rbm.get_tf_params(scope='weights')
+                H = 1. / (1. + np.exp(-2. * self.X_val.dot(weights['W']) - 2. * weights['hb']))
+                X_recon = 1. / (1. + np.exp(-H.dot(weights['W'].T) - weights['vb']))
+                assert_allclose(rbm_np.reconstruct(self.X_val, batch_size=3), X_recon, rtol=1e-5)
+
+            # cleanup
+            self.cleanup()
+
+    def test_keep_alive(self):
+        rbm = BernoulliRBM(max_epoch=2,
+                           model_path='test_rbm_1/',
+                           **self.rbm_config)
+        rbm.fit(self.X)
+        rbm_cold = BernoulliRBM.load_model('test_rbm_1/')
+
+        with rbm:
+            # graph and session are reused across calls
+            tf_session = rbm._tf_session
+            self.compare_weights(rbm, rbm_cold)
+            rbm.transform(self.X_val)
+            assert rbm._tf_session is tf_session
+
+            # saving from the resident session doesn't trigger reloading
+            rbm.set_params(max_epoch=rbm.max_epoch + 1).fit(self.X)
+            assert rbm._tf_session is tf_session
+
+            # ... while changing the checkpoint from outside does
+            rbm_cold = BernoulliRBM.load_model('test_rbm_1/')
+            rbm_cold.set_params(max_epoch=rbm_cold.max_epoch + 1).fit(self.X)
+            self.compare_weights(rbm, rbm_cold)
+            assert rbm._tf_session is not tf_session
+        assert rbm._tf_session is None
+
+        # cleanup
+        self.cleanup()
+
+    def test_save_async(self):
+        rbm = BernoulliRBM(max_epoch=4,
+                           model_path='test_rbm_1/',
+                           **self.rbm_config)
+        rbm.fit(self.X)
+
+        rbm_async = BernoulliRBM(max_epoch=4,
+                                 save_async=True,
+                                 tf_saver_params=dict(max_to_keep=2),
+                                 model_path='test_rbm_2/',
+                                 **self.rbm_config)
+        rbm_async.fit(self.X)
+        self.compare_weights(rbm, rbm_async)
+
+        # per epoch checkpoints are written (only last ones kept)
+        assert not os.path.isfile('test_rbm_2/model-2.index')
+        assert os.path.isfile('test_rbm_2/model-4.index')
+        assert not glob('test_rbm_2/*.tmp*')
+        W = tf.train.NewCheckpointReader('test_rbm_2/model-4').get_tensor('weights/W')
+        assert_allclose(W, rbm.get_tf_params(scope='weights')['W'])
+
+        # final (synchronous) save shares the list of checkpoints with async ones
+        state = tf.train.get_checkpoint_state('test_rbm_2/')
+        assert [os.path.basename(p) for p in state.all_model_checkpoint_paths] == ['model-4', 'model']
+        assert not os.path.isfile('test_rbm_2/model-3.index')
+
+        # cleanup
+        self.cleanup()
+
+    def test_resume(self):
+        class Interrupted(Exception):
+            pass
+
+        def interrupt_after(n_batches, X=None):
+            # data that "crashes" training when accessed after `n_batches` batches
+            counter = [0]
+            def f(X_b):
+                counter[0] += 1
+                if counter[0] > n_batches:
+                    raise Interrupted()
+                return X_b
+            return LazyArray(self.X if X is None else X, fn=f)
+
+        # deterministic updates, to compare with uninterrupted training
+        config = dict(self.rbm_config)
+        config.update(sample_v_states=False, sample_h_states=False, dropout=None)
+        for C in (BernoulliRBM, GaussianRBM):
+            rbm = C(max_epoch=3, batch_size=4, shuffle=True,
+                    model_path='test_rbm_1/', **config)
+            rbm.fit(self.X)
+
+            rbm2 = C(max_epoch=3, batch_size=4, shuffle=True,
+                     checkpoint_every_iter=2, model_path='test_rbm_2/', **config)
+            assert_raises(Interrupted, lambda: rbm2.fit(interrupt_after(7)))
+            rbm2 = C.load_model('test_rbm_2/')
+            assert rbm2.epoch_ == 2
+            assert rbm2.iter_ == 6
+            assert rbm2.batch_offset_ == 2
+            rbm2.fit(self.X)
+            assert rbm2.iter_ == rbm.iter_
+            self.compare_weights(rbm, rbm2)
+
+            # cleanup
+            self.cleanup()
+
+        # resumed epoch sees the same augmentations as an uninterrupted one
+        make_X = lambda: AugmentedArray(self.X, im_shape=(2, 2, 3), random_seed=1337)
+        rbm = BernoulliRBM(max_epoch=3, batch_size=4, shuffle=True,
+                           model_path='test_rbm_1/', **config)
+        rbm.fit(make_X())
+        rbm2 = BernoulliRBM(max_epoch=3, batch_size=4, shuffle=True,
+                            checkpoint_every_iter=2, model_path='test_rbm_2/', **config)
+        assert_raises(Interrupted, lambda: rbm2.fit(interrupt_after(7, make_X())))
+        rbm2 = BernoulliRBM.load_model('test_rbm_2/')
+        assert rbm2.batch_offset_ == 2
+        rbm2.fit(make_X())
+        self.compare_weights(rbm, rbm2)
+
+        # cleanup
+        self.cleanup()
+
+    def test_params_arrays(self):
+        W_init = RNG(seed=1337).randn(self.n_visible, self.n_hidden).astype(np.float32)
+        rbm = BernoulliRBM(max_epoch=2,
+                           W_init=W_init,
+                           model_path='test_rbm_1/',
+                           **self.rbm_config)
+        rbm.fit(self.X)
+
+        # array-valued params are stored in binary files, not in JSON
+        with open('test_rbm_1/params.json') as params_file:
+            params = json.load(params_file)
+        assert params['W_init'] == {'__ndarray__': 'params_arrays/W_init.npy'}
+
+        # ... and are memory-mapped back on load
+        rbm_loaded = BernoulliRBM.load_model('test_rbm_1/')
+        assert rbm_loaded.W_init.dtype == np.float32
+        assert_array_equal(rbm_loaded.W_init, W_init)
+        self.compare_weights(rbm, rbm_loaded)
+
+        # loaded models can be saved in place
+        rbm_loaded.set_params(max_epoch=3).fit(self.X)
+        rbm_loaded = BernoulliRBM.load_model('test_rbm_1/')
+        assert_array_equal(rbm_loaded.W_init, W_init)
+
+        # cleanup
+        self.cleanup()
+
+    def test_summaries(self):
+        rbm = BernoulliRBM(max_epoch=4,
+                           metrics_config=dict(msre=True,
+                                               train_metrics_every_iter=1,
+                                               histograms_every_iter=4,
+                                               images_every_iter=0),
+                           display_hidden_activations=2,
+                           model_path='test_rbm_1/',
+                           **self.rbm_config)
+        rbm.fit(self.X)
+
+        scalar_steps, histogram_steps, image_steps = set(), set(), set()
+        for filepath in glob('test_rbm_1/logs/train/events.*'):
+            for e in tf.train.summary_iterator(filepath):
+                for v in e.summary.value:
+                    if v.HasField('histo'):
+                        histogram_steps.add(e.step)
+                    elif v.HasField('image'):
+                        image_steps.add(e.step)
+                    else:
+                        scalar_steps.add(e.step)
+        # each tier is written with its own frequency, or not at all
+        assert scalar_steps == set(xrange(1, 9))
+        assert histogram_steps == {4, 8}
+        assert not image_steps
+
+        # cleanup
+        self.cleanup()
+
+    def test_summary_writers(self):
+        rbm = BernoulliRBM(max_epoch=2,
+                           metrics_config=dict(msre=True, train_metrics_every_iter=1),
+                           model_path='test_rbm_1/',
+                           **self.rbm_config)
+        rbm.fit(self.X)
+        assert len(glob('test_rbm_1/logs/train/events.*')) == 1
+        assert os.path.isfile('test_rbm_1/logs/train/graph_version')
+
+        # calls that emit no summaries do not create writers or write the graph
+        for _ in xrange(3):
+            rbm.transform(self.X_val)
+            rbm.get_tf_params(scope='weights')
+        assert len(glob('test_rbm_1/logs/train/events.*')) == 1
+        assert not glob('test_rbm_1/logs/val/events.*')
+
+        # writers are closed with the session ...
+        assert rbm._tf_writers == {}
+
+        # ... unless in keep-alive mode, where they are reused across calls
+        with rbm:
+            rbm.set_params(max_epoch=3).fit(self.X)
+            writers = dict(rbm._tf_writers)
+            assert writers
+            rbm.set_params(max_epoch=4).fit(self.X)
+            assert rbm._tf_writers == writers
+        assert rbm._tf_writers == {}
+
+        # cleanup
+        self.cleanup()
+
+    def test_read_tf_params(self):
+        rbm = BernoulliRBM(max_epoch=2,
+                           model_path='test_rbm_1/',
+                           **self.rbm_config)
+        assert_raises(RuntimeError, lambda: rbm.read_tf_params())
+        rbm.fit(self.X)
+
+        # values read from checkpoint are the same as evaluated in session
+        for scope in ('weights', 'grads_accumulators'):
+            params = rbm.read_tf_params(scopes=scope)
+            params_session = rbm.get_tf_params(scope=scope)
+            assert sorted(params) == sorted(params_session)
+            for k in params:
+                assert_array_equal(params[k], params_session[k])
+
+        # several scopes in one pass
+        params = rbm.read_tf_params(scopes=('weights', 'grads_accumulators'))
+        assert sorted(params['weights']) == ['W', 'hb', 'vb']
+        assert sorted(params['grads_accumulators']) == ['dW', 'dhb', 'dvb']
+        assert 'weights/W' in rbm.read_tf_params()
+
+        # cleanup
+        self.cleanup()
+
+    def test_persistent(self):
+        assert_raises(ValueError, lambda: BernoulliRBM(learning_algorithm='pcd-k'))
+        for learning_algorithm in ('pcd', 'fpcd'):
+            config = dict(self.rbm_config, learning_algorithm=learning_algorithm, n_particles=5,
+                          metrics_config=dict(msre=True, pll=True, train_metrics_every_iter=1))
+            rbm1 = BernoulliRBM(max_epoch=2, model_path='test_rbm_1/', **config)
+            rbm2 = BernoulliRBM(max_epoch=2, model_path='test_rbm_2/', **config)
+            rbm1.init()
+            particles = rbm1.get_tf_params(scope='negative_particles')['h']
+            assert particles.shape == (5, self.n_hidden)
+
+            rbm1.fit(self.X)
+            rbm2.fit(self.X)
+            self.compare_weights(rbm1, rbm2)
+            self.compare_transforms(rbm1, rbm2)
+
+            # chains are continued, and stored in checkpoints
+            particles_1 = rbm1.get_tf_params(scope='negative_particles')['h']
+            assert not np.allclose(particles, particles_1)
+            rbm1 = BernoulliRBM.load_model('test_rbm_1/')
+            assert_array_equal(rbm1.get_tf_params(scope='negative_particles')['h'], particles_1)
+            if learning_algorithm == 'fpcd':
+                assert np.any(rbm1.get_tf_params(scope='fast_weights')['W_fast'])
+
+            # cleanup
+            self.cleanup()
+
+    def test_parallel_tempering(self):
+        assert_raises(ValueError, lambda: BernoulliRBM(pt_betas=[1., 0.5]))
+        assert_raises(ValueError, lambda: BernoulliRBM(learning_algorithm='pcd', pt_betas=[0.5, 1.]))
+        assert_raises(ValueError, lambda: BernoulliRBM(learning_algorithm='pcd', pt_betas=[1., 0.5],
+                                                       dbm_first=True))
+        assert_raises(ValueError, lambda: GaussianRBM(learning_algorithm='pcd', pt_betas=[1., 0.5],
+                                                      sigma=2.))
+        for C in (BernoulliRBM, GaussianRBM):
+            config = dict(self.rbm_config, learning_algorithm='pcd', n_particles=5,
+                          pt_betas=[1., 0.9, 0.8, 0.7], n_gibbs_steps=2,
+                          metrics_config=dict(train_metrics_every_iter=1))
+            rbm1 = C(max_epoch=2, model_path='test_rbm_1/', **config)
+            rbm2 = C(max_epoch=2, model_path='test_rbm_2/', **config)
+            rbm1.fit(self.X)
+            rbm2.fit(self.X)
+            self.compare_weights(rbm1, rbm2)
+
+            particles = rbm1.get_tf_params(scope='negative_particles')
+            assert particles['h'].shape == (5, self.n_hidden)
+            assert particles['h_tempered'].shape == (15, self.n_hidden)
+
+            # swap rate is logged
+            swap_rates = [v.simple_value for f in glob('test_rbm_1/logs/train/events.*')
+                          for e in tf.train.summary_iterator(f)
+                          for v in e.summary.value if v.tag == 'pt_swap_rate']
+            assert swap_rates
+            assert all(0. <= r <= 1. for r in swap_rates)
+
+            # cleanup
+            self.cleanup()
+
+    def test_parallel_tempering_means(self):
+        # chains sample states even if means are used otherwise (as by default)
+        rbm = BernoulliRBM(max_epoch=2, model_path='test_rbm_1/',
+                           **dict(self.rbm_config, sample_v_states=False, sample_h_states=False,
+                                  learning_algorithm='pcd', n_particles=5, pt_betas=[1., 0.8, 0.6]))
+        rbm.fit(self.X)
+        particles = rbm.get_tf_params(scope='negative_particles')
+        for H in (particles['h'], particles['h_tempered']):
+            assert np.all((H == 0.) | (H == 1.))
+
+        # cleanup
+        self.cleanup()
+
+    def test_tempered_conditionals(self):
+        # conditionals at inverse temperature `beta` must be proportional to
+        # exp(-beta * E) for the energy E used for replica swaps, i.e.
+        # log P(x|y) + beta * E(x, y) must not depend on x
+        beta = 0.4
+        rng = RNG(seed=1337)
+        W = rng.randn(3, 2).astype(np.float32)
+        vb = rng.randn(3).astype(np.float32)
+        hb = rng.randn(2).astype(np.float32)
+        def binary(n):
+            return np.array([[(k >> j) & 1 for j in xrange(n)]
+                             for k in xrange(2 ** n)], dtype=np.float32)
+
+        for C in (BernoulliRBM, GaussianRBM):
+            rbm = C(n_visible=3, n_hidden=2, W_init=W, vb_init=vb, hb_init=hb,
+                    learning_algorithm='pcd', pt_betas=[1., beta],
+                    verbose=False, display_filters=False)
+            V = binary(3) if C is BernoulliRBM else rng.randn(8, 3).astype(np.float32)
+            H = binary(2)
+            with tf.Graph().as_default():
+                rbm._make_constants()
+                rbm._make_placeholders()
+                rbm._make_vars()
+                T = []
+                for v in V:
+                    v = tf.constant(np.tile(v, (len(H), 1)))
+                    h = tf.constant(H)
+                    h_means = rbm._means_h_given_v(v, beta=beta)
+                    log_p = tf.reduce_sum(rbm._h_layer._sample(h_means, beta=beta).log_prob(h), axis=1)
+                    T.append(log_p + beta * rbm._make_energy(v, h))
+                for h in H:
+                    v = tf.constant(V)
+                    h = tf.constant(np.tile(h, (len(V), 1)))
+                    v_means = rbm._means_v_given_h(h, beta=beta)
+                    log_p = tf.reduce_sum(rbm._v_layer._sample(v_means, beta=beta).log_prob(v), axis=1)
+                    T.append(log_p + beta * rbm._make_energy(v, h))
+                with tf.Session() as sess:
+                    sess.run(tf.global_variables_initializer())
+                    for t in sess.run(T):
+                        assert_allclose(t, t[0], atol=1e-4)
+
     def tearDown(self):
         self.cleanup()
@@ -0,0 +1,333 @@
+"""
+NumPy-only runtime for inference with trained models, exported
+using `export_numpy` method of RBMs and DBM.
+
+It does not depend on TensorFlow, hence it is cheap to import and
+load models with (e.g. for serving on CPU). All the computations
+are done with BLAS matrix products into buffers allocated once
+per call, and activations are computed in-place.
+"""
+import numpy as np
+
+
+def _sigmoid(X):
+    with np.errstate(over='ignore'):
+        np.negative(X, out=X)
+        np.exp(X, out=X)
+    X += 1.
+    np.reciprocal(X, out=X)
+    return X
+
+def _softmax(X):
+    X -= X.max(axis=1, keepdims=True)
+    np.exp(X, out=X)
+    X /= X.sum(axis=1, keepdims=True)
+    return X
+
+def _batches(N, batch_size):
+    for start in xrange(0, N, batch_size):
+        yield start, min(start + batch_size, N)
+
+
+class NumpyLayer(object):
+    """Layer of units, counterpart of `layers.BaseLayer`
+    (only activations, w/o sampling).
+
+    Parameters
+    ----------
+    type : {'bernoulli', 'multinomial', 'gaussian'}
+    n_samples : float
+        Number of samples of a multinomial unit.
+    sigma : float or (n_units,) np.ndarray
+        Standard deviations of gaussian units.
+    """
+    def __init__(self, type, n_samples=None, sigma=None):
+        if type not in ('bernoulli', 'multinomial', 'gaussian'):
+            raise ValueError("invalid layer type '{0}'".format(type))
+        self.type = type
+        self.n_samples = n_samples
+        self.sigma = sigma
+
+    def activation(self, X, b):
+        """Compute activation in-place, where `X` is total
+        input received (excluding bias `b`)."""
+        if self.type == 'gaussian':
+            X *= self.sigma
+            X += b
+        elif self.type == 'bernoulli':
+            X += b
+            _sigmoid(X)
+        else:
+            X += b
+            _softmax(X)
+            X *= self.n_samples
+        return X
+
+    def export_params(self):
+        params = dict(type=self.type, n_samples=self.n_samples, sigma=self.sigma)
+        return {k: v for k, v in params.items() if v is not None}
+
+
+def _save_layer(arrays, name, layer):
+    for k, v in layer.export_params().items():
+        arrays['{0}.{1}'.format(name, k)] = v
+
+def _make_layer(layer, dtype):
+    """Make `NumpyLayer` from `layer` (or its parameters), with
+    parameters of `dtype`, so that in-place activations keep it."""
+    if not isinstance(layer, NumpyLayer):
+        layer = NumpyLayer(**layer)
+    if layer.sigma is not None:
+        layer.sigma = np.asarray(layer.sigma, dtype=dtype)
+    return layer
+
+def _load_layer(arrays, name):
+    prefix = name + '.'
+    params = {}
+    for k in arrays.files:
+        if k.startswith(prefix):
+            v = arrays[k]
+            params[k[len(prefix):]] = v.item() if v.ndim == 0 else v
+    params['type'] = str(params['type'])
+    return NumpyLayer(**params)
+
+
+class NumpyRBM(object):
+    """RBM for inference, counterpart of `rbm.BaseRBM`.
+
+    Parameters
+    ----------
+    W : (n_visible, n_hidden) np.ndarray
+    vb : (n_visible,) np.ndarray
+    hb : (n_hidden,) np.ndarray
+    v_layer, h_layer : NumpyLayer or dict
+        Layers (or their parameters, see `layers.BaseLayer.export_params`).
+    propup_multiplier, propdown_multiplier : float
+        Multipliers of total input of hidden and visible units resp.
+        (see `dbm_first`, `dbm_last` in `rbm.BaseRBM`).
+    """
+    def __init__(self, W, vb, hb, v_layer, h_layer,
+                 propup_multiplier=1., propdown_multiplier=1.):
+        self.W = np.asarray(W)
+        self.vb = np.asarray(vb, dtype=self.W.dtype)
+        self.hb = np.asarray(hb, dtype=self.W.dtype)
+        self.v_layer = _make_layer(v_layer, self.W.dtype)
+        self.h_layer = _make_layer(h_layer, self.W.dtype)
+        self.propup_multiplier = float(propup_multiplier)
+        self.propdown_multiplier = float(propdown_multiplier)
+
+        # scale weights and biases once
+        self._W_up = self.propup_multiplier * self.W
+        self._hb_up = self.propup_multiplier * self.hb
+        self._W_down = self.propdown_multiplier * self.W
+        self._vb_down = self.propdown_multiplier * self.vb
+
+    @property
+    def n_visible(self):
+        return self.W.shape[0]
+
+    @property
+    def n_hidden(self):
+        return self.W.shape[1]
+
+    def save(self, filepath):
+        """Save model to `filepath` (.npz)."""
+        arrays = dict(model='rbm', W=self.W, vb=self.vb, hb=self.hb,
+                      propup_multiplier=self.propup_multiplier,
+                      propdown_multiplier=self.propdown_multiplier)
+        _save_layer(arrays, 'v_layer', self.v_layer)
+        _save_layer(arrays, 'h_layer', self.h_layer)
+        np.savez(filepath, **arrays)
+        return self
+
+    @classmethod
+    def _from_arrays(cls, arrays):
+        return cls(W=arrays['W'], vb=arrays['vb'], hb=arrays['hb'],
+                   v_layer=_load_layer(arrays, 'v_layer'),
+                   h_layer=_load_layer(arrays, 'h_layer'),
+                   propup_multiplier=arrays['propup_multiplier'],
+                   propdown_multiplier=arrays['propdown_multiplier'])
+
+    def _h_means(self, X_b, H_b):
+        if self.v_layer.type == 'gaussian':
+            X_b = X_b / self.v_layer.sigma
+        np.dot(X_b, self._W_up, out=H_b)
+        return self.h_layer.activation(H_b, self._hb_up)
+
+    def transform(self, X, batch_size=1000):
+        """Compute hidden units' activation probabilities."""
+        H = np.empty((len(X), self.n_hidden), dtype=self.W.dtype)
+        for start, end in _batches(len(X), batch_size):
+            X_b = np.asarray(X[start:end], dtype=self.W.dtype)
+            self._h_means(X_b, H[start:end])
+        if self.h_layer.type == 'multinomial':
+            H /= self.h_layer.n_samples
+        return H
+
+    def reconstruct(self, X, batch_size=1000):
+        """Compute visible units' means given hidden
+        activation probabilities, p(v|h=p(h|v=x))."""
+        X_recon = np.empty((len(X), self.n_visible), dtype=self.W.dtype)
+        H_b = np.empty((min(batch_size, len(X)), self.n_hidden), dtype=self.W.dtype)
+        for start, end in _batches(len(X), batch_size):
+            X_b = np.asarray(X[start:end], dtype=self.W.dtype)
+            H_b_ = self._h_means(X_b, H_b[:(end - start)])
+            np.dot(H_b_, self._W_down.T, out=X_recon[start:end])
+            self.v_layer.activation(X_recon[start:end], self._vb_down)
+        return X_recon
+
+
+class NumpyDBM(object):
+    """DBM for inference (mean-field), counterpart of `dbm.DBM`.
+
+    Parameters
+    ----------
+    W : [(n_visible, n_hiddens[0]), (n_hiddens[0], n_hiddens[1]), ...] np.ndarrays
+    vb : (n_visible,) np.ndarray
+    hb : [(n_hiddens[i],)] np.ndarrays
+    v_layer : NumpyLayer or dict
+    h_layers : [NumpyLayer or dict]
+    max_mf_updates : positive int
+    mf_tol : positive float
+    gibbs_schedule : {'sequential', 'checkerboard'}
+        Order of mean-field updates of hidden layers (see `dbm.DBM`).
+    """
+    def __init__(self, W, vb, hb, v_layer, h_layers, max_mf_updates=10, mf_tol=1e-7,
+                 gibbs_schedule='sequential'):
+        self.W = [np.asarray(W_i) for W_i in W]
+        self.vb = np.asarray(vb, dtype=self.W[0].dtype)
+        self.hb = [np.asarray(hb_i, dtype=self.W[0].dtype) for hb_i in hb]
+        self.v_layer = _make_layer(v_layer, self.W[0].dtype)
+        self.h_layers = [_make_layer(l, self.W[0].dtype) for l in h_layers]
+        self.max_mf_updates = int(max_mf_updates)
+        self.mf_tol = float(mf_tol)
+        if gibbs_schedule not in ('sequential', 'checkerboard'):
+            raise ValueError("invalid gibbs schedule '{0}'".format(gibbs_schedule))
+        self.gibbs_schedule = gibbs_schedule
+
+    @property
+    def n_layers(self):
+        return len(self.W)
+
+    @property
+    def n_visible(self):
+        return self.W[0].shape[0]
+
+    @property
+    def n_hiddens(self):
+        return [W_i.shape[1] for W_i in self.W]
+
+    def save(self, filepath):
+        """Save model to `filepath` (.npz)."""
+        arrays = dict(model='dbm', vb=self.vb,
+                      max_mf_updates=self.max_mf_updates, mf_tol=self.mf_tol,
+                      gibbs_schedule=self.gibbs_schedule)
+        _save_layer(arrays, 'v_layer', self.v_layer)
+        for i in xrange(self.n_layers):
+            arrays['W_{0}'.format(i)] = self.W[i]
+            arrays['hb_{0}'.format(i)] = self.hb[i]
+            _save_layer(arrays, 'h_layer_{0}'.format(i), self.h_layers[i])
+        np.savez(filepath, **arrays)
+        return self
+
+    @classmethod
+    def _from_arrays(cls, arrays):
+        n_layers = sum(k.startswith('W_') for k in arrays.files)
+        return cls(W=[arrays['W_{0}'.format(i)] for i in xrange(n_layers)],
+                   vb=arrays['vb'],
+                   hb=[arrays['hb_{0}'.format(i)] for i in xrange(n_layers)],
+                   v_layer=_load_layer(arrays, 'v_layer'),
+                   h_layers=[_load_layer(arrays, 'h_layer_{0}'.format(i)) for i in xrange(n_layers)],
+                   max_mf_updates=arrays['max_mf_updates'],
+                   mf_tol=arrays['mf_tol'],
+                   gibbs_schedule=str(arrays['gibbs_schedule']) if 'gibbs_schedule' in arrays.files
+                                  else 'sequential')
+
+    def _make_buffers(self, batch_size):
+        return [[np.empty((batch_size, n), dtype=self.W[0].dtype) for n in self.n_hiddens]
+                for _ in xrange(3)]
+
+    def _mf_step(self, X_b, mu, mu_new, T):
+        """Update `mu_new` given `mu` (as in `dbm.DBM._make_gibbs_step`)."""
+        L = self.n_layers
+        if self.gibbs_schedule == 'checkerboard':
+            # odd layers (h0, h2, ...) given `mu`, then even ones given the updated odd ones
+            order = range(0, L, 2) + range(1, L, 2)
+        else:
+            order = range(L)
+        for i in order:
+            if self.gibbs_schedule == 'checkerboard':
+                below = above = mu if i % 2 == 0 else mu_new
+            else:
+                below, above = mu_new, mu
+            np.dot(X_b if i == 0 else below[i - 1], self.W[i], out=mu_new[i])
+            if i < L - 1:
+                np.dot(above[i + 1], self.W[i + 1].T, out=T[i])
+                mu_new[i] += T[i]
+            self.h_layers[i].activation(mu_new[i], self.hb[i])
+
+    def _mf(self, X_b, mu, mu_new, T):
+        """Run mean-field updates for mini-batch `X_b`
+        (as in `dbm.DBM._make_mf`), using buffers `mu`, `mu_new`, `T`."""
+        # initialize mu using approximate inference
+        L = self.n_layers
+        for i in xrange(L):
+            np.dot(X_b if i == 0 else mu[i - 1], self.W[i], out=mu[i])
+            if i == 0 or i < L - 1:
+                mu[i] *= 2.
+            self.h_layers[i].activation(mu[i], self.hb[i])
+        for q in mu_new:
+            q.fill(0.)
+
+        # run mean-field updates until convergence
+        for _ in xrange(self.max_mf_updates):
+            diff = 0.
+            for i in xrange(L):
+                np.subtract(mu[i], mu_new[i], out=T[i])
+                np.abs(T[i], out=T[i])
+                diff = max(diff, T[i].max())
+            if diff <= self.mf_tol:
+                break
+            self._mf_step(X_b, mu, mu_new, T)
+            mu, mu_new = mu_new, mu
+        return mu
+
+    def _run(self, X, batch_size, f):
+        mu, mu_new, T = self._make_buffers(min(batch_size, len(X)))
+        for start, end in _batches(len(X), batch_size):
+            X_b = np.asarray(X[start:end], dtype=self.W[0].dtype)
+            n = end - start
+            mu_b = self._mf(X_b, [q[:n] for q in mu], [q[:n] for q in mu_new], [t[:n] for t in T])
+            f(start, end, mu_b)
+
+    def transform(self, X, batch_size=1000):
+        """Compute hidden units' (from last layer) activation probabilities."""
+        G = np.empty((len(X), self.n_hiddens[-1]), dtype=self.W[0].dtype)
+        def f(start, end, mu):
+            G[start:end] = mu[-1]
+        self._run(X, batch_size, f)
+        return G
+
+    def reconstruct(self, X, batch_size=1000):
+        """Compute p(v|h_0=q, h...)=p(v|h_0=q), where q=p(h_0|v=x)"""
+        X_recon = np.empty((len(X), self.n_visible), dtype=self.W[0].dtype)
+        def f(start, end, mu):
+            np.dot(mu[0], self.W[0].T, out=X_recon[start:end])
+            self.v_layer.activation(X_recon[start:end], self.vb)
+        self._run(X, batch_size, f)
+        return X_recon
+
+
+def load_numpy_model(filepath):
+    """Load model exported by `export_numpy`.
+
+    Returns
+    -------
+    model : NumpyRBM or NumpyDBM
+    """
+    arrays = np.load(filepath)
+    try:
+        model_cls = {'rbm': NumpyRBM, 'dbm': NumpyDBM}[str(arrays['model'])]
+        return model_cls._from_arrays(arrays)
+    finally:
+        arrays.close()
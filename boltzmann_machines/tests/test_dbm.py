@@ -0,0 +1,221 @@
+import os
+import json
+import numpy as np
+from shutil import rmtree
+from numpy.testing import assert_allclose, assert_raises
+
+from boltzmann_machines import DBM
+from boltzmann_machines.rbm import BernoulliRBM
+from boltzmann_machines.runtime import load_numpy_model
+from boltzmann_machines.utils import RNG, LazyArray
+from boltzmann_machines.utils.augmentation import AugmentedArray
+
+
+class TestDBM(object):
+    def __init__(self):
+        self.n_visible = 12
+        self.n_hiddens = (8, 4)
+        self.X = RNG(seed=1337).rand(16, self.n_visible)
+        self.X_val = RNG(seed=42).rand(8, self.n_visible)
+        self.rbm_config = dict(max_epoch=1, batch_size=4,
+                               verbose=False, random_seed=1337)
+        self.dbm_config = dict(n_particles=4, n_gibbs_steps=1, max_mf_updates=5,
+                               max_epoch=2, batch_size=4,
+                               verbose=False, random_seed=1337)
+
+    def cleanup(self):
+        for d in ('test_dbm_rbm_1/', 'test_dbm_rbm_2/', 'test_dbm_rbm_3/',
+                  'test_dbm_1/', 'test_dbm_2/'):
+            if os.path.exists(d):
+                rmtree(d)
+
+    def make_rbms(self):
+        rbm1 = BernoulliRBM(n_visible=self.n_visible, n_hidden=self.n_hiddens[0],
+                            dbm_first=True, model_path='test_dbm_rbm_1/',
+                            **self.rbm_config)
+        rbm1.fit(self.X)
+        rbm2 = BernoulliRBM(n_visible=self.n_hiddens[0], n_hidden=self.n_hiddens[1],
+                            dbm_last=True, model_path='test_dbm_rbm_2/',
+                            **self.rbm_config)
+        rbm2.fit(rbm1.transform(self.X))
+        return rbm1, rbm2
+
+    def test_transform(self):
+        dbm = DBM(rbms=self.make_rbms(), model_path='test_dbm_1/', **self.dbm_config)
+        dbm.fit(self.X)
+        particles = dbm.get_tf_params(scope='negative_particles')
+
+        # transform is deterministic and doesn't advance persistent particles
+        G = dbm.transform(self.X_val)
+        assert G.shape == (len(self.X_val), self.n_hiddens[-1])
+        assert_allclose(G, dbm.transform(self.X_val))
+        for k, v in dbm.get_tf_params(scope='negative_particles').items():
+            assert_allclose(v, particles[k])
+
+        # cleanup
+        self.cleanup()
+
+    def test_batch_size(self):
+        dbm = DBM(rbms=self.make_rbms(), model_path='test_dbm_1/', **self.dbm_config)
+        # number of training examples is not divisible by batch size
+        dbm.fit(self.X[:14])
+
+        # inference doesn't depend on batch size used for training
+        G = dbm.transform(self.X_val)
+        assert_allclose(G, dbm.transform(self.X_val, batch_size=3), rtol=1e-5)
+        assert_allclose(G, dbm.transform(self.X_val, batch_size=64), rtol=1e-5)
+        X_recon = dbm.reconstruct(self.X_val)
+        assert X_recon.shape == self.X_val.shape
+        assert_allclose(X_recon, dbm.reconstruct(self.X_val, batch_size=64), rtol=1e-5)
+
+        # cleanup
+        self.cleanup()
+
+    def test_export_numpy(self):
+        dbm = DBM(rbms=self.make_rbms(), model_path='test_dbm_1/', **self.dbm_config)
+        dbm.fit(self.X)
+        dbm.export_numpy('test_dbm_1/dbm.npz')
+
+        dbm_np = load_numpy_model('test_dbm_1/dbm.npz')
+        assert_allclose(dbm_np.transform(self.X_val, batch_size=3),
+                        dbm.transform(self.X_val), rtol=1e-5, atol=1e-6)
+        assert_allclose(dbm_np.reconstruct(self.X_val, batch_size=3),
+                        dbm.reconstruct(self.X_val), rtol=1e-5, atol=1e-6)
+
+        # cleanup
+        self.cleanup()
+
+    def test_profile(self):
+        dbm = DBM(rbms=self.make_rbms(), model_path='test_dbm_1/', **self.dbm_config)
+        dbm.fit(self.X, profile_iters=[2, 5])
+
+        # timelines (full and per scope) are written for traced iterations only
+        for step in (2, 5):
+            assert os.path.isfile('test_dbm_1/logs/profile/train_{0}.ctf.json'.format(step))
+            for scope in ('mean_field', 'gibbs_chain', 'grads_estimates', 'momentum_updates'):
+                assert os.path.isfile('test_dbm_1/logs/profile/train_{0}_{1}.ctf.json'.format(step, scope))
+        assert not os.path.isfile('test_dbm_1/logs/profile/train_3.ctf.json')
+        with open('test_dbm_1/logs/profile/train_summary.json') as f:
+            summary = json.load(f)
+        assert [r['step'] for r in summary['steps']] == [2, 5]
+        assert all(r['scopes_ms']['mean_field'] > 0. for r in summary['steps'])
+        assert os.path.isfile('test_dbm_1/logs/profile/train_summary.txt')
+
+        # every batch is traced
+        G = dbm.transform(self.X_val, batch_size=4, profile_iters=1)
+        assert_allclose(G, dbm.transform(self.X_val, batch_size=4), rtol=1e-5)
+        with open('test_dbm_1/logs/profile/transform_summary.json') as f:
+            assert len(json.load(f)['steps']) == 2
+
+        # cleanup
+        self.cleanup()
+
+    def test_parallel_tempering(self):
+        rbms = self.make_rbms()
+        assert_raises(ValueError, lambda: DBM(rbms=rbms, pt_betas=[1.]))
+        assert_raises(ValueError, lambda: DBM(rbms=rbms, pt_betas=[0.5, 0.25]))
+        assert_raises(ValueError, lambda: DBM(rbms=rbms, pt_betas=[1., 0.5, 0.5]))
+
+        dbm = DBM(rbms=rbms, pt_betas=[1., 0.8, 0.6], model_path='test_dbm_1/', **self.dbm_config)
+        dbm.fit(self.X)
+        particles = dbm.get_tf_params(scope='negative_particles')
+        assert particles['v'].shape == (4, self.n_visible)
+        assert particles['v_tempered'].shape == (8, self.n_visible)
+
+        # sampling also runs (and updates) all the replicas
+        V = dbm.sample_v(n_gibbs_steps=3)
+        assert V.shape == (4, self.n_visible)
+        particles_new = dbm.get_tf_params(scope='negative_particles')
+        assert not np.allclose(particles['v_tempered'], particles_new['v_tempered'])
+        self.cleanup()
+
+        # chains sample states even if means are used otherwise
+        rbms = self.make_rbms()
+        dbm = DBM(rbms=rbms, pt_betas=[1., 0.8, 0.6], model_path='test_dbm_1/',
+                  sample_v_states=False, sample_h_states=[False, False], **self.dbm_config)
+        dbm.fit(self.X)
+        particles = dbm.get_tf_params(scope='negative_particles')
+        for name, P in particles.items():
+            if 'new' not in name:  # (not used with parallel tempering)
+                assert np.all((P == 0.) | (P == 1.)), name
+
+        # cleanup
+        self.cleanup()
+
+    def test_checkerboard(self):
+        rbm1, rbm2 = self.make_rbms()
+        assert_raises(ValueError, lambda: DBM(rbms=[rbm1, rbm2], gibbs_schedule='odd_even'))
+
+        # for 2 hidden layers the schedules are equivalent
+        dbm1 = DBM(rbms=[rbm1, rbm2], model_path='test_dbm_1/', **self.dbm_config)
+        dbm2 = DBM(rbms=[rbm1, rbm2], gibbs_schedule='checkerboard',
+                   model_path='test_dbm_2/', **self.dbm_config)
+        dbm1.init()
+        dbm2.init()
+        assert_allclose(dbm1.transform(self.X_val), dbm2.transform(self.X_val), rtol=1e-5)
+
+        # deeper model
+        rbm3 = BernoulliRBM(n_visible=self.n_hiddens[1], n_hidden=3,
+                            dbm_last=True, model_path='test_dbm_rbm_3/',
+                            **self.rbm_config)
+        rbm3.fit(rbm2.transform(rbm1.transform(self.X)))
+        dbm = DBM(rbms=[rbm1, rbm2, rbm3], gibbs_schedule='checkerboard',
+                  model_path='test_dbm_1/', **self.dbm_config)
+        dbm.fit(self.X)
+        assert dbm.transform(self.X_val).shape == (len(self.X_val), 3)
+        assert dbm.sample_v(n_gibbs_steps=2).shape == (4, self.n_visible)
+
+        # exported model runs the same schedule
+        dbm.export_numpy('test_dbm_1/dbm.npz')
+        dbm_np = load_numpy_model('test_dbm_1/dbm.npz')
+        assert dbm_np.gibbs_schedule == 'checkerboard'
+        assert_allclose(dbm_np.transform(self.X_val, batch_size=3),
+                        dbm.transform(self.X_val), rtol=1e-5, atol=1e-6)
+
+        # cleanup
+        self.cleanup()
+
+    def test_mf_cache(self):
+        rbms = self.make_rbms()
+        assert_raises(ValueError, lambda: DBM(rbms=rbms, mf_cache='disk'))
+        dbm = DBM(rbms=rbms, mf_cache='memory', model_path='test_dbm_1/', **self.dbm_config)
+        assert_raises(ValueError, lambda: dbm.fit(AugmentedArray(self.X, im_shape=(2, 2, 3))))
+        assert_raises(ValueError, lambda: dbm.fit(LazyArray(AugmentedArray(self.X, im_shape=(2, 2, 3)),
+                                                            fn=lambda X_b: 2. * X_b)))
+        for mf_cache in ('memory', 'mmap'):
+            config = dict(self.dbm_config, max_mf_updates=50, shuffle=True)
+            dbm = DBM(rbms=rbms, mf_cache=mf_cache, model_path='test_dbm_1/', **config)
+            dbm.fit(self.X)
+
+            # all the examples are cached after the first epoch
+            # (stats are for the last one)
+            stats = dbm._mf_cache.stats()
+            assert stats['hit_rate'] == 1.
+            assert stats['n_mf_updates_cold'] is not None
+            assert stats['n_mf_updates_saved'] is not None
+            assert dbm._mf_cache.cached.all()
+            if mf_cache == 'mmap':
+                assert os.path.isfile('test_dbm_1/mf_cache/mu_1.npy')
+
+            # states are kept for the same model and data ...
+            dbm._init_mf_cache(self.X)
+            assert dbm._mf_cache.cached.all()
+
+            # ... but discarded for other data ...
+            dbm._init_mf_cache(self.X[::-1])
+            assert not dbm._mf_cache.cached.any()
+
+            # ... and for other weights, even if files are reused
+            dbm.max_epoch = 3
+            dbm.fit(self.X)
+            assert dbm._mf_cache.cached.all()
+            if mf_cache == 'mmap':
+                dbm_new = DBM(rbms=rbms, mf_cache=mf_cache, model_path='test_dbm_1/', **config)
+                dbm_new._init_mf_cache(self.X)
+                assert not dbm_new._mf_cache.cached.any()
+
+            # cleanup
+            self.cleanup()
+
+    def tearDown(self):
+        self.cleanup()
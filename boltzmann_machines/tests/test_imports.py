@@ -0,0 +1,26 @@
+import sys
+import json
+import subprocess
+
+
+# run in a fresh interpreter so that modules already
+# imported by other tests do not affect the result
+IMPORT_SCRIPT = """
+import sys
+import json
+import boltzmann_machines.rbm
+heavy = [m for m in ('matplotlib', 'seaborn', 'keras', 'tqdm') if m in sys.modules]
+print json.dumps({'heavy': heavy})
+"""
+
+
+def test_import_rbm():
+    out = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT])
+    result = json.loads(out.strip().splitlines()[-1])
+    assert result['heavy'] == []
+
+def test_lazy_attributes():
+    from boltzmann_machines import utils
+    from boltzmann_machines.utils import plot_utils
+    assert utils.im_plot is plot_utils.im_plot
+    assert utils.dataset.load_mnist is not None
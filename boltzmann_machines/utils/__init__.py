@@ -1,4 +1,43 @@
+import sys
+import types
+from importlib import import_module
+
 from rng import *
 from utils import *
-from plot_utils import *
 from stopwatch import *
+
+
+# plotting helpers (matplotlib, seaborn) and submodules with heavy
+# dependencies (keras, scipy, ...) are imported on first attribute access
+_LAZY_ATTRS = {
+    'tick_params': 'plot_utils',
+    'im_plot': 'plot_utils',
+    'im_reshape': 'plot_utils',
+    'im_gif': 'plot_utils',
+    'plot_confusion_matrix': 'plot_utils',
+}
+_LAZY_SUBMODULES = ('augmentation', 'dataset', 'jobs', 'optimizers', 'plot_utils')
+
+
+class _LazyModule(types.ModuleType):
+    def __init__(self, module):
+        super(_LazyModule, self).__init__(module.__name__, module.__doc__)
+        self.__dict__.update(module.__dict__)
+        # keep the original module alive, otherwise its globals are cleared
+        self._module = module
+
+    def __getattr__(self, name):
+        if name in _LAZY_SUBMODULES:
+            value = import_module('.' + name, self.__name__)
+        elif name in _LAZY_ATTRS:
+            value = getattr(import_module('.' + _LAZY_ATTRS[name], self.__name__), name)
+        else:
+            raise AttributeError("module '{0}' has no attribute '{1}'".format(self.__name__, name))
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(_LAZY_ATTRS) | set(_LAZY_SUBMODULES))
+
+
+sys.modules[__name__] = _LazyModule(sys.modules[__name__])
@@ -1,5 +1,8 @@
 import numpy as np
 import scipy.ndimage as nd
+from multiprocessing.pool import ThreadPool
+
+from rng import RNG
 
 
 def shift(x, offset=(0, 0)):
@@ -14,3 +17,183 @@ def shift(x, offset=(0, 0)):
 def horizontal_mirror(x):
     y = np.fliplr(x[:,:,...])
     return y
+
+def _map_chunks(f, X, n_jobs=1, chunk_size=1000):
+    """Apply `f` to chunks of `X` along the first axis,
+    optionally in parallel using `n_jobs` threads."""
+    if n_jobs == 1 or len(X) <= chunk_size:
+        return f(X)
+    Y = np.empty_like(X)
+    starts = range(0, len(X), chunk_size)
+    def g(start):
+        Y[start:(start + chunk_size)] = f(X[start:(start + chunk_size)])
+    pool = ThreadPool(processes=n_jobs)
+    try:
+        pool.map(g, starts)
+    finally:
+        pool.close()
+    return Y
+
+def batch_shift(X, offset=(0, 0), n_jobs=1, chunk_size=1000):
+    """Shift batch of images `X` by integer number of pixels,
+    replicating pixels on the edges.
+
+    Equivalent to applying `shift` to each image, w/o spline
+    interpolation and python loops.
+
+    Parameters
+    ----------
+    X : (n_samples, H, W) or (n_samples, H, W, C) np.ndarray
+    offset : (int, int)
+        Shift along H and W axes resp.
+    n_jobs : positive int
+        Number of threads to process chunks of `X` with.
+    chunk_size : positive int
+
+    Examples
+    --------
+    >>> X = np.arange(8).reshape((2, 2, 2))
+    >>> batch_shift(X, offset=(0, 1))
+    array([[[0, 0],
+            [2, 2]],
+    <BLANKLINE>
+           [[4, 4],
+            [6, 6]]])
+    >>> X = np.random.rand(10, 8, 8, 3).astype(np.float32)
+    >>> Y = np.array([shift(x.copy(), offset=(-1, 2)) for x in X])
+    >>> np.testing.assert_allclose(Y, batch_shift(X, offset=(-1, 2), n_jobs=2, chunk_size=3),
+    ...                            atol=1e-7)
+    """
+    X = np.asarray(X)
+    dy, dx = offset
+    if int(dy) != dy or int(dx) != dx:
+        raise ValueError('`offset` must be integer, got {0}'.format(offset))
+    H, W = X.shape[1:3]
+    # index of source pixel for each target pixel, clipped to replicate edges
+    ind_y = np.clip(np.arange(H) - int(dy), 0, H - 1)
+    ind_x = np.clip(np.arange(W) - int(dx), 0, W - 1)
+    f = lambda X_b: X_b[:, ind_y][:, :, ind_x]
+    return _map_chunks(f, X, n_jobs=n_jobs, chunk_size=chunk_size)
+
+def batch_horizontal_mirror(X, n_jobs=1, chunk_size=1000):
+    """Mirror batch of images `X` horizontally.
+
+    Equivalent to applying `horizontal_mirror` to each image.
+
+    Examples
+    --------
+    >>> X = np.arange(8).reshape((2, 2, 2))
+    >>> batch_horizontal_mirror(X)
+    array([[[1, 0],
+            [3, 2]],
+    <BLANKLINE>
+           [[5, 4],
+            [7, 6]]])
+    """
+    X = np.asarray(X)
+    f = lambda X_b: X_b[:, :, ::-1].copy()
+    return _map_chunks(f, X, n_jobs=n_jobs, chunk_size=chunk_size)
+
+
+class AugmentedArray(object):
+    """Array-like wrapper around `X`, that randomly augments the rows
+    being accessed with shifts and horizontal mirroring.
+
+    Augmentation of each row depends only on the seed, the row index
+    and the current epoch (see `set_epoch`, called by the models at the
+    start of each epoch), not on the order of accesses. So if used as
+    training data (optionally with `n_prefetch_batches` to run
+    augmentation in a background thread), each epoch sees fresh
+    augmented samples, w/o storing them, and a resumed epoch sees
+    the same ones as an uninterrupted one.
+
+    Parameters
+    ----------
+    X : array-like
+        Underlying images, either (n_samples, H, W, C) or flattened
+        as in `dataset.im_flatten` (then `im_shape` should be provided).
+    offsets : iterable of (int, int)
+        Shifts to choose from (uniformly) for each sample.
+    mirror : bool
+        Whether to mirror each sample with probability 0.5.
+    im_shape : None or (H, W, C) tuple
+        Shape of images if `X` is flattened.
+    random_seed : None or int
+        If None, augmentations are not reproducible across instances.
+
+    Examples
+    --------
+    >>> X = np.arange(2 * 2 * 3 * 3).reshape((2, 2, 3, 3))
+    >>> X_aug = AugmentedArray(X, random_seed=1337)
+    >>> X_aug.shape
+    (2, 2, 3, 3)
+    >>> A = X_aug[:]
+    >>> C = AugmentedArray(X, random_seed=1337)[:]
+    >>> np.array_equal(A, C), np.array_equal(A[::-1], X_aug[::-1])
+    (True, True)
+    >>> Y = AugmentedArray(np.arange(100 * 2 * 3 * 3).reshape((100, 2, 3, 3)), random_seed=1337)
+    >>> Y_0 = Y[:]
+    >>> Y.set_epoch(1)
+    >>> np.array_equal(Y_0, Y[:])
+    False
+    >>> X_flat = X.transpose(0, 3, 1, 2).reshape((2, -1))
+    >>> D = AugmentedArray(X_flat, im_shape=(2, 3, 3), random_seed=1337)[:]
+    >>> np.array_equal(A.transpose(0, 3, 1, 2).reshape((2, -1)), D)
+    True
+    """
+    def __init__(self, X, offsets=((0, 0), (1, 0), (-1, 0), (0, 1), (0, -1)),
+                 mirror=True, im_shape=None, random_seed=None):
+        self.X = X
+        self.offsets = list(offsets)
+        self.mirror = mirror
+        self.im_shape = im_shape
+        self.random_seed = random_seed
+        self._seed = random_seed if random_seed is not None else RNG().randint(2 ** 31 - 1)
+        self.epoch = 0
+        self._augmentations = None
+        self.shape = X.shape
+        self.dtype = X.dtype
+
+    def set_epoch(self, epoch):
+        """Select augmentations of all the rows for `epoch`."""
+        self.epoch = epoch
+
+    def _get_augmentations(self):
+        """Indices of offsets and mirroring flags of all the rows for current epoch."""
+        augmentations = self._augmentations  # (may be replaced from another thread)
+        if augmentations is None or augmentations[0] != self.epoch:
+            epoch = self.epoch
+            rng = RNG(seed=[self._seed, epoch])
+            n = len(self.X)
+            k = rng.randint(len(self.offsets), size=n)
+            m = rng.rand(n) < 0.5 if self.mirror else np.zeros(n, dtype=bool)
+            augmentations = self._augmentations = (epoch, k, m)
+        return augmentations[1:]
+
+    def __len__(self):
+        return len(self.X)
+
+    def __getitem__(self, key):
+        X_b = np.asarray(self.X[key])
+        if self.im_shape is not None:
+            H, W, C = self.im_shape
+            X_b = X_b.reshape((-1, C, H, W)).transpose(0, 2, 3, 1)
+
+        n = len(X_b)
+        k, m = self._get_augmentations()
+        rows = np.arange(len(self.X))[key]
+        k, m = k[rows], m[rows]
+        Y = np.empty_like(X_b)
+        for i, offset in enumerate(self.offsets):
+            Y[k == i] = batch_shift(X_b[k == i], offset=offset)
+        Y[m] = batch_horizontal_mirror(Y[m])
+
+        if self.im_shape is not None:
+            Y = Y.transpose(0, 3, 1, 2).reshape((n, -1))
+        return Y
+
+
+if __name__ == '__main__':
+    # run corresponding tests
+    from testing import run_tests
+    run_tests(__file__)
@@ -2,18 +2,58 @@ import struct
 import pickle
 import os.path
 import numpy as np
-import matplotlib.pyplot as plt
 
 from rng import RNG
+from utils import LazyArray
 
 
-def load_mnist(mode='train', path='.'):
+def _save_atomic(filepath, x):
+    # write to temporary file and rename, so that an interrupted
+    # write never leaves a truncated file to be loaded later
+    tmp_filepath = filepath + '.tmp'
+    with open(tmp_filepath, 'wb') as f:
+        np.save(f, x)
+    os.rename(tmp_filepath, filepath)
+
+def _load_cached(load_raw, cache_prefix, cache=False):
+    """Load raw ('uint8') data and targets using `load_raw`, optionally
+    caching them into .npy files with `cache_prefix` on the first call,
+    and memory-mapping these files on later calls.
+    """
+    data_path = cache_prefix + '_data.npy'
+    target_path = cache_prefix + '_target.npy'
+    if cache and os.path.isfile(data_path) and os.path.isfile(target_path):
+        return np.load(data_path, mmap_mode='r'), np.load(target_path)
+    data, target = load_raw()
+    if cache:
+        _save_atomic(data_path, data)
+        _save_atomic(target_path, target)
+        data = np.load(data_path, mmap_mode='r')
+    return data, target
+
+def _convert(data, dtype=float, lazy=False):
+    if lazy:
+        return LazyArray(data, dtype=dtype)
+    return data.astype(dtype)
+
+def load_mnist(mode='train', path='.', cache=False, lazy=False, dtype=float):
     """
     Load and return MNIST dataset.
 
+    Parameters
+    ----------
+    cache : bool
+        Whether to convert raw files into binary ('uint8') .npy cache
+        on the first call, and memory-map it on later calls.
+    lazy : bool
+        If True, return `LazyArray` converting only the rows being
+        accessed to `dtype`, instead of converting the whole dataset.
+    dtype : np.dtype
+        Type of the returned data.
+
     Returns
     -------
-    data : (n_samples, 784) np.ndarray
+    data : (n_samples, 784) np.ndarray or LazyArray
         Data representing raw pixel intensities (in [0., 255.] range).
     target : (n_samples,) np.ndarray
         Labels vector (zero-based integers).
@@ -28,24 +68,32 @@ def load_mnist(mode='train', path='.'):
     else:
         raise ValueError("`mode` must be 'train' or 'test'")
 
-    with open(fname_data, 'rb') as fdata:
-        magic, n_samples, n_rows, n_cols = struct.unpack(">IIII", fdata.read(16))
-        data = np.fromfile(fdata, dtype=np.uint8)
-        data = data.reshape(n_samples, n_rows * n_cols)
+    def load_raw():
+        with open(fname_data, 'rb') as fdata:
+            magic, n_samples, n_rows, n_cols = struct.unpack(">IIII", fdata.read(16))
+            data = np.fromfile(fdata, dtype=np.uint8)
+            data = data.reshape(n_samples, n_rows * n_cols)
 
-    with open(fname_target, 'rb') as ftarget:
-        magic, n_samples = struct.unpack(">II", ftarget.read(8))
-        target = np.fromfile(ftarget, dtype=np.int8)
+        with open(fname_target, 'rb') as ftarget:
+            magic, n_samples = struct.unpack(">II", ftarget.read(8))
+            target = np.fromfile(ftarget, dtype=np.int8)
+        return data, target
 
-    return data.astype(float), target
+    data, target = _load_cached(load_raw, os.path.join(dirpath, mode), cache=cache)
+    return _convert(data, dtype=dtype, lazy=lazy), target
 
-def load_cifar10(mode='train', path='.'):
+def load_cifar10(mode='train', path='.', cache=False, lazy=False, dtype=float):
     """
     Load and return CIFAR-10 dataset.
 
+    Parameters
+    ----------
+    cache, lazy, dtype
+        Same semantics as for `load_mnist`.
+
     Returns
     -------
-    data : (n_samples, 3 * 32 * 32) np.ndarray
+    data : (n_samples, 3 * 32 * 32) np.ndarray or LazyArray
         Data representing raw pixel intensities (in [0., 255.] range).
     target : (n_samples,) np.ndarray
         Labels vector (zero-based integers).
@@ -58,18 +106,23 @@ def load_cifar10(mode='train', path='.'):
         fnames = ['test_batch']
     else:
         raise ValueError("`mode` must be 'train' or 'test'")
-    n_samples = batch_size * len(fnames)
-    data = np.zeros(shape=(n_samples, 3 * 32 * 32), dtype=float)
-    target = np.zeros(shape=(n_samples,), dtype=int)
-    start = 0
-    for fname in fnames:
-        fname = os.path.join(dirpath, fname)
-        with open(fname, 'rb') as fdata:
-            _data = pickle.load(fdata)
-            data[start:(start + batch_size)] = np.asarray(_data['data'])
-            target[start:(start + batch_size)] = np.asarray(_data['labels'])
-        start += 10000
-    return data, target
+
+    def load_raw():
+        n_samples = batch_size * len(fnames)
+        data = np.zeros(shape=(n_samples, 3 * 32 * 32), dtype=np.uint8)
+        target = np.zeros(shape=(n_samples,), dtype=int)
+        start = 0
+        for fname in fnames:
+            fname = os.path.join(dirpath, fname)
+            with open(fname, 'rb') as fdata:
+                _data = pickle.load(fdata)
+                data[start:(start + batch_size)] = np.asarray(_data['data'])
+                target[start:(start + batch_size)] = np.asarray(_data['labels'])
+            start += 10000
+        return data, target
+
+    data, target = _load_cached(load_raw, os.path.join(dirpath, mode), cache=cache)
+    return _convert(data, dtype=dtype, lazy=lazy), target
 
 def im_flatten(X):
     """Flatten batch of 3-channel images `X`
@@ -165,6 +218,8 @@ def get_cifar10_label(index):
 
 def plot_cifar10(X, y, samples_per_class=7,
                  title='CIFAR-10 dataset', title_params=None, imshow_params=None):
+    import matplotlib.pyplot as plt
+
     # check params
     title_params = title_params or {}
     title_params.setdefault('fontsize', 20)
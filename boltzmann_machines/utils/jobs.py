@@ -0,0 +1,77 @@
+import os
+import tensorflow as tf
+from multiprocessing import Pool, cpu_count
+
+
+# jobs are inherited by forked worker processes,
+# so that data (possibly memory-mapped) is not pickled
+_jobs = []
+
+def make_tf_session_config(n_threads):
+    """Create session config for TF to use (at most) `n_threads` threads."""
+    return tf.ConfigProto(intra_op_parallelism_threads=n_threads,
+                          inter_op_parallelism_threads=1)
+
+def _is_saved(model):
+    return os.path.isfile(model._params_filepath) and \
+           os.path.isfile(model._tf_meta_graph_filepath)
+
+def _run_job(i):
+    model, X, X_val, tf_session_config = _jobs[i]
+
+    # resume from `model_path` if the model has already been saved there
+    if _is_saved(model):
+        max_epoch = model.max_epoch
+        model = model.__class__.load_model(model._model_filepath)
+        model.max_epoch = max_epoch
+    model._tf_session_config = tf_session_config
+    if not model.initialized_ or model.epoch_ < model.max_epoch:
+        model.fit(X, X_val)
+    return model._model_filepath
+
+def run_jobs(jobs, n_jobs=None, n_threads=None):
+    """Fit independent models in parallel in a pool of processes.
+
+    Each job is run in a separate (forked) process, with
+    TF session limited to `n_threads` threads. Jobs, whose models
+    are already trained (saved in their `model_path` with `epoch_`
+    equal to `max_epoch`), are skipped, and partially trained
+    ones are resumed.
+
+    Note that no TF session should be created in the parent process
+    before calling this function, as TF runtime does not support fork.
+
+    Parameters
+    ----------
+    jobs : [(model, X, X_val)]
+        Models (e.g. `BaseRBM` instances), their training
+        and validation (can be None) data.
+    n_jobs : None or positive int
+        Number of processes, if None use number of CPUs.
+    n_threads : None or positive int
+        Number of threads per job, if None divide
+        CPUs evenly between processes.
+
+    Returns
+    -------
+    models : list
+        Trained models, loaded from their `model_path`.
+    """
+    global _jobs
+    n_jobs = n_jobs or cpu_count()
+    n_threads = n_threads or max(1, cpu_count() // n_jobs)
+    tf_session_config = make_tf_session_config(n_threads)
+    _jobs = [(model, X, X_val, tf_session_config) for model, X, X_val in jobs]
+
+    pool = Pool(processes=n_jobs, maxtasksperchild=1)
+    try:
+        model_filepaths = pool.map(_run_job, range(len(_jobs)), chunksize=1)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        _jobs = []
+    return [model.__class__.load_model(model_filepath)
+            for (model, _, _), model_filepath in zip(jobs, model_filepaths)]
@@ -0,0 +1,160 @@
+import os
+import json
+import numpy as np
+
+
+class MeanFieldCache(object):
+    """Per-example cache of variational parameters (converged mean-field
+    states of the hidden layers), indexed by example id, used to warm-start
+    mean-field updates for examples seen before.
+
+    Besides the states, the cache tracks hit rate (fraction of looked up
+    examples found in the cache) and number of mean-field updates per batch
+    for batches started entirely from scratch ("cold") and entirely from
+    cached states ("warm"). Hit rate and warm batches are counted since the
+    last `reset_stats` call (e.g. per epoch), cold batches since creation,
+    as these serve as a baseline.
+
+    States are only valid for the model (weights) and data they were
+    computed for. These are described by a `key`, stored on `flush`
+    (in a file alongside memory-mapped states), and `check_key`
+    invalidates all the states if the key does not match.
+
+    Parameters
+    ----------
+    n_samples : positive int
+        Number of examples, ids are in range [0, `n_samples`).
+    n_units : iterable of positive int
+        Number of units in each hidden layer.
+    dtype : str or np.dtype
+        Dtype of the stored states.
+    dirpath : None or str
+        If provided, states are kept in memory-mapped files in this
+        directory (and reused on next creation if shapes match and
+        the key is the same, see `check_key`), otherwise in host memory.
+
+    Examples
+    --------
+    >>> cache = MeanFieldCache(n_samples=4, n_units=[3])
+    >>> mu, cached = cache.get([0, 2])
+    >>> cached
+    array([False, False])
+    >>> cache.put([2], [np.ones((1, 3))])
+    >>> cache.add_n_mf_updates(10, cached)
+    >>> mu, cached = cache.get([0, 2])
+    >>> cached
+    array([False,  True])
+    >>> mu[0]
+    array([[ 0.,  0.,  0.],
+           [ 1.,  1.,  1.]], dtype=float32)
+    >>> cache.add_n_mf_updates(4, [True, True])
+    >>> sorted(cache.stats().items())
+    [('hit_rate', 0.25), ('n_mf_updates_cold', 10.0), ('n_mf_updates_saved', 6.0), ('n_mf_updates_warm', 4.0)]
+    >>> cache.flush(key={'iter': 1})
+    >>> cache.check_key({'iter': 1})
+    >>> cache.cached
+    array([False,  True])
+    >>> cache.check_key({'iter': 2})
+    >>> cache.cached
+    array([False, False])
+    """
+    def __init__(self, n_samples, n_units, dtype='float32', dirpath=None):
+        self.n_samples = n_samples
+        self.n_units = list(n_units)
+        self.dtype = np.dtype(dtype)
+        self.dirpath = dirpath
+        self.key = None
+        if self.dirpath is None:
+            self.mu = [np.zeros((self.n_samples, n), dtype=self.dtype) for n in self.n_units]
+            self.cached = np.zeros(self.n_samples, dtype=bool)
+        else:
+            if not os.path.exists(self.dirpath):
+                os.makedirs(self.dirpath)
+            self.cached = self._open_memmap('cached.npy', (self.n_samples,), np.bool_)
+            self.mu = [self._open_memmap('mu_{0}.npy'.format(i), (self.n_samples, n), self.dtype)
+                       for i, n in enumerate(self.n_units)]
+            if os.path.isfile(self._key_filepath):
+                with open(self._key_filepath, 'r') as f:
+                    self.key = json.load(f)
+        self._n_mf_updates_cold = []
+        self.reset_stats()
+
+    @property
+    def _key_filepath(self):
+        return os.path.join(self.dirpath, 'key.json')
+
+    def _open_memmap(self, filename, shape, dtype):
+        filepath = os.path.join(self.dirpath, filename)
+        if os.path.isfile(filepath):
+            X = np.lib.format.open_memmap(filepath, mode='r+')
+            if X.shape == shape and X.dtype == dtype:
+                return X
+            del X
+        X = np.lib.format.open_memmap(filepath, mode='w+', shape=shape, dtype=dtype)
+        if filename != 'cached.npy':
+            # states do not match the (new) mask, invalidate all of them
+            self.cached[:] = False
+        return X
+
+    def check_key(self, key):
+        """Invalidate all the states unless they were stored under `key`."""
+        if key != self.key:
+            self.cached[:] = False
+            self.key = key
+
+    def reset_stats(self):
+        self._n_lookups = 0
+        self._n_hits = 0
+        self._n_mf_updates_warm = []
+
+    def get(self, ids):
+        """Look up states of examples `ids`.
+
+        Returns
+        -------
+        mu : [(len(ids), n_units[i]) np.ndarray]
+            Cached states (zeros for examples not in the cache).
+        cached : (len(ids),) bool np.ndarray
+            Whether resp. example was found in the cache.
+        """
+        ids = np.asarray(ids)
+        cached = np.asarray(self.cached[ids])
+        self._n_lookups += len(ids)
+        self._n_hits += int(cached.sum())
+        return [np.asarray(M[ids]) for M in self.mu], cached
+
+    def put(self, ids, mu):
+        """Store states `mu` (one array per hidden layer) of examples `ids`."""
+        ids = np.asarray(ids)
+        for M, q in zip(self.mu, mu):
+            M[ids] = q
+        self.cached[ids] = True
+
+    def add_n_mf_updates(self, n_mf_updates, cached):
+        """Record number of mean-field updates done for a batch,
+        whose examples were found in the cache according to `cached`."""
+        cached = np.asarray(cached)
+        if cached.all():
+            self._n_mf_updates_warm.append(n_mf_updates)
+        elif not cached.any():
+            self._n_mf_updates_cold.append(n_mf_updates)
+
+    def stats(self):
+        """Hit rate and average number of mean-field updates per batch
+        (cold, warm and their difference), None if not available yet."""
+        cold = float(np.mean(self._n_mf_updates_cold)) if self._n_mf_updates_cold else None
+        warm = float(np.mean(self._n_mf_updates_warm)) if self._n_mf_updates_warm else None
+        return dict(hit_rate=float(self._n_hits) / self._n_lookups if self._n_lookups else None,
+                    n_mf_updates_cold=cold,
+                    n_mf_updates_warm=warm,
+                    n_mf_updates_saved=cold - warm if cold is not None and warm is not None else None)
+
+    def flush(self, key=None):
+        """Mark the states as stored under `key` and write them to disk
+        (if memory-mapped)."""
+        self.key = key
+        if self.dirpath is not None:
+            for M in self.mu + [self.cached]:
+                M.flush()
+            with open(self._key_filepath, 'w') as f:
+                json.dump(key, f)
@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+
+def _busy_time(intervals):
+    """Total length of the union of `intervals`
+    (ops of one scope may run concurrently).
+
+    Examples
+    --------
+    >>> _busy_time([(0, 10), (5, 15), (20, 25)])
+    20
+    >>> _busy_time([])
+    0
+    """
+    total, end = 0, None
+    for s, e in sorted(intervals):
+        if end is None or s > end:
+            total += e - s
+            end = e
+        elif e > end:
+            total += e - end
+            end = e
+    return total
+
+def _in_scope(node_name, scope):
+    return scope in node_name.split('/')
+
+
+class TFProfiler(object):
+    """Trace selected `session.run` calls with `FULL_TRACE` run options,
+    dump their Chrome-trace timelines (full and per name scope) and
+    aggregate per-scope wall time into a summary table.
+
+    Time outside of traced ops is attributed to "session overhead"
+    (time of `session.run` not covered by any op, e.g. feeding and
+    fetching) and "host loop" (time since previous `session.run`
+    returned, e.g. Python loop and batches preparation).
+
+    Parameters
+    ----------
+    dirpath : str
+        Where to write timelines and summary.
+    iters : positive int or iterable of int
+        If int, trace every `iters`-th step, otherwise trace these steps.
+    scopes : iterable of str
+        Name scopes to aggregate time for.
+    tag : str
+        Prefix of the written files, e.g. 'train' or 'transform'.
+    get_tf_writer : None or callable
+        If provided, run metadata of traced steps are also added
+        to the `tf.summary.FileWriter` it returns (to be displayed
+        in TensorBoard).
+    """
+    SCOPES = ('mean_field', 'gibbs_chain', 'grads_estimates', 'momentum_updates')
+
+    def __init__(self, dirpath, iters, scopes=SCOPES, tag='train', get_tf_writer=None):
+        self.dirpath = dirpath
+        self.iters = iters if isinstance(iters, (int, long)) else set(iters)
+        self.scopes = list(scopes)
+        self.tag = tag
+        self.get_tf_writer = get_tf_writer
+        self.records = []
+        self._last_end = None
+
+    def should_trace(self, step):
+        if isinstance(self.iters, (int, long)):
+            return step % self.iters == 0
+        return step in self.iters
+
+    def run(self, session, fetches, feed_dict=None, step=None):
+        t0 = time.time()
+        host_time = t0 - self._last_end if self._last_end is not None else None
+        if step is None or not self.should_trace(step):
+            res = session.run(fetches, feed_dict=feed_dict)
+            self._last_end = time.time()
+            return res
+        run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+        run_metadata = tf.RunMetadata()
+        res = session.run(fetches, feed_dict=feed_dict,
+                          options=run_options, run_metadata=run_metadata)
+        self._last_end = time.time()
+        self._add_step(step, run_metadata, 1e3 * (self._last_end - t0),
+                       1e3 * host_time if host_time is not None else None)
+        return res
+
+    def _add_step(self, step, run_metadata, wall_ms, host_ms):
+        if not os.path.exists(self.dirpath):
+            os.makedirs(self.dirpath)
+
+        # collect intervals of all ops, overall and per scope
+        intervals = []
+        scope_intervals = dict((scope, []) for scope in self.scopes)
+        other_intervals = []
+        for dev_stats in run_metadata.step_stats.dev_stats:
+            for ns in dev_stats.node_stats:
+                interval = (ns.all_start_micros, ns.all_start_micros + ns.all_end_rel_micros)
+                intervals.append(interval)
+                in_any_scope = False
+                for scope in self.scopes:
+                    if _in_scope(ns.node_name, scope):
+                        scope_intervals[scope].append(interval)
+                        in_any_scope = True
+                if not in_any_scope:
+                    other_intervals.append(interval)
+        ops_ms = 1e-3 * _busy_time(intervals)
+        record = dict(step=step, wall_ms=wall_ms, host_ms=host_ms,
+                      session_overhead_ms=max(wall_ms - ops_ms, 0.),
+                      other_ops_ms=1e-3 * _busy_time(other_intervals),
+                      scopes_ms=dict((scope, 1e-3 * _busy_time(v))
+                                     for scope, v in scope_intervals.items()))
+        self.records.append(record)
+
+        # write full timeline and timelines of ops within each scope
+        trace = json.loads(timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format())
+        prefix = os.path.join(self.dirpath, '{0}_{1}'.format(self.tag, step))
+        with open(prefix + '.ctf.json', 'w') as f:
+            json.dump(trace, f)
+        for scope in self.scopes:
+            events = [e for e in trace['traceEvents']
+                      if e.get('ph') == 'M' or _in_scope(e.get('args', {}).get('name', ''), scope)]
+            with open('{0}_{1}.ctf.json'.format(prefix, scope), 'w') as f:
+                json.dump(dict(trace, traceEvents=events), f)
+
+        if self.get_tf_writer is not None:
+            self.get_tf_writer().add_run_metadata(run_metadata, '{0}_{1}'.format(self.tag, step), step)
+
+    def summary(self):
+        """Per-scope time aggregated over traced steps.
+
+        Returns
+        -------
+        rows : [(str, float, float, float)]
+            Name, total time (ms), mean time per step (ms)
+            and percentage of the mean step time.
+        """
+        n = len(self.records)
+        if not n:
+            return []
+        rows = [(scope, [r['scopes_ms'][scope] for r in self.records]) for scope in self.scopes]
+        rows.append(('other ops', [r['other_ops_ms'] for r in self.records]))
+        rows.append(('session overhead', [r['session_overhead_ms'] for r in self.records]))
+        host = [r['host_ms'] for r in self.records if r['host_ms'] is not None]
+        if host:
+            rows.append(('host loop', host))
+        step_ms = sum(r['wall_ms'] for r in self.records) / n
+        if host:
+            step_ms += sum(host) / len(host)
+        return [(name, sum(v), sum(v) / len(v), 100. * sum(v) / len(v) / step_ms if step_ms else 0.)
+                for name, v in rows]
+
+    def format_summary(self):
+        lines = ['{0:<20} {1:>12} {2:>12} {3:>8}'.format('scope', 'total, ms', 'ms/step', '%')]
+        for name, total, per_step, percent in self.summary():
+            lines.append('{0:<20} {1:>12.2f} {2:>12.2f} {3:>8.1f}'.format(name, total, per_step, percent))
+        lines.append('({0} traced steps)'.format(len(self.records)))
+        return '\n'.join(lines)
+
+    def write_summary(self):
+        """Write summary table (as text and JSON) along with
+        per-step records, and return the text."""
+        if not self.records:
+            return None
+        s = self.format_summary()
+        prefix = os.path.join(self.dirpath, '{0}_summary'.format(self.tag))
+        with open(prefix + '.txt', 'w') as f:
+            f.write(s + '\n')
+        with open(prefix + '.json', 'w') as f:
+            json.dump(dict(summary=self.summary(), steps=self.records), f, indent=4, sort_keys=True)
+        return s
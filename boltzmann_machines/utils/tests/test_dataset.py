@@ -0,0 +1,52 @@
+import os
+import struct
+import numpy as np
+from shutil import rmtree
+from numpy.testing import assert_allclose
+
+from boltzmann_machines.utils import RNG, LazyArray
+from boltzmann_machines.utils.dataset import load_mnist
+
+
+class TestLoadMNIST(object):
+    def __init__(self):
+        self.path = 'test_dataset/'
+        self.data = RNG(seed=1337).randint(256, size=(10, 28 * 28)).astype(np.uint8)
+        self.target = RNG(seed=42).randint(10, size=10).astype(np.int8)
+
+    def setUp(self):
+        # write data in the original (idx) format
+        dirpath = os.path.join(self.path, 'mnist/')
+        os.makedirs(dirpath)
+        with open(os.path.join(dirpath, 'train-images-idx3-ubyte'), 'wb') as f:
+            f.write(struct.pack(">IIII", 2051, 10, 28, 28))
+            self.data.tofile(f)
+        with open(os.path.join(dirpath, 'train-labels-idx1-ubyte'), 'wb') as f:
+            f.write(struct.pack(">II", 2049, 10))
+            self.target.tofile(f)
+
+    def test_cache(self):
+        X, y = load_mnist(path=self.path)
+        assert X.dtype == np.float64
+        assert_allclose(X, self.data)
+        assert_allclose(y, self.target)
+
+        # first call creates cache, later ones memory-map it
+        for _ in xrange(2):
+            X, y = load_mnist(path=self.path, cache=True, dtype=np.float32)
+            assert X.dtype == np.float32
+            assert_allclose(X, self.data)
+            assert_allclose(y, self.target)
+        assert os.path.isfile(os.path.join(self.path, 'mnist/train_data.npy'))
+        assert not any(f.endswith('.tmp') for f in os.listdir(os.path.join(self.path, 'mnist/')))
+
+        X, _ = load_mnist(path=self.path, cache=True, lazy=True, dtype=np.float32)
+        assert isinstance(X, LazyArray)
+        assert isinstance(X.X, np.memmap)
+        assert X.shape == self.data.shape
+        assert X[2:5].dtype == np.float32
+        assert_allclose(X[2:5], self.data[2:5])
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            rmtree(self.path)
@@ -0,0 +1,52 @@
+import os
+import sys
+import subprocess
+from shutil import rmtree
+from numpy.testing import assert_allclose
+
+from boltzmann_machines.rbm import BernoulliRBM
+from boltzmann_machines.utils import RNG
+
+
+# TF runtime does not support fork, hence jobs are
+# launched from a fresh interpreter (w/o TF sessions created)
+RUN_JOBS_SCRIPT = """
+from boltzmann_machines.rbm import BernoulliRBM
+from boltzmann_machines.utils import RNG
+from boltzmann_machines.utils.jobs import run_jobs
+
+X = RNG(seed=1337).rand(16, 12)
+rbms = [BernoulliRBM(n_visible=12, n_hidden=8, max_epoch=2, verbose=False,
+                     random_seed=1337 + i, model_path='test_jobs_{0}/'.format(i))
+        for i in xrange(3)]
+run_jobs([(rbm, X, None) for rbm in rbms], n_jobs=2, n_threads=1)
+"""
+
+
+class TestRunJobs(object):
+    def __init__(self):
+        self.X = RNG(seed=1337).rand(16, 12)
+
+    def run_jobs(self):
+        subprocess.check_call([sys.executable, '-c', RUN_JOBS_SCRIPT])
+
+    def test_run_jobs(self):
+        self.run_jobs()
+        for i in xrange(3):
+            rbm = BernoulliRBM.load_model('test_jobs_{0}/'.format(i))
+            assert rbm.epoch_ == 2
+            rbm_serial = BernoulliRBM(n_visible=12, n_hidden=8, max_epoch=2, verbose=False,
+                                      random_seed=1337 + i, model_path='test_jobs_serial/')
+            rbm_serial.fit(self.X)
+            assert_allclose(rbm.get_tf_params(scope='weights')['W'],
+                            rbm_serial.get_tf_params(scope='weights')['W'], rtol=1e-5)
+
+        # completed jobs are not run again
+        mtime = os.path.getmtime('test_jobs_0/params.json')
+        self.run_jobs()
+        assert os.path.getmtime('test_jobs_0/params.json') == mtime
+
+    def tearDown(self):
+        for d in ('test_jobs_0/', 'test_jobs_1/', 'test_jobs_2/', 'test_jobs_serial/'):
+            if os.path.exists(d):
+                rmtree(d)
@@ -1,19 +1,152 @@
+import sys
+import threading
 import numpy as np
+from Queue import Queue, Full
+
 
-from tqdm import tqdm, tqdm_notebook
 def _is_in_ipython():
     try: __IPYTHON__; return True
     except NameError: return False
-progress_bar = tqdm_notebook if _is_in_ipython() else tqdm
+
+def progress_bar(*args, **kwargs):
+    # tqdm is imported on first use only
+    from tqdm import tqdm, tqdm_notebook
+    return (tqdm_notebook if _is_in_ipython() else tqdm)(*args, **kwargs)
 
 
 def write_during_training(s):
+    from tqdm import tqdm
     tqdm.write(s)
 
-def batch_iter(X, batch_size=10, verbose=False, desc='epoch'):
+class LazyArray(object):
+    """Array-like wrapper around (possibly memory-mapped) `X`,
+    that converts only the rows being accessed.
+
+    Parameters
+    ----------
+    X : array-like
+        Underlying data, e.g. `np.load(path, mmap_mode='r')`.
+    dtype : None or np.dtype
+        If provided, convert accessed rows to this dtype.
+    fn : None or callable
+        If provided, applied to (converted) accessed rows,
+        e.g. to scale or standardize them. Should preserve
+        the number of rows.
+
+    Examples
+    --------
+    >>> X = np.arange(12, dtype=np.uint8).reshape((4, 3))
+    >>> X_lazy = LazyArray(X, dtype=np.float32, fn=lambda x: x / 2.)
+    >>> X_lazy.shape
+    (4, 3)
+    >>> len(X_lazy)
+    4
+    >>> X_lazy[1:3]
+    array([[ 1.5,  2. ,  2.5],
+           [ 3. ,  3.5,  4. ]], dtype=float32)
+    >>> X_lazy[[3, 0]]
+    array([[ 4.5,  5. ,  5.5],
+           [ 0. ,  0.5,  1. ]], dtype=float32)
+    """
+    def __init__(self, X, dtype=None, fn=None):
+        self.X = X
+        self._dtype = dtype
+        self.fn = fn
+        x = self[:1]
+        self.dtype = x.dtype
+        self.shape = (len(X),) + x.shape[1:]
+
+    def __len__(self):
+        return len(self.X)
+
+    def __getitem__(self, key):
+        x = self.X[key]
+        if self._dtype is not None:
+            x = np.asarray(x, dtype=self._dtype)
+        if self.fn is not None:
+            x = self.fn(x)
+        return x
+
+    def __array__(self, dtype=None):
+        return np.asarray(self[:], dtype=dtype)
+
+    def set_epoch(self, epoch):
+        """Pass `epoch` to `X` if it depends on it
+        (see `augmentation.AugmentedArray`)."""
+        if hasattr(self.X, 'set_epoch'):
+            self.X.set_epoch(epoch)
+
+def prefetch_iter(gen, n_prefetch=1):
+    """Run generator `gen` in a background thread, keeping
+    up to `n_prefetch` items staged in a bounded queue.
+
+    Examples
+    --------
+    >>> for x in prefetch_iter(xrange(4), n_prefetch=2):
+    ...     print x
+    0
+    1
+    2
+    3
+    """
+    queue = Queue(maxsize=n_prefetch)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def worker():
+        try:
+            for item in gen:
+                if not put((item, None)):
+                    return
+        except Exception:
+            put((end, sys.exc_info()))
+            return
+        put((end, None))
+
+    thread = threading.Thread(target=worker)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item, exc_info = queue.get()
+            if item is end:
+                if exc_info is not None:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                break
+            yield item
+    finally:
+        # stop the worker if consumer is done early
+        stop.set()
+
+def batch_iter(X, batch_size=10, verbose=False, desc='epoch',
+               indices=None, n_prefetch=0, dtype=None, start_batch=0):
     """Divide input data into batches, with optional
     progress bar.
 
+    Parameters
+    ----------
+    indices : None or (N,) array-like
+        If provided, batches are formed from `X[indices]`
+        (e.g. random permutation for shuffling).
+    n_prefetch : non-negative int
+        If positive, batches are prepared in a background thread,
+        and up to this number of them are kept ready.
+    dtype : None or np.dtype
+        If provided, batches are converted to this dtype
+        (as part of the preparation).
+    start_batch : non-negative int
+        Index of the first batch to yield (e.g. to resume
+        an interrupted epoch).
+
     Examples
     --------
     >>> X = np.arange(36).reshape((12, 3))
@@ -31,14 +164,38 @@ def batch_iter(X, batch_size=10, verbose=False, desc='epoch'):
      [27 28 29]]
     [[30 31 32]
      [33 34 35]]
+    >>> X = np.arange(8).reshape((4, 2))
+    >>> for X_b in batch_iter(X, batch_size=3, indices=[3, 1, 0, 2], n_prefetch=2):
+    ...     print X_b
+    [[6 7]
+     [2 3]
+     [0 1]]
+    [[4 5]]
+    >>> for X_b in batch_iter(X, batch_size=3, indices=[3, 1, 0, 2], start_batch=1):
+    ...     print X_b
+    [[4 5]]
     """
-    X = np.asarray(X)
+    if isinstance(X, (list, tuple)):
+        X = np.asarray(X)
     N = len(X)
     n_batches = N / batch_size + (N % batch_size > 0)
-    gen = range(n_batches)
-    if verbose: gen = progress_bar(gen, leave=False, ncols=64, desc=desc)
-    for i in gen:
-        yield X[i*batch_size:(i + 1)*batch_size]
+
+    def make_batches():
+        for i in xrange(start_batch, n_batches):
+            if indices is None:
+                X_b = X[i*batch_size:(i + 1)*batch_size]
+            else:
+                X_b = X[indices[i*batch_size:(i + 1)*batch_size]]
+            if dtype is not None:
+                X_b = np.asarray(X_b, dtype=dtype)
+            yield X_b
+
+    gen = make_batches()
+    if n_prefetch > 0: gen = prefetch_iter(gen, n_prefetch=n_prefetch)
+    if verbose: gen = progress_bar(gen, total=n_batches, initial=start_batch,
+                                   leave=False, ncols=64, desc=desc)
+    for X_b in gen:
+        yield X_b
 
 def epoch_iter(start_epoch, max_epoch, verbose=False):
     gen = xrange(start_epoch + 1, max_epoch + 1)
@@ -36,6 +36,7 @@ print __doc__
 import os
 import argparse
 import numpy as np
+from functools import partial
 from keras import regularizers
 from keras.callbacks import EarlyStopping, ReduceLROnPlateau
 from keras.initializers import glorot_uniform
@@ -45,12 +46,14 @@ from sklearn.metrics import accuracy_score
 
 import env
 from boltzmann_machines import DBM
-from boltzmann_machines.rbm import GaussianRBM, MultinomialRBM
-from boltzmann_machines.utils import (RNG, Stopwatch,
+from boltzmann_machines.rbm import GaussianRBM, MultinomialRBM, StackedGaussianRBM
+from boltzmann_machines.utils import (RNG, Stopwatch, LazyArray, batch_iter,
                                       one_hot, one_hot_decision_function, unhot)
-from boltzmann_machines.utils.augmentation import shift, horizontal_mirror
+from boltzmann_machines.utils.augmentation import (batch_shift, batch_horizontal_mirror,
+                                                   AugmentedArray)
 from boltzmann_machines.utils.dataset import (load_cifar10,
                                               im_flatten, im_unflatten)
+from boltzmann_machines.utils.jobs import run_jobs
 from boltzmann_machines.utils.optimizers import MultiAdam
 
 
@@ -63,7 +66,7 @@ def make_augmentation(X_train, y_train, n_train, args):
     augment = True
     if os.path.isfile(X_aug_path):
         print "\nLoading augmented data ..."
-        X_aug = np.load(X_aug_path)
+        X_aug = np.load(X_aug_path, mmap_mode='r')
         print "Checking augmented data ..."
         if len(X_aug) == 10 * n_train:
             augment = False
@@ -72,43 +75,105 @@ def make_augmentation(X_train, y_train, n_train, args):
         print "\nAugmenting data ..."
         s = Stopwatch(verbose=True).start()
 
-        X_aug = np.zeros((10 * n_train, 32, 32, 3), dtype=np.float32)
-        X_train = im_unflatten(X_train)
-        X_aug[:n_train] = X_train
-        for i in xrange(n_train):
+        # write augmented images directly to disk, converted
+        # to 'uint8' type (and flattened) to save disk space and memory
+        X_aug = np.lib.format.open_memmap(X_aug_path, mode='w+', dtype=np.uint8,
+                                          shape=(10 * n_train, 3072))
+        to_uint8 = lambda X: (X * np.float32(255.)).transpose(0, 3, 1, 2) \
+                                                    .reshape((len(X), -1)).astype('uint8')
+        for X_b, start in zip(batch_iter(X_train, batch_size=1000),
+                              xrange(0, n_train, 1000)):
+            end = start + len(X_b)
+            X_b = X_b.reshape((-1, 3, 32, 32)).transpose(0, 2, 3, 1).astype(np.float32)
+            X_aug[start:end] = to_uint8(X_b)
+            X_aug[5 * n_train + start:5 * n_train + end] = to_uint8(batch_horizontal_mirror(X_b))
             for k, offset in enumerate((
                     ( 1,  0),
                     (-1,  0),
                     ( 0,  1),
                     ( 0, -1)
             )):
-                img = X_train[i].copy()
-                X_aug[(k + 1) * n_train + i] = shift(img, offset=offset)
-        for i in xrange(5 * n_train):
-            X_aug[5 * n_train + i] = horizontal_mirror(X_aug[i].copy())
+                X_shifted = batch_shift(X_b, offset=offset)
+                X_aug[(k + 1) * n_train + start:(k + 1) * n_train + end] = to_uint8(X_shifted)
+                X_aug[(k + 6) * n_train + start:(k + 6) * n_train + end] = \
+                    to_uint8(batch_horizontal_mirror(X_shifted))
 
         # shuffle once again
         RNG(seed=1337).shuffle(X_aug)
 
-        # convert to 'uint8' type to save disk space
-        X_aug *= 255.
-        X_aug = X_aug.astype('uint8')
-
-        # flatten to (10 * `n_train`, 3072) shape
-        X_aug = im_flatten(X_aug)
-
-        # save to disk
-        np.save(X_aug_path, X_aug)
+        # flush to disk and reopen read-only
+        X_aug.flush()
+        del X_aug
+        X_aug = np.load(X_aug_path, mmap_mode='r')
 
         s.elapsed()
         print "\n"
 
     return X_aug, y_train
 
-def make_small_rbms((X_train, X_val), args):
-    X_train = im_unflatten(X_train)
-    X_val = im_unflatten(X_val)
+def extract_patches(X, i, j, size=8):
+    """Extract `size` x `size` patches at (`i`, `j`) from flattened images."""
+    X = X.reshape((-1, 3, 32, 32))[:, :, i:(i + size), j:(j + size)]
+    return X.reshape((len(X), -1))
+
+def downsample(X):
+    """Downsample flattened images to 8 x 8 by averaging."""
+    X = X.reshape((-1, 3, 4, 8, 4, 8)).mean(axis=4).mean(axis=2)  # (N, 3, 8, 8)
+    return X.reshape((len(X), -1))
+
+def extract_all_patches(X):
+    """Extract inputs for all 26 small RBMs, in the same
+    order as they are used in `make_large_weights`."""
+    patches = [extract_patches(X, i=8 * i, j=8 * j) for i in xrange(4) for j in xrange(4)]
+    patches += [extract_patches(X, i=4 + 8 * i, j=4 + 8 * j) for i in xrange(3) for j in xrange(3)]
+    patches += [downsample(X)]
+    return np.stack(patches, axis=1)  # (N, 26, 8*8*3)
+
+def make_small_rbms_stacked((X_train, X_val), small_rbm_config, args):
+    rbm_dirpaths = [args.small_dirpath_prefix + str(rbm_id) + '/' for rbm_id in xrange(26)]
+    if all(os.path.isdir(rbm_dirpath) for rbm_dirpath in rbm_dirpaths):
+        print "\nLoading small RBMs ...\n\n"
+        return [GaussianRBM.load_model(rbm_dirpath) for rbm_dirpath in rbm_dirpaths]
+
+    stacked_dirpath = args.small_dirpath_prefix + 'stacked/'
+    if os.path.isdir(stacked_dirpath):
+        print "\nLoading stacked small RBMs ...\n\n"
+        stacked_rbm = StackedGaussianRBM.load_model(stacked_dirpath)
+    else:
+        config = dict(small_rbm_config)
+        config.update(display_filters=0, display_hidden_activations=0)
+        stacked_rbm = StackedGaussianRBM(n_models=26,
+                                         random_seed=args.small_random_seed,
+                                         model_path=stacked_dirpath,
+                                         **config)
+
+    # train (or continue training) all 26 small RBMs at once
+    print "\nTraining small RBMs ...\n\n"
+    X_patches = LazyArray(X_train, fn=extract_all_patches)
+    X_patches_val = extract_all_patches(X_val)
+    stacked_rbm.fit(X_patches, X_patches_val)
+    return stacked_rbm.unstack(rbm_dirpaths)
+
+def make_small_rbms_parallel((X_train, X_val), small_rbm_config, args):
+    # (i, j) offsets of patches, as in `make_small_rbms`, None for downsampled images
+    patches = [(8 * i, 8 * j) for i in xrange(4) for j in xrange(4)]
+    patches += [(4 + 8 * i, 4 + 8 * j) for i in xrange(3) for j in xrange(3)]
+    patches += [None]
+
+    jobs = []
+    for rbm_id, patch in enumerate(patches):
+        fn = downsample if patch is None else partial(extract_patches, i=patch[0], j=patch[1])
+        rbm_seed = (args.small_random_seed if 16 <= rbm_id < 25 else 9000) + rbm_id
+        rbm = GaussianRBM(random_seed=rbm_seed,
+                          model_path=args.small_dirpath_prefix + str(rbm_id) + '/',
+                          **small_rbm_config)
+        jobs.append((rbm, LazyArray(X_train, fn=fn), fn(X_val)))
+
+    # train (or continue training) small RBMs in a pool of processes
+    print "\nTraining small RBMs in {0} processes ...\n\n".format(args.small_n_jobs)
+    return run_jobs(jobs, n_jobs=args.small_n_jobs)
 
+def make_small_rbms((X_train, X_val), args):
     small_rbm_config = dict(n_visible=8 * 8 * 3,
                             n_hidden=300,
                             sigma=1.,
@@ -138,8 +203,13 @@ def make_small_rbms((X_train, X_val), args):
                             display_filters=12,
                             display_hidden_activations=36,
                             v_shape=(8, 8, 3),
+                            n_prefetch_batches=args.n_prefetch_batches,
                             dtype='float32',
                             tf_saver_params=dict(max_to_keep=1))
+    if args.small_stacked:
+        return make_small_rbms_stacked((X_train, X_val), small_rbm_config, args)
+    if args.small_n_jobs > 1:
+        return make_small_rbms_parallel((X_train, X_val), small_rbm_config, args)
     small_rbms = []
 
     # first 16 ...
@@ -153,12 +223,8 @@ def make_small_rbms((X_train, X_val), args):
                 rbm = GaussianRBM.load_model(rbm_dirpath)
             else:
                 print "\nTraining small RBM #{0} ...\n\n".format(rbm_id)
-                X_patches = X_train[:, 8 * i:8 * (i + 1),
-                                       8 * j:8 * (j + 1), :]
-                X_patches_val = X_val[:, 8 * i:8 * (i + 1),
-                                         8 * j:8 * (j + 1), :]
-                X_patches = im_flatten(X_patches)
-                X_patches_val = im_flatten(X_patches_val)
+                X_patches = LazyArray(X_train, fn=partial(extract_patches, i=8 * i, j=8 * j))
+                X_patches_val = extract_patches(X_val, i=8 * i, j=8 * j)
 
                 rbm = GaussianRBM(random_seed=9000 + rbm_id,
                                   model_path=rbm_dirpath,
@@ -177,12 +243,8 @@ def make_small_rbms((X_train, X_val), args):
                 rbm = GaussianRBM.load_model(rbm_dirpath)
             else:
                 print "\nTraining small RBM #{0} ...\n\n".format(rbm_id)
-                X_patches = X_train[:, 4 + 8 * i:4 + 8 * (i + 1),
-                                       4 + 8 * j:4 + 8 * (j + 1), :]
-                X_patches_val = X_val[:, 4 + 8 * i:4 + 8 * (i + 1),
-                                         4 + 8 * j:4 + 8 * (j + 1), :]
-                X_patches = im_flatten(X_patches)
-                X_patches_val = im_flatten(X_patches_val)
+                X_patches = LazyArray(X_train, fn=partial(extract_patches, i=4 + 8 * i, j=4 + 8 * j))
+                X_patches_val = extract_patches(X_val, i=4 + 8 * i, j=4 + 8 * j)
 
                 rbm = GaussianRBM(random_seed=args.small_random_seed + rbm_id,
                                   model_path=rbm_dirpath,
@@ -199,17 +261,8 @@ def make_small_rbms((X_train, X_val), args):
         rbm = GaussianRBM.load_model(rbm_dirpath)
     else:
         print "\nTraining small RBM #{0} ...\n\n".format(rbm_id)
-        X_patches = X_train.copy()  # (N, 32, 32, 3)
-        X_patches = X_patches.transpose(0, 3, 1, 2)  # (N, 3, 32, 32)
-        X_patches = X_patches.reshape((-1, 3, 4, 8, 4, 8)).mean(axis=4).mean(axis=2)  # (N, 3, 8, 8)
-        X_patches = X_patches.transpose(0, 2, 3, 1)  # (N, 8, 8, 3)
-        X_patches = im_flatten(X_patches)  # (N, 8*8*3)
-
-        X_patches_val = X_val.copy()
-        X_patches_val = X_patches_val.transpose(0, 3, 1, 2)
-        X_patches_val = X_patches_val.reshape((-1, 3, 4, 8, 4, 8)).mean(axis=4).mean(axis=2)
-        X_patches_val = X_patches_val.transpose(0, 2, 3, 1)
-        X_patches_val = im_flatten(X_patches_val)
+        X_patches = LazyArray(X_train, fn=downsample)  # (N, 8*8*3)
+        X_patches_val = downsample(X_val)
 
         rbm = GaussianRBM(random_seed=9000 + rbm_id,
                           model_path=rbm_dirpath,
@@ -227,7 +280,7 @@ def make_large_weights(small_rbms):
     for i in xrange(4):
         for j in xrange(4):
             rbm_id = 4 * i + j
-            weights = small_rbms[rbm_id].get_tf_params(scope='weights')
+            weights = small_rbms[rbm_id].read_tf_params(scopes='weights')
             W_small = weights['W']
             W_small = W_small.T  # (300, 192)
             W_small = im_unflatten(W_small)  # (300, 8, 8, 3)
@@ -240,7 +293,7 @@ def make_large_weights(small_rbms):
     for i in xrange(3):
         for j in xrange(3):
             rbm_id = 16 + 3 * i + j
-            weights = small_rbms[rbm_id].get_tf_params(scope='weights')
+            weights = small_rbms[rbm_id].read_tf_params(scopes='weights')
             W_small = weights['W']
             W_small = W_small.T
             W_small = im_unflatten(W_small)
@@ -250,7 +303,7 @@ def make_large_weights(small_rbms):
                4 + 8 * j:4 + 8 * (j + 1), :] += im_unflatten(weights['vb'])
             hb[300 * rbm_id: 300 * (rbm_id + 1)] = weights['hb']
 
-    weights = small_rbms[25].get_tf_params(scope='weights')
+    weights = small_rbms[25].read_tf_params(scopes='weights')
     W_small = weights['W']
     W_small = W_small.T
     W_small = im_unflatten(W_small)
@@ -314,6 +367,7 @@ def make_grbm((X_train, X_val), small_rbms, args):
                            display_hidden_activations=36,
                            v_shape=(32, 32, 3),
                            random_seed=args.random_seed[0],
+                           n_prefetch_batches=args.n_prefetch_batches,
                            dtype='float32',
                            tf_saver_params=dict(max_to_keep=1),
                            model_path=args.grbm_dirpath)
@@ -389,6 +443,9 @@ def make_dbm((X_train, X_val), rbms, (Q, G), args):
         print "\nLoading DBM ...\n\n"
         dbm = DBM.load_model(args.dbm_dirpath)
         dbm.load_rbms(rbms)  # !!!
+        if dbm.batch_offset_ or dbm.epoch_ < dbm.max_epoch:
+            print "\nResuming DBM training from epoch {0} ...\n\n".format(dbm.epoch_)
+            dbm.fit(X_train, X_val)
     else:
         print "\nTraining DBM ...\n\n"
         dbm = DBM(rbms=rbms,
@@ -399,6 +456,7 @@ def make_dbm((X_train, X_val), rbms, (Q, G), args):
                   n_gibbs_steps=args.n_gibbs_steps[2],
                   max_mf_updates=args.max_mf_updates,
                   mf_tol=args.mf_tol,
+                  mf_cache=args.mf_cache,
                   learning_rate=np.geomspace(args.lr[2], 1e-6, args.epochs[2]),
                   momentum=np.geomspace(0.5, 0.9, 10),
                   max_epoch=args.epochs[2],
@@ -417,8 +475,10 @@ def make_dbm((X_train, X_val), rbms, (Q, G), args):
                   display_filters=12,
                   display_particles=36,
                   v_shape=(32, 32, 3),
+                  n_prefetch_batches=args.n_prefetch_batches,
                   dtype='float32',
                   tf_saver_params=dict(max_to_keep=1),
+                  checkpoint_every_sec=args.dbm_checkpoint_every_sec,
                   model_path=args.dbm_dirpath)
         dbm.fit(X_train, X_val)
     return dbm
@@ -491,6 +551,13 @@ def main():
                         help='directory for storing augmented data etc.')
     parser.add_argument('--no-aug', action='store_true',
                         help="if enabled, don't augment data")
+    parser.add_argument('--online-aug', action='store_true',
+                        help="if enabled, augment training batches on the fly (with fresh " + \
+                             "shifts/mirrors each epoch) instead of precomputing them")
+    parser.add_argument('--aug-random-seed', type=int, default=1337, metavar='N',
+                        help='random seed for on the fly augmentation')
+    parser.add_argument('--n-prefetch-batches', type=int, default=4, metavar='N',
+                        help='number of input batches prepared in background for training')
 
     # small RBMs related
     parser.add_argument('--small-lr', type=float, default=1e-3, metavar='LR', nargs='+',
@@ -507,6 +574,10 @@ def main():
                         help='controls the amount of sparsity penalty')
     parser.add_argument('--small-random-seed', type=int, default=9000, metavar='N',
                         help="random seeds for models training")
+    parser.add_argument('--small-stacked', action='store_true',
+                        help='if enabled, train all small RBMs at once, as a single stacked model')
+    parser.add_argument('--small-n-jobs', type=int, default=1, metavar='N',
+                        help='number of processes to train small RBMs in parallel (on CPU)')
     parser.add_argument('--small-dirpath-prefix', type=str, default='../models/rbm_cifar_small_', metavar='PREFIX',
                         help='directory path prefix to save RBMs trained on patches')
 
@@ -522,8 +593,7 @@ def main():
     parser.add_argument('--epochs', type=int, default=(64, 33, 100), metavar='N', nargs='+',
                         help='number of epochs to train')
     parser.add_argument('--batch-size', type=int, default=(100, 100, 100), metavar='B', nargs='+',
-                        help='input batch size for training, `--n-train` and `--n-val`' + \
-                             'must be divisible by this number (for DBM)')
+                        help='input batch size for training')
     parser.add_argument('--l2', type=float, default=(1e-3, 0.005, 0.), metavar='L2', nargs='+',
                         help='L2 weight decay coefficients')
     parser.add_argument('--random-seed', type=int, default=(1111, 2222, 3333), metavar='N', nargs='+',
@@ -536,6 +606,9 @@ def main():
                         help='directory path to save Multinomial RBM')
     parser.add_argument('--dbm-dirpath', type=str, default='../models/dbm_cifar/', metavar='DIRPATH',
                         help='directory path to save DBM')
+    parser.add_argument('--dbm-checkpoint-every-sec', type=float, default=600., metavar='T',
+                        help='save DBM checkpoint (incl. position within epoch) every T seconds, ' + \
+                             'interrupted training is resumed from it on the next run')
 
     # DBM related
     parser.add_argument('--n-particles', type=int, default=100, metavar='M',
@@ -544,6 +617,10 @@ def main():
                         help='maximum number of mean-field updates per weight update')
     parser.add_argument('--mf-tol', type=float, default=1e-11, metavar='TOL',
                         help='mean-field tolerance')
+    parser.add_argument('--mf-cache', type=str, default=None, choices=('memory', 'mmap'),
+                        help='warm-start mean-field from cached per-example states '
+                             '(kept in memory or in memory-mapped files); '
+                             'incompatible with --online-aug')
     parser.add_argument('--max-norm', type=float, default=4., metavar='C',
                         help='maximum norm constraint')
     parser.add_argument('--sparsity-target', type=float, default=(0.2, 0.2), metavar='T', nargs='+',
@@ -573,6 +650,9 @@ def main():
 
     # parse and check params
     args = parser.parse_args()
+    if args.mf_cache and args.online_aug and not args.no_aug:
+        parser.error('--mf-cache cannot be used with --online-aug '
+                     '(augmented examples change every epoch)')
     os.environ['CUDA_VISIBLE_DEVICES'] = args.gpu
     for x, m in (
         (args.n_gibbs_steps, 3),
@@ -587,8 +667,7 @@ def main():
 
     # prepare data (load + scale + split)
     print "\nPreparing data ..."
-    X, y = load_cifar10(mode='train', path=args.data_path)
-    X = X.astype(np.float32)
+    X, y = load_cifar10(mode='train', path=args.data_path, cache=True, dtype=np.float32)
     X /= 255.
     RNG(seed=42).shuffle(X)
     RNG(seed=42).shuffle(y)
@@ -599,44 +678,71 @@ def main():
     y_train = y[:n_train]
     y_val = y[-n_val:]
 
-    if not args.no_aug:
-        # augment data
+    if not args.no_aug and args.online_aug:
+        # center and normalize using statistics of original data
+        # (shifts and mirrors do not change them considerably)
+        X_mean = X_train.mean(axis=0)
+        X_std = X_train.std(axis=0)
+        standardize = lambda X: (X - X_mean) / X_std
+
+        # models are trained on randomly augmented batches, prepared
+        # in background (along with prefetching), other computations
+        # (features extraction etc.) are done on original data
+        X_fit = LazyArray(AugmentedArray(X_train, im_shape=(32, 32, 3),
+                                         random_seed=args.aug_random_seed),
+                          fn=standardize)
+        X_train = standardize(X_train)
+    elif not args.no_aug:
+        # augment data (memory-mapped 'uint8' array)
         X_aug, y_train = make_augmentation(X_train, y_train, n_train, args)
+        print "Augmented shape: {0}".format(X_aug.shape)
 
-        # convert + scale augmented data again
-        X_train = X_aug.astype(np.float32)
-        X_train /= 255.
-        print "Augmented shape: {0}".format(X_train.shape)
-        print "Augmented range: {0}".format((X_train.min(), X_train.max()))
-
-    # center and normalize training data
-    X_mean = X_train.mean(axis=0)
-    X_std = X_train.std(axis=0)
-
-    if not args.no_aug:
+        # compute statistics for centering and normalization
+        # (by batches, w/o loading augmented data into memory)
         mean_path = os.path.join(args.data_path, 'X_aug_mean.npy')
         std_path = os.path.join(args.data_path, 'X_aug_std.npy')
-        if not os.path.isfile(mean_path):
+        if os.path.isfile(mean_path) and os.path.isfile(std_path):
+            X_mean = np.load(mean_path)
+            X_std = np.load(std_path)
+        else:
+            S1 = np.zeros(X_aug.shape[1])
+            S2 = np.zeros(X_aug.shape[1])
+            for X_b in batch_iter(X_aug, batch_size=10000):
+                X_b = X_b / 255.
+                S1 += X_b.sum(axis=0)
+                S2 += np.square(X_b).sum(axis=0)
+            X_mean = S1 / len(X_aug)
+            X_std = np.sqrt(S2 / len(X_aug) - np.square(X_mean))
+            X_mean = X_mean.astype(np.float32)
+            X_std = X_std.astype(np.float32)
             np.save(mean_path, X_mean)
-        if not os.path.isfile(std_path):
             np.save(std_path, X_std)
 
-    X_train -= X_mean
-    X_train /= X_std
+        # convert, scale, center and normalize training data
+        # lazily, only for the batches being consumed
+        X_train = X_fit = LazyArray(X_aug, dtype=np.float32,
+                                    fn=lambda X: (X / np.float32(255.) - X_mean) / X_std)
+    else:
+        # center and normalize training data
+        X_mean = X_train.mean(axis=0)
+        X_std = X_train.std(axis=0)
+        X_train -= X_mean
+        X_train /= X_std
+        X_fit = X_train
+
     X_val -= X_mean
     X_val /= X_std
-    print "Augmented mean: ({0:.3f}, ...); std: ({1:.3f}, ...)".format(X_train.mean(axis=0)[0],
-                                                                       X_train.std(axis=0)[0])
-    print "Augmented range: ({0:.3f}, {1:.3f})\n\n".format(X_train.min(), X_train.max())
+    print "Standardized (first batch) mean: ({0:.3f}, ...); std: ({1:.3f}, ...)" \
+          .format(X_train[:10000].mean(axis=0)[0], X_train[:10000].std(axis=0)[0])
 
     # train 26 small Gaussian RBMs on patches
     small_rbms = None
     if not os.path.isdir(args.grbm_dirpath):
-        small_rbms = make_small_rbms((X_train, X_val), args)
+        small_rbms = make_small_rbms((X_fit, X_val), args)
 
     # assemble large weight matrix and biases
     # and pre-train large Gaussian RBM (G-RBM)
-    grbm = make_grbm((X_train, X_val), small_rbms, args)
+    grbm = make_grbm((X_fit, X_val), small_rbms, args)
 
     # extract features Q = p_{G-RBM}(h|v=X)
     print "\nExtracting features from G-RBM ...\n\n"
@@ -660,10 +766,10 @@ def main():
         G = make_rbm_transform(mrbm, Q, G_path)
 
     # jointly train DBM
-    dbm = make_dbm((X_train, X_val), (grbm, mrbm), (Q, G), args)
+    dbm = make_dbm((X_fit, X_val), (grbm, mrbm), (Q, G), args)
 
     # load test data
-    X_test, y_test = load_cifar10(mode='test', path=args.data_path)
+    X_test, y_test = load_cifar10(mode='test', path=args.data_path, cache=True)
     X_test /= 255.
     X_test -= X_mean
     X_test /= X_std
@@ -679,7 +785,8 @@ def main():
         W = weights['W']
         hb = weights['hb']
 
-    make_mlp((X_train, y_train), (X_val, y_val), (X_test, y_test),
+    # Keras needs training data in memory
+    make_mlp((np.asarray(X_train), y_train), (X_val, y_val), (X_test, y_test),
              (W, hb), args)
 
 
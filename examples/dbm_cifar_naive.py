@@ -280,8 +280,7 @@ def main():
     parser.add_argument('--epochs', type=int, default=(120, 180, 1500), metavar='N', nargs='+',
                         help='number of epochs to train')
     parser.add_argument('--batch-size', type=int, default=(100, 100, 100), metavar='B', nargs='+',
-                        help='input batch size for training, `--n-train` and `--n-val`' + \
-                             'must be divisible by this number (for DBM)')
+                        help='input batch size for training')
     parser.add_argument('--l2', type=float, default=(0.01, 0.05, 1e-8), metavar='L2', nargs='+',
                         help='L2 weight decay coefficients')
     parser.add_argument('--random-seed', type=int, default=(1337, 1111, 2222), metavar='N', nargs='+',
@@ -339,8 +338,7 @@ def main():
 
     # prepare data (load + scale + split)
     print "\nPreparing data ..."
-    X, y = load_cifar10(mode='train', path=args.data_path)
-    X = X.astype(np.float32)
+    X, y = load_cifar10(mode='train', path=args.data_path, cache=True, dtype=np.float32)
     X /= 255.
     RNG(seed=42).shuffle(X)
     RNG(seed=42).shuffle(y)
@@ -401,7 +399,7 @@ def main():
     dbm = make_dbm((X_train, X_val), (grbm, mrbm), (Q, G), args)
 
     # load test data
-    X_test, y_test = load_cifar10(mode='test', path=args.data_path)
+    X_test, y_test = load_cifar10(mode='test', path=args.data_path, cache=True)
     X_test /= 255.
     X_test -= X_s_mean
     X_test /= X_s_std
@@ -252,8 +252,7 @@ def main():
     parser.add_argument('--epochs', type=int, default=(64, 120, 500), metavar='N', nargs='+',
                         help='number of epochs to train')
     parser.add_argument('--batch-size', type=int, default=(48, 48, 100), metavar='B', nargs='+',
-                        help='input batch size for training, `--n-train` and `--n-val`' + \
-                             'must be divisible by this number (for DBM)')
+                        help='input batch size for training')
     parser.add_argument('--l2', type=float, default=(1e-3, 2e-4, 1e-7), metavar='L2', nargs='+',
                         help='L2 weight decay coefficients')
     parser.add_argument('--random-seed', type=int, default=(1337, 1111, 2222), metavar='N', nargs='+',
@@ -318,7 +317,7 @@ def main():
 
     # prepare data (load + scale + split)
     print "\nPreparing data ...\n\n"
-    X, y = load_mnist(mode='train', path='../data/')
+    X, y = load_mnist(mode='train', path='../data/', cache=True)
     X /= 255.
     RNG(seed=42).shuffle(X)
     RNG(seed=42).shuffle(y)
@@ -354,7 +353,7 @@ def main():
     dbm = make_dbm((X_train, X_val), (rbm1, rbm2), (Q, G), args)
 
     # load test data
-    X_test, y_test = load_mnist(mode='test', path='../data/')
+    X_test, y_test = load_mnist(mode='test', path='../data/', cache=True)
     X_test /= 255.
 
     # discriminative fine-tuning: initialize MLP with
@@ -205,7 +205,7 @@ def main():
 
     # prepare data (load + scale + split)
     print "\nPreparing data ...\n\n"
-    X, y = load_mnist(mode='train', path=args.data_path)
+    X, y = load_mnist(mode='train', path=args.data_path, cache=True)
     X /= 255.
     RNG(seed=42).shuffle(X)
     RNG(seed=42).shuffle(y)
@@ -220,7 +220,7 @@ def main():
     rbm = make_rbm(X_train, X_val, args)
 
     # load test data
-    X_test, y_test = load_mnist(mode='test', path=args.data_path)
+    X_test, y_test = load_mnist(mode='test', path=args.data_path, cache=True)
     X_test /= 255.
 
     # discriminative fine-tuning: initialize MLP with